@@ -0,0 +1,83 @@
+"""N single transaction messages versus one N-line message through
+MessageHandler, with the real pool and commit scheduler underneath.
+
+    python3 -m benchmarks.batch [lines] [rounds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import types
+
+config = types.ModuleType("src.config")
+config.ADMIN_ID = 0
+sys.modules.setdefault("src.config", config)
+
+from src.bot import MessageHandler
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+
+class Replies:
+    def __init__(self):
+        self.sent = 0
+
+    async def reply(self, message, text, **kwargs):
+        self.sent += 1
+
+
+def message(user, text):
+    return types.SimpleNamespace(text=text, message_id=1,
+            from_user=types.SimpleNamespace(id=user),
+            chat=types.SimpleNamespace(id=user))
+
+
+async def main(lines, rounds):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                data = UsersData()
+                await data.init(pool)
+                commits = CommitScheduler()
+                await commits.init(tg, pool)
+                replies = Replies()
+                bot = MessageHandler()
+                await bot.init(tg, data, commits, replies)
+
+                await bot.start_message(message(1, "/start"))
+                for text in ["доб кат еда", "доб кат дом", "доб счет карта"]:
+                    await bot.reply_message(message(1, text))
+
+                texts = [f"{i % 500},5 {'еда' if i % 2 else 'дом'} карта"
+                         for i in range(lines)]
+
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for text in texts:
+                        await bot.reply_message(message(1, text))
+                single = (time.perf_counter() - start) / rounds
+
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    await bot.reply_message(message(1, "\n".join(texts)))
+                batch = (time.perf_counter() - start) / rounds
+
+                await commits.close()
+        finally:
+            await pool.close()
+
+    print(f"{lines} single messages: {single * 1000:.1f} ms, "
+          f"one {lines}-line message: {batch * 1000:.1f} ms "
+          f"({single / batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    lines = args[0] if args else 50
+    rounds = args[1] if len(args) > 1 else 5
+    asyncio.run(main(lines, rounds))
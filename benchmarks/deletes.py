@@ -0,0 +1,161 @@
+"""Latency of other users' writes while one user deletes a category with
+a million transactions, the old inline DELETE against tombstone + reaper.
+
+    python3 -m benchmarks.deletes --rows 1000000 --users 20
+
+Light users each add a transaction, wait for its commit and read their
+balance in a loop. Their latency is measured with nobody deleting, then
+while the heavy category goes in one DELETE as delete_category used to
+do it, then while a tombstone is reaped in chunks. Exits with an error if
+the p99 during reaping is more than --max-ratio times the idle p99.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.load import percentile
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+from src.reaper import Reaper
+
+HEAVY = 1
+SEED_BATCH = 50_000
+
+
+async def seed(data, commits, rows, users):
+    rnd = random.Random(0)
+    for user in range(HEAVY, users + 2):
+        await data.add_user(user)
+        await data.add_category(user, "food")
+        await data.add_account(user, "card")
+    category_id = await data.get_category_id(HEAVY, "food")
+    account_id = await data.get_account_id(HEAVY, "card")
+
+    for start in range(0, rows, SEED_BATCH):
+        await data.add_transactions(HEAVY, [
+                (rnd.randint(-5000, 5000), category_id, account_id,
+                 f"{2015 + rnd.randrange(10)}-{rnd.randint(1, 12):02}-{rnd.randint(1, 28):02}")
+                for _ in range(min(SEED_BATCH, rows - start))])
+        await commits.commit()
+    return category_id
+
+
+async def delete_inline(pool, user_id, category_id):
+    """delete_category as it was before tombstones."""
+    async with pool.write() as cur:
+        await cur.execute("""UPDATE account_balances SET total = total - coalesce(
+                (SELECT sum(amount) FROM transactions
+                    WHERE category_id = ?
+                        AND transactions.account_id = account_balances.account_id), 0)
+                WHERE owner_id = ?""",
+                (category_id, user_id))
+        await cur.execute("""DELETE FROM transactions WHERE category_id = ?""",
+                (category_id,))
+        await cur.execute("""DELETE FROM categories WHERE category_id = ?""",
+                (category_id,))
+        await cur.execute("""DELETE FROM daily_totals
+                WHERE (owner_id, category_id) = (?, ?)""",
+                (user_id, category_id))
+
+
+async def clients(data, commits, users, done):
+    latencies = []
+
+    async def client(user):
+        category_id = await data.get_category_id(user, "food")
+        account_id = await data.get_account_id(user, "card")
+        while not done.is_set():
+            start = time.perf_counter()
+            await data.add_transaction(user, 10, category_id, account_id)
+            await commits.commit()
+            await data.get_balance(user)
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.005)
+
+    await asyncio.gather(*(client(user) for user in range(HEAVY + 1, users + 2)))
+    return latencies
+
+
+async def run(directory, mode, args):
+    pool = ConnectionPool()
+    await pool.init(os.path.join(directory, f"{mode}.db"))
+    try:
+        async with asyncio.TaskGroup() as tg:
+            data = UsersData()
+            await data.init(pool)
+            commits = CommitScheduler()
+            await commits.init(tg, pool)
+            category_id = await seed(data, commits, args.rows, args.users)
+
+            reaper = Reaper()
+            await reaper.init(tg, data, commits, chunk_ms=args.chunk_ms)
+
+            done = asyncio.Event()
+            measured = tg.create_task(clients(data, commits, args.users, done))
+            await asyncio.sleep(0.5)
+
+            start = time.perf_counter()
+            if mode == "idle":
+                await asyncio.sleep(args.idle_seconds)
+                handler = 0.0
+            elif mode == "inline":
+                await delete_inline(pool, HEAVY, category_id)
+                await commits.commit()
+                handler = time.perf_counter() - start
+            else:
+                await data.delete_category(HEAVY, category_id)
+                await commits.commit()
+                handler = time.perf_counter() - start
+                reaper.wake()
+                await asyncio.sleep(0.1)
+                while await data.count_tombstones():
+                    await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+
+            done.set()
+            latencies = await measured
+            balance = await data.get_balance(HEAVY)
+            stats = reaper.stats()
+            await reaper.close()
+            await commits.close()
+    finally:
+        await pool.close()
+
+    return latencies, handler, elapsed, balance, stats
+
+
+async def main(args):
+    p99 = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("idle", "inline", "tombstone"):
+            latencies, handler, elapsed, balance, stats = await run(directory, mode, args)
+            p99[mode] = percentile(latencies, 0.99)
+            line = (f"{mode:>9}: {len(latencies):6} writes, "
+                    f"p50 {percentile(latencies, 0.5) * 1000:7.2f} ms, "
+                    f"p99 {p99[mode] * 1000:7.2f} ms, "
+                    f"max {max(latencies) * 1000:7.2f} ms")
+            if mode != "idle":
+                line += (f"; delete handler {handler * 1000:.0f} ms, "
+                         f"all rows gone after {elapsed:.1f} s, balance {balance}")
+            if mode == "tombstone":
+                line += (f", {stats['chunks']} chunks, mean "
+                         f"{stats['mean_chunk_ms']:.1f} ms, max {stats['max_chunk_ms']:.1f} ms")
+            print(line, flush=True)
+
+    if p99["tombstone"] > p99["idle"] * args.max_ratio:
+        raise SystemExit(f"p99 while reaping is {p99['tombstone'] / p99['idle']:.1f}x "
+                         f"the idle p99, more than {args.max_ratio}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--chunk-ms", type=float, default=5.0)
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    asyncio.run(main(parser.parse_args()))
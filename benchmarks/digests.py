@@ -0,0 +1,199 @@
+"""Digests for the whole user base: one query per user and category as
+get_transactions_by_time() would do it against UsersData.iter_digests(),
+then how replies fare while a digest run is being sent.
+
+    python3 -m benchmarks.digests --digest-users 20000 --users 20 --messages 30
+
+The second part is two benchmarks.load runs in fresh processes against a
+database seeded with --digest-users users who had transactions last week,
+once with DIGESTS off and once with DIGESTS = ("week",). OUTBOX_RATE is
+--rate in both, so the digests have to share it with the replies.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.load import LoadTest, percentile
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.digests import last_period
+from src.pool import ConnectionPool
+
+CATEGORIES = 3
+# far above the ids benchmarks.load gives its users
+FIRST_USER = 1_000_001
+
+
+def last_week(hour=9):
+    begin, end = last_period("week", (datetime.now() - timedelta(hours=hour)).date())
+    return begin.isoformat(), end.isoformat()
+
+
+async def seed(data, commits, users, per_user=5):
+    begin, _ = last_week()
+    ids = range(FIRST_USER, FIRST_USER + users)
+    async with data._pool.shards[0].write() as cur:
+        await cur.executemany("""INSERT INTO users (user_id) VALUES (?)""",
+                ((user,) for user in ids))
+        await cur.executemany("""INSERT INTO categories (owner_id, name) VALUES (?, ?)""",
+                ((user, f"c{i}") for user in ids for i in range(CATEGORIES)))
+        await cur.executemany("""INSERT INTO accounts (owner_id, name) VALUES (?, ?)""",
+                ((user, "card") for user in ids))
+        await cur.executemany("""INSERT INTO account_balances (account_id, owner_id)
+                SELECT account_id, owner_id FROM accounts WHERE owner_id = ?""",
+                ((user,) for user in ids))
+    await commits.commit()
+
+    rnd = random.Random(0)
+    first = datetime.fromisoformat(begin)
+    for number, user in enumerate(ids):
+        await data.add_transactions(user, [
+                (rnd.randint(-500_000, 100_000), number * CATEGORIES + rnd.randrange(CATEGORIES) + 1,
+                 number + 1, (first + timedelta(days=rnd.randrange(7))).date().isoformat())
+                for _ in range(per_user)])
+        if number % 1000 == 999:
+            await commits.commit()
+    await commits.commit()
+    return ids
+
+
+async def queries(args):
+    begin, end = last_week()
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                data = UsersData()
+                await data.init(pool)
+                commits = CommitScheduler()
+                await commits.init(tg, pool)
+                users = await seed(data, commits, args.digest_users)
+                await commits.close()
+
+            start = time.perf_counter()
+            naive = {}
+            for user in users:
+                categories = []
+                for name, category_id in sorted((await data.get_category_ids(user)).items()):
+                    total = await data.get_transactions_by_time(user, begin, end, category_id)
+                    if total:
+                        categories.append((name, total))
+                if categories:
+                    naive[user] = (sorted(categories, key=lambda item: item[1]),
+                                   await data.get_balance(user))
+            per_user = time.perf_counter() - start
+
+            start = time.perf_counter()
+            batched = {}
+            pages = 0
+            async for _, page in data.iter_digests("week", begin, end):
+                pages += 1
+                for user, total, categories, balance in page:
+                    batched[user] = (categories, balance)
+            set_based = time.perf_counter() - start
+        finally:
+            await pool.close()
+
+    same = ({user: (sorted(map(tuple, c)), b) for user, (c, b) in naive.items()}
+            == {user: (sorted(map(tuple, c)), b) for user, (c, b) in batched.items()})
+    print(f"{len(users)} users, {len(batched)} digests for {begin} - {end}:")
+    print(f"  per user and category: {per_user:.2f} s")
+    print(f"  iter_digests: {set_based:.2f} s in {pages} pages, "
+          f"{per_user / set_based:.0f}x faster, same digests: {same}")
+
+
+class DigestLoadTest(LoadTest):
+    digests = 0
+
+    def on_message(self, method, chat_id, reply_to, text):
+        if method == "sendMessage" and not reply_to:
+            self.digests += 1
+        super().on_message(method, chat_id, reply_to, text)
+
+
+async def load(args):
+    """One benchmarks.load run over a seeded database, digests on or off."""
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                data = UsersData()
+                await data.init(pool)
+                commits = CommitScheduler()
+                await commits.init(tg, pool)
+                await seed(data, commits, args.digest_users)
+                await commits.close()
+        finally:
+            await pool.close()
+
+        test = DigestLoadTest(directory, settings={"OUTBOX_RATE": args.rate,
+                "DIGESTS": ("week",) if args.with_digests else ()})
+
+        async def wait_digests(test):
+            if args.with_digests:
+                while test.digests < args.digest_users:
+                    await asyncio.sleep(0.05)
+
+        await test.run(args.users, args.messages,
+                {"transaction": 6, "balance": 2, "statistics": 1, "listing": 1},
+                during=wait_digests)
+
+        replies = [value for kind, values in test.latencies.items() if kind != "setup"
+                   for value in values]
+        print(f"replies p50 {percentile(replies, 0.5) * 1000:.1f} ms "
+              f"p99 {percentile(replies, 0.99) * 1000:.1f} ms, "
+              f"{len(replies) / test.elapsed:.1f} replies/s", end="")
+        if args.with_digests:
+            with sqlite3.connect(os.path.join(directory, "data.db")) as con:
+                sent, duration, rate = con.execute("""SELECT sent, duration, rate
+                        FROM digest_runs WHERE finished = 1""").fetchone()
+            print(f"; digests {sent} sent in {duration:.1f} s, {rate:.1f} per second, "
+                  f"{test.digests} received", end="")
+        print()
+
+
+def run_load(args, with_digests):
+    command = [sys.executable, "-m", "benchmarks.digests", "--load",
+               "--digest-users", str(args.load_digest_users), "--users", str(args.users),
+               "--messages", str(args.messages), "--rate", str(args.rate)]
+    if with_digests:
+        command.append("--with-digests")
+    result = subprocess.run(command, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    lines = [line for line in result.stdout.splitlines() if line.startswith("replies")]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"load run failed:\n{result.stderr[-2000:]}")
+    return lines[0]
+
+
+def main(args):
+    if args.load:
+        asyncio.run(load(args))
+        return
+
+    asyncio.run(queries(args))
+    print(f"{args.users} users x {args.messages} messages at OUTBOX_RATE {args.rate}, "
+          f"{args.load_digest_users} digests:", flush=True)
+    print(f"  without digests: {run_load(args, False)}", flush=True)
+    print(f"     with digests: {run_load(args, True)}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--digest-users", type=int, default=20_000)
+    parser.add_argument("--load-digest-users", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=100)
+    parser.add_argument("--load", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--with-digests", action="store_true", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,85 @@
+"""Export of one heavy user's history: paged export_csv against a single
+fetchall of the same rows, with peak Python memory and the worst event
+loop stall seen by a concurrent ticker.
+
+    python3 -m benchmarks.export [transactions]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.indexes import seed
+from src.data_managers import UsersData
+from src.exporter import export_csv
+from src.pool import ConnectionPool
+
+USER = 1
+
+FETCHALL = """SELECT transactions.day, transactions.amount, categories.name,
+        accounts.name
+        FROM transactions
+        JOIN accounts ON transactions.account_id = accounts.account_id
+        JOIN categories ON transactions.category_id = categories.category_id
+        WHERE accounts.owner_id = ?"""
+
+
+async def measure(call):
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - before - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await call()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    done = True
+    await tick
+    return result, elapsed, peak, stall
+
+
+async def main(transactions):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+
+        try:
+            data = UsersData()
+            await data.init(pool)
+            await data.delete()
+            await data.create_tables()
+            await seed(pool.writer, transactions, 1, 5)
+            await data.migrate()
+
+            path = os.path.join(directory, "export.csv.gz")
+            count, elapsed, peak, stall = await measure(
+                    lambda: export_csv(data, USER, path))
+            print(f"export_csv: {count} rows in {elapsed:.2f} s "
+                  f"({count / elapsed:.0f} rows/s), {os.path.getsize(path) / 2**20:.1f} MB "
+                  f"gzip, peak {peak / 2**20:.1f} MB, worst stall {stall * 1000:.1f} ms")
+
+            async def fetchall():
+                async with pool.read() as cur:
+                    await cur.execute(FETCHALL, (USER,))
+                    return await cur.fetchall()
+
+            rows, elapsed, peak, stall = await measure(fetchall)
+            print(f"fetchall:   {len(rows)} rows in {elapsed:.2f} s, "
+                  f"peak {peak / 2**20:.1f} MB, worst stall {stall * 1000:.1f} ms")
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
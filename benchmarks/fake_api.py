@@ -0,0 +1,110 @@
+"""Offline stand-in for the Telegram Bot API.
+
+Serves just enough of getMe/getUpdates/sendMessage and the webhook
+methods for aiogram to run against it, hands out queued updates to long
+polling and reports every sent message to a callback. Like Telegram, it
+hands out the same updates again until a getUpdates offset above them
+confirms them, and a negative offset -n forgets all but the last n
+pending ones, as aiogram's skip_updates() relies on. With flood_every set,
+every n-th send is refused with a 429 and a one second retry_after.
+"""
+import asyncio
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    def __init__(self, on_message=None, flood_every=0):
+        self.updates = asyncio.Queue()
+        self.unconfirmed = deque()
+        self.on_message = on_message
+        self.flood_every = flood_every
+        self.polls = 0
+        self.sent = 0
+        self.refused = 0
+        self._sends = 0
+        self._message_id = 0
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=8081):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request):
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+
+        method = request.match_info["method"]
+        match method:
+            case "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Bench",
+                          "username": "bench_bot"}
+            case "getUpdates":
+                result = await self.get_updates(params)
+            case ("sendMessage" | "editMessageText" | "sendDocument"
+                  | "sendPhoto"):
+                self._sends += 1
+                if self.flood_every and self._sends % self.flood_every == 0:
+                    self.refused += 1
+                    return web.json_response({"ok": False, "error_code": 429,
+                            "description": "Too Many Requests: retry after 1",
+                            "parameters": {"retry_after": 1}}, status=429)
+                result = self.send_message(method, params)
+            case "getWebhookInfo":
+                result = {"url": "", "has_custom_certificate": False,
+                          "pending_update_count": 0}
+            case _:
+                result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        if offset < 0:
+            pending = list(self.unconfirmed)
+            while not self.updates.empty():
+                pending.append(self.updates.get_nowait())
+            self.unconfirmed = deque(pending[offset:])
+            return list(self.unconfirmed)
+        self.polls += 1
+
+        while self.unconfirmed and self.unconfirmed[0]["update_id"] < offset:
+            self.unconfirmed.popleft()
+        limit = int(params.get("limit", 100))
+        if self.unconfirmed:
+            return list(self.unconfirmed)[:limit]
+
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(),
+                    float(params.get("timeout", 0)) or 0.01))
+        except TimeoutError:
+            return []
+
+        while len(updates) < limit and not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        self.unconfirmed.extend(updates)
+        return updates
+
+    def send_message(self, method, params):
+        self._message_id += 1
+        self.sent += 1
+
+        chat_id = int(params["chat_id"])
+        reply_to = int(params.get("reply_to_message_id") or 0)
+        if self.on_message is not None:
+            self.on_message(method, chat_id, reply_to, params.get("text", ""))
+
+        return {"message_id": int(params.get("message_id") or self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")}
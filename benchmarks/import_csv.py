@@ -0,0 +1,84 @@
+"""CSV import throughput and peak memory for a synthetic bank statement.
+
+    python3 -m benchmarks.import_csv --rows 1000000
+"""
+import argparse
+import asyncio
+import csv
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import date, timedelta
+
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.importer import import_csv
+from src.money import format_amount
+from src.pool import ConnectionPool
+
+USER = 1
+
+
+def write_statement(path, rows, categories, accounts):
+    rnd = random.Random(0)
+    first = date(2015, 1, 1)
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["day", "amount", "category", "account"])
+        for _ in range(rows):
+            writer.writerow([(first + timedelta(days=rnd.randrange(3650))).isoformat(),
+                             f"{rnd.uniform(-5000, 5000):.2f}",
+                             f"c{rnd.randrange(categories)}",
+                             f"a{rnd.randrange(accounts)}"])
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "statement.csv")
+        start = time.perf_counter()
+        write_statement(path, args.rows, args.categories, args.accounts)
+        print(f"wrote {args.rows} rows ({os.path.getsize(path) / 2**20:.1f} MB) "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                data = UsersData()
+                await data.init(pool)
+                await data.add_user(USER)
+
+                commits = CommitScheduler()
+                await commits.init(tg, pool)
+
+                updates = 0
+
+                async def progress(read, imported):
+                    nonlocal updates
+                    updates += 1
+
+                start = time.perf_counter()
+                imported, errors, _ = await import_csv(data, commits, USER, path,
+                        progress)
+                elapsed = time.perf_counter() - start
+
+                balance = await data.get_balance(USER)
+                await commits.close()
+
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"imported {imported} rows ({errors} errors) in {elapsed:.1f} s: "
+                  f"{imported / elapsed:.0f} rows/s, {commits.stats()['commits']} "
+                  f"commits, {updates} progress updates")
+            print(f"balance {format_amount(balance)}, peak RSS {peak:.0f} MB")
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--accounts", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
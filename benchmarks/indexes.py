@@ -0,0 +1,124 @@
+"""Query plans and latency of the UsersData lookups before and after
+the schema migrations.
+
+    python3 -m benchmarks.indexes [transactions] [users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from src.cache import LookupCache
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+CATEGORIES = 10
+ACCOUNTS = 3
+QUERIES = 200
+
+QUERIES_SQL = {
+    "get_category_id": ("""SELECT category_id FROM categories
+            WHERE (owner_id, name) = (?, ?){live}""", lambda user: (user, "c3")),
+    "get_account_id": ("""SELECT account_id FROM accounts
+            WHERE (owner_id, name) = (?, ?){live}""", lambda user: (user, "a1")),
+    "balance": ("""SELECT count(amount), sum(amount) FROM transactions
+            JOIN accounts ON transactions.account_id = accounts.account_id
+            WHERE accounts.owner_id = ?""", lambda user: (user,)),
+    "account balance": ("""SELECT count(amount), sum(amount) FROM transactions
+            JOIN accounts ON transactions.account_id = accounts.account_id
+            WHERE (accounts.owner_id, accounts.name) = (?, ?){live}""",
+            lambda user: (user, "a1")),
+    "statistics": ("""SELECT sum(amount) FROM transactions
+            JOIN accounts ON transactions.account_id = accounts.account_id
+            WHERE owner_id = ? AND day BETWEEN ? AND ?""",
+            lambda user: (user, "2023-01-01", "2023-03-01")),
+    "category statistics": ("""SELECT sum(amount) FROM transactions
+            JOIN accounts ON transactions.account_id = accounts.account_id
+            WHERE (owner_id, category_id) = (?, ?) AND day BETWEEN ? AND ?""",
+            lambda user: (user, user * CATEGORIES, "2023-01-01", "2023-03-01")),
+}
+
+
+async def seed(con, transactions, users, years=1):
+    await con.executemany("""INSERT INTO users (user_id) VALUES (?)""",
+            ((user,) for user in range(1, users + 1)))
+    await con.executemany("""INSERT INTO categories (owner_id, name) VALUES (?, ?)""",
+            ((user, f"c{i}") for user in range(1, users + 1)
+                for i in range(CATEGORIES)))
+    await con.executemany("""INSERT INTO accounts (owner_id, name) VALUES (?, ?)""",
+            ((user, f"a{i}") for user in range(1, users + 1)
+                for i in range(ACCOUNTS)))
+
+    rnd = random.Random(0)
+
+    def rows():
+        for _ in range(transactions):
+            user = rnd.randrange(users)
+            yield (user * CATEGORIES + rnd.randrange(CATEGORIES) + 1,
+                   user * ACCOUNTS + rnd.randrange(ACCOUNTS) + 1,
+                   rnd.randint(-5000, 5000),
+                   f"{2023 - rnd.randrange(years)}-{rnd.randint(1, 12):02}"
+                   f"-{rnd.randint(1, 28):02}")
+
+    await con.executemany("""INSERT INTO transactions
+            (category_id, account_id, amount, day) VALUES (?, ?, ?, ?)""", rows())
+    await con.commit()
+
+
+async def report(con, users, migrated):
+    rnd = random.Random(1)
+    # the migrations add the deleted flags, name lookups that skip the
+    # tombstones as UsersData does use the partial unique indexes
+    live = " AND deleted = 0" if migrated else ""
+
+    for name, (query, params) in QUERIES_SQL.items():
+        query = query.format(live=live)
+        async with con.execute("EXPLAIN QUERY PLAN " + query, params(1)) as cur:
+            plan = "; ".join(row[3] for row in await cur.fetchall())
+
+        start = time.perf_counter()
+        for _ in range(QUERIES):
+            async with con.execute(query, params(rnd.randint(1, users))) as cur:
+                await cur.fetchall()
+        elapsed = (time.perf_counter() - start) / QUERIES
+
+        print(f"  {name}: {elapsed * 1000:.3f} ms/query")
+        print(f"    {plan}")
+
+
+async def main(transactions, users):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"), readers=0)
+
+        try:
+            data = UsersData()
+            data._pool = pool
+            data.cache = LookupCache()
+            await data.create_tables()
+
+            start = time.perf_counter()
+            await seed(pool.writer, transactions, users)
+            print(f"seeded {transactions} transactions in "
+                  f"{time.perf_counter() - start:.1f} s")
+
+            print("before migration:")
+            await report(pool.writer, users, False)
+
+            start = time.perf_counter()
+            await data.migrate()
+            print(f"migrated in {time.perf_counter() - start:.1f} s")
+
+            print("after migration:")
+            await report(pool.writer, users, True)
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    transactions = args[0] if args else 1_000_000
+    users = args[1] if len(args) > 1 else 1000
+    asyncio.run(main(transactions, users))
@@ -0,0 +1,272 @@
+"""Crash safety of the update journal and the cost of online backups.
+
+    python3 -m benchmarks.journal --users 50 --operations 3000 --rows 3000000
+
+crash   a bot process is killed with SIGKILL while it works through
+        --operations transactions of 1 each and then started again. The
+        transactions recorded are counted against the ones sent, with
+        JOURNAL on and off, along with how long the restarted bot took to
+        answer again and to catch up.
+backup  replies while --users users keep sending the usual benchmarks.load
+        mix against a database of --rows transactions: idle, during a
+        backup copied --pages pages at a time with pauses as Backup does it,
+        and during a one-shot copy of the whole file. The WAL size is
+        sampled throughout.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_api import FakeBotApi
+from benchmarks.load import API_PORT, COMMANDS, SETUP, LoadTest, percentile
+from src.backup import BACKUP_PAGES, BACKUP_PAUSE, copy_database
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RATIOS = {"transaction": 6, "balance": 2, "statistics": 1, "listing": 1}
+
+CHILD = """
+import sys, types
+config = types.ModuleType("src.config")
+config.__dict__.update({settings!r})
+sys.modules["src.config"] = config
+
+import asyncio
+from src import run
+asyncio.run(run.main())
+"""
+
+
+class Crash:
+    """Fake Bot API side of the crash test, counts the replies per update."""
+
+    def __init__(self):
+        self.api = FakeBotApi(self.on_message)
+        self.replies = {}
+        self.replied = None
+        self._update_id = 0
+
+    def on_message(self, method, chat_id, reply_to, text):
+        self.replies[reply_to] = self.replies.get(reply_to, 0) + 1
+        self.replied = time.perf_counter()
+
+    def update(self, user, text):
+        self._update_id += 1
+        return {"update_id": self._update_id, "message": {
+            "message_id": self._update_id, "date": int(time.time()),
+            "chat": {"id": user, "type": "private"},
+            "from": {"id": user, "is_bot": False, "first_name": f"user{user}"},
+            "text": text}}
+
+    async def wait_replies(self, update_ids, timeout, quiet=3.0):
+        """Waits until every one of update_ids got a reply, or nothing
+        came for quiet seconds, or timeout."""
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            if all(update_id in self.replies for update_id in update_ids):
+                return True
+            if self.replied is not None and time.perf_counter() - self.replied > quiet:
+                return False
+            await asyncio.sleep(0.02)
+        return False
+
+
+def start_bot(directory, journal):
+    settings = {"TOKEN": "123456:bench", "ADMIN_ID": 0,
+                "API_SERVER": f"http://127.0.0.1:{API_PORT}",
+                "DB_PATH": os.path.join(directory, "data.db"),
+                "OUTBOX_RATE": 1_000_000, "OUTBOX_CHAT_INTERVAL": 0,
+                "METRICS": False, "JOURNAL": journal,
+                # every transaction is queued at once, none may be turned away
+                "MAILBOX_USER_LIMIT": 1_000_000, "MAILBOX_LIMIT": 1_000_000}
+    return subprocess.Popen([sys.executable, "-c", CHILD.format(settings=settings)],
+            cwd=ROOT, stderr=subprocess.DEVNULL)
+
+
+async def crash(args, journal):
+    with tempfile.TemporaryDirectory() as directory:
+        test = Crash()
+        await test.api.start(port=API_PORT)
+        bot = start_bot(directory, journal)
+        try:
+            users = range(1, args.users + 1)
+            setup = []
+            for text in SETUP:
+                for user in users:
+                    update = test.update(user, text)
+                    setup.append(update["update_id"])
+                    test.api.updates.put_nowait(update)
+            await test.wait_replies(setup, 120)
+
+            operations = []
+            for number in range(args.operations):
+                update = test.update(users[number % len(users)], "1 c0 a0")
+                operations.append(update["update_id"])
+                test.api.updates.put_nowait(update)
+
+            while sum(update_id in test.replies for update_id in operations) \
+                    < args.operations * args.kill_at:
+                await asyncio.sleep(0.005)
+            bot.kill()
+            await asyncio.to_thread(bot.wait)
+            replied = sum(update_id in test.replies for update_id in operations)
+
+            restarted = time.perf_counter()
+            test.replied = None
+            bot = start_bot(directory, journal)
+            while test.replied is None and time.perf_counter() - restarted < args.wait:
+                await asyncio.sleep(0.005)
+            if test.replied is not None:
+                first = test.replied - restarted
+                await test.wait_replies(operations, 120)
+                caught_up = test.replied - restarted
+        finally:
+            bot.send_signal(signal.SIGINT)
+            await asyncio.to_thread(bot.wait)
+            await test.api.close()
+
+        with sqlite3.connect(os.path.join(directory, "data.db")) as con:
+            recorded, = con.execute("""SELECT count(*) FROM transactions""").fetchone()
+
+    unanswered = sum(update_id not in test.replies for update_id in operations)
+    repeated = sum(test.replies.get(update_id, 0) > 1 for update_id in operations)
+    summary = (f"{recorded} of {args.operations} recorded, {replied} answered before "
+               f"the kill, {unanswered} never answered, {repeated} answered twice; ")
+    if test.replied is None:
+        return summary + f"no reply within {args.wait:.0f} s of the restart"
+    return summary + (f"first reply {first:.2f} s after the restart, caught up after "
+                      f"{caught_up:.2f} s")
+
+
+async def seed(path, rows):
+    pool = ConnectionPool()
+    await pool.init(path, readers=0)
+    try:
+        await UsersData().init(pool)
+        await pool.writer.commit()
+    finally:
+        await pool.close()
+
+    rnd = random.Random(0)
+    with sqlite3.connect(path) as con:
+        con.executemany("""INSERT INTO transactions (category_id, account_id, amount, day)
+                VALUES (?, ?, ?, ?)""",
+                ((rnd.randrange(1000), rnd.randrange(300), rnd.randint(-500_000, 500_000),
+                  f"2023-{rnd.randint(1, 12):02}-{rnd.randint(1, 28):02}")
+                 for _ in range(rows)))
+
+
+async def backup(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.db")
+        shutil.copy(args.template, path)
+        test = LoadTest(directory, settings={"METRICS": False})
+        result = {}
+
+        async def client(test, user, done, rnd):
+            for text in SETUP:
+                await test.send(user, text, "setup")
+            kinds = list(RATIOS)
+            while not done.is_set():
+                kind = rnd.choices(kinds, [RATIOS[kind] for kind in kinds])[0]
+                await test.send(user, COMMANDS[kind](rnd), kind)
+
+        async def sample_wal(wal, sizes):
+            while True:
+                sizes.append(os.path.getsize(wal) if os.path.exists(wal) else 0)
+                await asyncio.sleep(0.05)
+
+        async def scenario(test):
+            done = asyncio.Event()
+            clients = [asyncio.create_task(client(test, user, done,
+                    random.Random(user))) for user in range(1, args.users + 1)]
+            await asyncio.sleep(1)
+
+            sizes = []
+            sampler = asyncio.create_task(sample_wal(path + "-wal", sizes))
+            test.latencies = {}
+            start = time.perf_counter()
+            if args.run == "idle":
+                await asyncio.sleep(args.idle)
+            else:
+                pages, pause = ((args.pages, args.pause) if args.run == "paced" else (-1, 0))
+                await asyncio.to_thread(copy_database, path,
+                        os.path.join(directory, "copy.db"), pages, pause)
+            result["window"] = time.perf_counter() - start
+            result["latencies"], test.latencies = test.latencies, {}
+            sampler.cancel()
+            result["wal"] = max(sizes)
+            done.set()
+            await asyncio.gather(*clients)
+
+        await test.run(0, 0, RATIOS, during=scenario)
+        replies = [value for kind, values in result["latencies"].items() if kind != "setup"
+                   for value in values]
+        size = os.path.getsize(path)
+    # a small database is copied before the first reply comes
+    latency = (f"replies p50 {percentile(replies, 0.5) * 1000:.1f} ms p99 "
+               f"{percentile(replies, 0.99) * 1000:.1f} ms" if replies else "no replies")
+    print(f"result: {result['window']:.2f} s, {latency}, "
+          f"{len(replies) / result['window']:.0f} replies/s; database {size / 2 ** 20:.0f} MB, "
+          f"largest WAL {result['wal'] / 2 ** 20:.1f} MB")
+
+
+def run_backup(args, scenario, template):
+    command = [sys.executable, "-m", "benchmarks.journal", "--run", scenario,
+               "--template", template, "--users", str(args.users),
+               "--idle", str(args.idle), "--pages", str(args.pages),
+               "--pause", str(args.pause)]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("result")]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"{scenario} failed:\n{result.stderr[-2000:]}")
+    return lines[0].removeprefix("result: ")
+
+
+def main(args):
+    if args.run:
+        asyncio.run(backup(args))
+        return
+
+    print(f"crash: {args.users} users, {args.operations} transactions, killed after "
+          f"{args.kill_at:.0%} of them were answered", flush=True)
+    for journal in (False, True):
+        label = "journal" if journal else "no journal"
+        print(f"  {label:>10}: {asyncio.run(crash(args, journal))}", flush=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        template = os.path.join(directory, "template.db")
+        asyncio.run(seed(template, args.rows))
+        print(f"backup: {args.users} users sending, {args.rows} transactions", flush=True)
+        for scenario in ("idle", "paced", "oneshot"):
+            print(f"  {scenario:>8}: {run_backup(args, scenario, template)}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--operations", type=int, default=3000)
+    parser.add_argument("--kill-at", type=float, default=0.5,
+                        help="share of the transactions answered before the kill")
+    parser.add_argument("--wait", type=float, default=10.0,
+                        help="seconds to wait for the restarted bot to answer")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--idle", type=float, default=5.0,
+                        help="seconds measured without a backup")
+    parser.add_argument("--pages", type=int, default=BACKUP_PAGES,
+                        help="pages per step of the paced backup")
+    parser.add_argument("--pause", type=float, default=BACKUP_PAUSE,
+                        help="seconds between the steps of the paced backup")
+    parser.add_argument("--run", choices=["idle", "paced", "oneshot"],
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--template", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,207 @@
+"""End-to-end load test of run.main against the fake Bot API.
+
+A synthetic population of users registers, adds categories and accounts
+and then sends transactions, balance, statistics and listing requests in
+the given ratios. Every user waits for the reply to one message before
+sending the next. Latency is measured from handing an update to the bot
+until its reply reaches the fake API.
+
+    python3 -m benchmarks.load --users 200 --messages 50 --mode webhook
+"""
+import argparse
+import ast
+import asyncio
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+import types
+
+import aiohttp
+
+from benchmarks.fake_api import FakeBotApi
+
+API_PORT = 18081
+WEBHOOK_PORT = 18080
+
+COMMANDS = {
+    "transaction": lambda rnd: f"{rnd.randint(-5000, 5000)} c{rnd.randrange(3)} "
+                               f"a{rnd.randrange(2)}",
+    "balance": lambda rnd: "баланс",
+    "statistics": lambda rnd: "статистика 2000-01-01 2100-01-01",
+    "listing": lambda rnd: "категории",
+}
+
+# measure the bot itself, not the Telegram send limits it obeys
+SETTINGS = {"OUTBOX_RATE": 1_000_000, "OUTBOX_CHAT_INTERVAL": 0}
+
+SETUP = (["/start"] + [f"добавить категорию c{i}" for i in range(3)]
+         + [f"добавить счет a{i}" for i in range(2)])
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class LoadTest:
+    def __init__(self, directory, mode="polling", settings=None, flood_every=0):
+        self.directory = directory
+        self.mode = mode
+        self.settings = dict(SETTINGS, **(settings or {}))
+        self.latencies = {}
+        self._pending = {}
+        self._message_id = 0
+        self._batch = []
+
+        self.api = FakeBotApi(self.on_message, flood_every)
+
+    def on_message(self, method, chat_id, reply_to, text):
+        pending = self._pending.pop(reply_to, None)
+        if pending is None:
+            return
+
+        kind, sent, future = pending
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - sent)
+        if not future.done():
+            future.set_result(text)
+
+    def update(self, user, text):
+        self._message_id += 1
+        return {"update_id": self._message_id, "message": {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": user, "type": "private"},
+            "from": {"id": user, "is_bot": False, "first_name": f"user{user}"},
+            "text": text}}
+
+    async def send(self, user, text, kind):
+        update = self.update(user, text)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update["message"]["message_id"]] = (kind, time.perf_counter(),
+                future)
+
+        if self.mode == "webhook":
+            self._batch.append(update)
+        else:
+            self.api.updates.put_nowait(update)
+        return await asyncio.wait_for(future, 60)
+
+    async def deliver(self, session):
+        url = f"http://127.0.0.1:{WEBHOOK_PORT}/webhook"
+        while True:
+            if self._batch:
+                batch, self._batch = self._batch, []
+                async with session.post(url, json=batch) as response:
+                    response.raise_for_status()
+            await asyncio.sleep(0.002)
+
+    async def wait_ready(self, session):
+        while True:
+            if self.mode == "webhook":
+                try:
+                    async with session.post(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook",
+                            json=[]) as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+            elif self.api.polls:
+                return
+            await asyncio.sleep(0.05)
+
+    async def user(self, user, messages, ratios, rnd):
+        for text in SETUP:
+            await self.send(user, text, "setup")
+
+        kinds = list(ratios)
+        weights = [ratios[kind] for kind in kinds]
+        for _ in range(messages):
+            kind = rnd.choices(kinds, weights)[0]
+            await self.send(user, COMMANDS[kind](rnd), kind)
+
+    async def run(self, users, messages, ratios, during=None):
+        config = types.ModuleType("src.config")
+        config.TOKEN = "123456:bench"
+        config.ADMIN_ID = 0
+        config.API_SERVER = f"http://127.0.0.1:{API_PORT}"
+        config.MODE = self.mode
+        config.WEBHOOK_PORT = WEBHOOK_PORT
+        config.DB_PATH = os.path.join(self.directory, "data.db")
+        for name, value in self.settings.items():
+            setattr(config, name, value)
+        sys.modules["src.config"] = config
+
+        from src import run
+
+        await self.api.start(port=API_PORT)
+        bot = asyncio.create_task(run.main())
+
+        async with aiohttp.ClientSession() as session:
+            await self.wait_ready(session)
+            deliver = asyncio.create_task(self.deliver(session))
+
+            extra = asyncio.create_task(during(self)) if during else None
+            rnd = random.Random(0)
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                    self.user(user, messages, ratios, random.Random(rnd.random()))
+                    for user in range(1, users + 1)))
+            self.elapsed = time.perf_counter() - start
+            if extra is not None:
+                await extra
+
+            deliver.cancel()
+
+        os.kill(os.getpid(), signal.SIGINT)
+        await bot
+        await self.api.close()
+
+    def report(self):
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"{total} messages in {self.elapsed:.2f} s: "
+              f"{total / self.elapsed:.0f} messages/s, "
+              f"{self.api.refused} sends refused with 429")
+        for kind, values in sorted(self.latencies.items()):
+            print(f"  {kind:>12}: n={len(values):<6} "
+                  f"p50={percentile(values, 0.50) * 1000:7.2f} ms "
+                  f"p95={percentile(values, 0.95) * 1000:7.2f} ms "
+                  f"p99={percentile(values, 0.99) * 1000:7.2f} ms")
+
+
+def parse_setting(text):
+    name, value = text.split("=", 1)
+    return name, ast.literal_eval(value)
+
+
+def parse_ratios(text):
+    ratios = {}
+    for item in text.split(","):
+        kind, weight = item.split("=")
+        if kind not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"unknown command type {kind}")
+        ratios[kind] = float(weight)
+    return ratios
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        test = LoadTest(directory, args.mode, dict(args.setting), args.flood)
+        await test.run(args.users, args.messages, args.ratios)
+        test.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20,
+                        help="messages per user after the setup commands")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--ratios", type=parse_ratios,
+                        default="transaction=6,balance=2,statistics=1,listing=1")
+    parser.add_argument("--setting", type=parse_setting, action="append", default=[],
+                        help="config override such as OUTBOX_MERGE=True")
+    parser.add_argument("--flood", type=int, default=0,
+                        help="refuse every n-th send with a 429")
+    asyncio.run(main(parser.parse_args()))
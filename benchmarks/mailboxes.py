@@ -0,0 +1,124 @@
+"""Per-user mailboxes against handlers started without a limit, as aiogram
+does with MAILBOX_WORKERS = 0.
+
+    python3 -m benchmarks.mailboxes --users 50 --pairs 10 --flood 2000
+
+Two scenarios, each run in a fresh process against the fake Bot API:
+
+race   every user sends "добавить счет zN" and "10 c0 zN" without waiting
+       for the first reply, and counts the operations refused because
+       the account did not exist yet.
+flood  one chat sends --flood messages at once while the others send the
+       usual benchmarks.load mix, whose latency is measured.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.load import SETUP, LoadTest, percentile
+
+FLOODER = 999_999
+RATIOS = {"transaction": 6, "balance": 2, "statistics": 1, "listing": 1}
+
+
+class MailboxLoadTest(LoadTest):
+    flood_replies = 0
+    busy = 0
+    refused = 0
+
+    def on_message(self, method, chat_id, reply_to, text):
+        if chat_id == FLOODER:
+            self.flood_replies += 1
+            if "не успеваю" in text:
+                self.busy += 1
+        super().on_message(method, chat_id, reply_to, text)
+
+    async def pairs(self, user, count):
+        for text in SETUP:
+            await self.send(user, text, "setup")
+        for number in range(count):
+            added, operation = await asyncio.gather(
+                    self.send(user, f"добавить счет z{number}", "add account"),
+                    self.send(user, f"10 c0 z{number}", "transaction"))
+            self.refused += "не существует" in operation
+
+
+async def race(args, settings):
+    with tempfile.TemporaryDirectory() as directory:
+        test = MailboxLoadTest(directory, settings=settings)
+
+        async def scenario(test):
+            await asyncio.gather(*(test.pairs(user, args.pairs)
+                    for user in range(args.users + 1, 2 * args.users + 1)))
+
+        await test.run(0, 0, RATIOS, during=scenario)
+        print(f"result: {test.refused} of {args.users * args.pairs} operations "
+              f"refused for a missing account")
+
+
+async def flood(args, settings):
+    with tempfile.TemporaryDirectory() as directory:
+        test = MailboxLoadTest(directory, settings=settings)
+
+        async def scenario(test):
+            await test.send(FLOODER, "/start", "setup")
+            for _ in range(args.flood):
+                test.api.updates.put_nowait(test.update(FLOODER, "баланс"))
+
+            start = time.perf_counter()
+            while (test.flood_replies < args.flood
+                    and time.perf_counter() - start < args.flood_wait):
+                await asyncio.sleep(0.05)
+
+        await test.run(args.users, args.messages, RATIOS, during=scenario)
+        replies = [value for kind, values in test.latencies.items() if kind != "setup"
+                   for value in values]
+        print(f"result: others p50 {percentile(replies, 0.5) * 1000:.1f} ms "
+              f"p99 {percentile(replies, 0.99) * 1000:.1f} ms, "
+              f"{len(replies) / test.elapsed:.0f} replies/s; flooding chat got "
+              f"{test.flood_replies - 1} replies, {test.busy} of them busy")
+
+
+def run(scenario, workers, args):
+    command = [sys.executable, "-m", "benchmarks.mailboxes", "--run", scenario,
+               "--workers", str(workers), "--users", str(args.users),
+               "--messages", str(args.messages), "--pairs", str(args.pairs),
+               "--flood", str(args.flood), "--policy", args.policy]
+    result = subprocess.run(command, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    lines = [line for line in result.stdout.splitlines() if line.startswith("result")]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"{scenario} with {workers} workers failed:\n"
+                         f"{result.stderr[-2000:]}")
+    return lines[0].removeprefix("result: ")
+
+
+def main(args):
+    if args.run:
+        settings = {"MAILBOX_WORKERS": args.workers, "MAILBOX_POLICY": args.policy}
+        asyncio.run((race if args.run == "race" else flood)(args, settings))
+        return
+
+    for scenario in ("race", "flood"):
+        print(f"{scenario}:")
+        for workers in (0, 64):
+            label = "no mailboxes" if not workers else f"{workers} mailbox workers"
+            print(f"  {label:>18}: {run(scenario, workers, args)}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--pairs", type=int, default=10)
+    parser.add_argument("--flood", type=int, default=2000)
+    parser.add_argument("--flood-wait", type=float, default=30.0,
+                        help="seconds to wait for the flood to be answered")
+    parser.add_argument("--policy", choices=["busy", "drop_oldest"], default="busy")
+    parser.add_argument("--run", choices=["race", "flood"], help=argparse.SUPPRESS)
+    parser.add_argument("--workers", type=int, default=64, help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,91 @@
+"""Overhead of the metrics instrumentation on MessageHandler, measured
+with the real pool and commit scheduler underneath and the outbox
+stubbed, so the cost of the wrappers is not hidden behind the network.
+
+    python3 -m benchmarks.metrics [users] [messages] [rounds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.batch import Replies, config, message
+from src.bot import MessageHandler
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.metrics import DISPATCHED, CountingCursor, Metrics
+from src.pool import ConnectionPool
+
+TEXTS = ["баланс", "баланс карта", "категории", "статистика 2000-01-01 2100-01-01",
+         "15 еда карта"]
+
+
+async def run(directory, users, messages, instrumented):
+    pool = ConnectionPool()
+    await pool.init(os.path.join(directory, f"{instrumented}.db"))
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            data = UsersData()
+            await data.init(pool)
+            commits = CommitScheduler()
+            await commits.init(tg, pool)
+            bot = MessageHandler()
+            await bot.init(tg, data, commits, Replies())
+
+            metrics = None
+            if instrumented:
+                metrics = Metrics()
+                await metrics.init(tg)
+                pool.wrap_cursor = CountingCursor
+                metrics.instrument(data, "query", "method", "UsersData call time",
+                        rows=True)
+                metrics.instrument(bot, "handler", "handler", "MessageHandler call time",
+                        skip=DISPATCHED)
+                metrics.instrument(commits, "commit", "method", "Commit time")
+
+            for user in range(1, users + 1):
+                await bot.start_message(message(user, "/start"))
+                await bot.reply_message(message(user, "доб кат еда\nдоб счет карта"))
+
+            async def client(user):
+                for i in range(messages):
+                    await bot.reply_message(message(user, TEXTS[i % len(TEXTS)]))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(user) for user in range(1, users + 1)))
+            elapsed = time.perf_counter() - start
+
+            render = 0.0
+            if metrics is not None:
+                start = time.perf_counter()
+                size = len(metrics.render())
+                render = time.perf_counter() - start
+                await metrics.close()
+            await commits.close()
+    finally:
+        await pool.close()
+
+    return elapsed / (users * messages), render
+
+
+async def main(users, messages, rounds):
+    times = {False: [], True: []}
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(rounds):
+            for instrumented in (False, True):
+                per_message, render = await run(directory, users, messages,
+                        instrumented)
+                times[instrumented].append(per_message)
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+
+    off, on = min(times[False]), min(times[True])
+    print(f"metrics off: {off * 1e6:.0f} us/message, on: {on * 1e6:.0f} us/message "
+          f"({(on / off - 1) * 100:+.1f}%), /metrics rendered in {render * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [50, 100, 3][len(args):])))
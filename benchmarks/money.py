@@ -0,0 +1,124 @@
+"""Aggregate speed, file size and exactness of float rubles against integer
+kopecks on a large history, and the time the chunked conversion takes.
+
+    python3 -m benchmarks.money [transactions] [users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import src.data_managers as data_managers
+from benchmarks.indexes import ACCOUNTS, CATEGORIES
+from src.cache import LookupCache
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+QUERIES = 1000
+
+AGGREGATES = {
+    "sum of all transactions": ("""SELECT sum(amount) FROM transactions""",
+            lambda rnd, users: ()),
+    "balance from transactions": ("""SELECT sum(amount) FROM transactions
+            JOIN accounts ON transactions.account_id = accounts.account_id
+            WHERE accounts.owner_id = ?""", lambda rnd, users: (rnd.randint(1, users),)),
+    "yearly statistics from rollups": ("""SELECT sum(total) FROM daily_totals
+            WHERE owner_id = ? AND day BETWEEN ? AND ?""",
+            lambda rnd, users: (rnd.randint(1, users), "2023-01-01", "2023-12-31")),
+    "balance from account_balances": ("""SELECT sum(total) FROM account_balances
+            WHERE owner_id = ?""", lambda rnd, users: (rnd.randint(1, users),)),
+}
+
+
+async def seed(con, transactions, users):
+    """Rubles with kopecks as floats, the way amounts used to be stored."""
+    await con.executemany("""INSERT INTO users (user_id) VALUES (?)""",
+            ((user,) for user in range(1, users + 1)))
+    await con.executemany("""INSERT INTO categories (owner_id, name) VALUES (?, ?)""",
+            ((user, f"c{i}") for user in range(1, users + 1) for i in range(CATEGORIES)))
+    await con.executemany("""INSERT INTO accounts (owner_id, name) VALUES (?, ?)""",
+            ((user, f"a{i}") for user in range(1, users + 1) for i in range(ACCOUNTS)))
+
+    rnd = random.Random(0)
+
+    def rows():
+        for _ in range(transactions):
+            user = rnd.randrange(users)
+            yield (user * CATEGORIES + rnd.randrange(CATEGORIES) + 1,
+                   user * ACCOUNTS + rnd.randrange(ACCOUNTS) + 1,
+                   rnd.randint(-500_000, 500_000) / 100,
+                   f"2023-{rnd.randint(1, 12):02}-{rnd.randint(1, 28):02}")
+
+    await con.executemany("""INSERT INTO transactions
+            (category_id, account_id, amount, day) VALUES (?, ?, ?, ?)""", rows())
+    await con.commit()
+
+
+async def report(con, users):
+    # both layouts freshly packed, so only the values differ
+    await con.execute("""VACUUM""")
+    async with con.execute("""SELECT page_count * page_size
+            FROM pragma_page_count(), pragma_page_size()""") as cur:
+        size = (await cur.fetchone())[0]
+    print(f"  file size after VACUUM: {size / 2**20:.1f} MB")
+
+    for name, (query, params) in AGGREGATES.items():
+        rnd = random.Random(1)
+        count = 5 if not params(rnd, users) else QUERIES
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(count):
+                async with con.execute(query, params(rnd, users)) as cur:
+                    await cur.fetchone()
+            times.append((time.perf_counter() - start) / count)
+        print(f"  {name}: {min(times) * 1000:.3f} ms")
+
+    async with con.execute("""SELECT (SELECT sum(total) FROM account_balances),
+            (SELECT sum(amount) FROM transactions)""") as cur:
+        balances, transactions = await cur.fetchone()
+    print(f"  balances - transactions: {balances - transactions!r}")
+
+
+async def main(transactions, users):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"), readers=0)
+
+        try:
+            data = UsersData()
+            data._pool = pool
+            data.cache = LookupCache()
+            await data.create_tables()
+            await seed(pool.writer, transactions, users)
+
+            # the migrations before the one to kopecks, which is number 5
+            later = data_managers.MIGRATIONS[4:]
+            del data_managers.MIGRATIONS[4:]
+            try:
+                await data.migrate()
+            finally:
+                data_managers.MIGRATIONS.extend(later)
+
+            print(f"float rubles, {transactions} transactions:")
+            await report(pool.writer, users)
+
+            start = time.perf_counter()
+            await data.migrate()
+            elapsed = time.perf_counter() - start
+            print(f"converted in {elapsed:.1f} s, {transactions / elapsed:.0f} "
+                  f"transactions/s, chunks of {data_managers.MIGRATION_CHUNK_ROWS}")
+
+            print("integer kopecks:")
+            await report(pool.writer, users)
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    transactions = args[0] if args else 2_000_000
+    users = args[1] if len(args) > 1 else 1000
+    asyncio.run(main(transactions, users))
@@ -0,0 +1,159 @@
+"""Fires concurrent mixed reads and writes at UsersData over the connection
+pool and checks that every handler saw only its own, consistent data.
+
+Some of the writes fail between the transactions rows and their rollups,
+the balances and statistics at the end show whether any of their rows
+were committed by the group commits of the others.
+
+    python3 -m benchmarks.pool_stress [operations] [users] [readers]
+"""
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import tempfile
+import time
+
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+CATEGORIES = 3
+ACCOUNTS = 2
+
+# set by the writes that fail on purpose, see FailingCursor
+FAILING = contextvars.ContextVar("failing", default=False)
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+class FailingCursor:
+    """Cursor proxy raising in add_transactions() after the transactions
+    rows are in and before the rollups, if FAILING is set."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    async def executemany(self, sql, parameters):
+        if FAILING.get() and "daily_totals" in sql:
+            raise InjectedFailure
+        await self._cur.executemany(sql, parameters)
+        return self
+
+
+async def operation(data, commits, rnd, user, expected, failed, errors):
+    categories = [f"c{user}_{i}" for i in range(CATEGORIES)]
+    accounts = [f"a{user}_{i}" for i in range(ACCOUNTS)]
+
+    match rnd.choice(["write", "write", "failing write", "balance", "statistics",
+                      "listing"]):
+        case "write" | "failing write" as kind:
+            amount = rnd.randint(1, 1000)
+            category_id = await data.get_category_id(user, rnd.choice(categories))
+            account_id = await data.get_account_id(user, rnd.choice(accounts))
+            if category_id == -1 or account_id == -1:
+                errors.append(f"user {user} lost a name")
+                return
+            if kind == "write":
+                expected[user] += amount
+                await data.add_transaction(user, amount, category_id, account_id)
+                await commits.commit()
+                return
+
+            FAILING.set(True)
+            try:
+                await data.add_transaction(user, amount, category_id, account_id)
+            except InjectedFailure:
+                failed[0] += 1
+            else:
+                errors.append(f"user {user} write did not fail")
+
+        case "balance":
+            balance = await data.get_balance(user)
+            if not 0 <= balance <= expected[user]:
+                errors.append(f"user {user} balance {balance} > {expected[user]}")
+
+        case "statistics":
+            total = await data.get_transactions_by_time(user, "2000-01-01", "2100-01-01")
+            if not 0 <= total <= expected[user]:
+                errors.append(f"user {user} statistics {total} > {expected[user]}")
+
+        case "listing":
+            names = await data.get_categories(user)
+            if sorted(names) != categories:
+                errors.append(f"user {user} listed {names}")
+
+
+async def main(operations, users, readers):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"), readers=readers)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                data = UsersData()
+                await data.init(pool)
+
+                commits = CommitScheduler()
+                await commits.init(tg, pool)
+                pool.wrap_cursor = FailingCursor
+
+                for user in range(1, users + 1):
+                    await data.add_user(user)
+                    for i in range(CATEGORIES):
+                        await data.add_category(user, f"c{user}_{i}")
+                    for i in range(ACCOUNTS):
+                        await data.add_account(user, f"a{user}_{i}")
+                await commits.commit()
+
+                rnd = random.Random(0)
+                expected = {user: 0 for user in range(1, users + 1)}
+                failed = [0]
+                errors = []
+
+                start = time.perf_counter()
+                await asyncio.gather(*(
+                        operation(data, commits, rnd, rnd.randint(1, users),
+                            expected, failed, errors)
+                        for _ in range(operations)))
+                elapsed = time.perf_counter() - start
+
+                for user in range(1, users + 1):
+                    balance = await data.get_balance(user)
+                    if balance != expected[user]:
+                        errors.append(f"user {user} final balance {balance} "
+                                      f"!= {expected[user]}")
+                    total = await data.get_transactions_by_time(user, "2000-01-01",
+                            "2100-01-01")
+                    if total != expected[user]:
+                        errors.append(f"user {user} final statistics {total} "
+                                      f"!= {expected[user]}")
+                drift = await data.verify_balances(repair=False)
+                if drift:
+                    errors.append(f"balances drifted: {drift}")
+
+                await commits.close()
+        finally:
+            await pool.close()
+
+    print(f"{operations} operations with {readers} readers in {elapsed:.2f} s "
+          f"({operations / elapsed:.0f} ops/s), {commits.stats()['commits']} commits, "
+          f"{failed[0]} writes failed on purpose")
+    for error in errors[:20]:
+        print("  " + error)
+    print("FAILED" if errors else "OK")
+    return not errors
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    operations = args[0] if args else 10_000
+    users = args[1] if len(args) > 1 else 100
+    readers = args[2] if len(args) > 2 else 4
+    sys.exit(0 if asyncio.run(main(operations, users, readers)) else 1)
@@ -0,0 +1,111 @@
+"""Latency of breakdown reports and charts under concurrent requests, and
+the worst event loop stall seen meanwhile by a ticker, with charts drawn
+inline on the loop and in the Reports process pool.
+
+    python3 -m benchmarks.reports [transactions] [users] [concurrency]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.indexes import seed
+from benchmarks.load import percentile
+from src import reports as reports_module
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+from src.reports import Reports
+
+YEARS = 5
+REQUESTS = 200
+
+
+async def measure(name, request, users, concurrency):
+    rnd = random.Random(0)
+    latencies = []
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - before - 0.001)
+
+    async def client(count):
+        for _ in range(count):
+            user = rnd.randint(1, users)
+            year = 2023 - rnd.randrange(YEARS)
+            start = time.perf_counter()
+            await request(user, f"{year}-01-01", f"{year}-12-31")
+            latencies.append(time.perf_counter() - start)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(client(REQUESTS // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done = True
+    await tick
+
+    print(f"{name:>24}: {len(latencies) / elapsed:7.1f} req/s "
+          f"p50={percentile(latencies, 0.50) * 1000:8.2f} ms "
+          f"p99={percentile(latencies, 0.99) * 1000:8.2f} ms "
+          f"worst stall={stall * 1000:7.2f} ms")
+
+
+async def main(transactions, users, concurrency):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+
+        try:
+            data = UsersData()
+            await data.init(pool)
+            await data.delete()
+            await data.create_tables()
+            await seed(pool.writer, transactions, users, YEARS)
+            await data.migrate()
+
+            reports = Reports()
+            await reports.init(data)
+            for user in range(1, users + 1):
+                await data.exists_user(user)
+
+            async def report(user, begin, end):
+                await reports.get_report(user, begin, end)
+
+            async def chart(user, begin, end):
+                await reports.get_chart(await reports.get_report(user, begin, end))
+
+            async def inline_chart(user, begin, end):
+                reports_module.render_chart(await reports.get_report(user, begin, end))
+
+            def drop():
+                data.cache.clear()
+                for user in range(1, users + 1):
+                    data.cache.add_user(user)
+
+            # start the worker processes before timing them
+            await asyncio.gather(*(chart(user, "2023-01-01", "2023-12-31")
+                    for user in range(1, 3)))
+
+            drop()
+            await measure("report, cold", report, users, concurrency)
+            await measure("report, cached", report, users, concurrency)
+            drop()
+            await measure("chart inline, cold", inline_chart, users, concurrency)
+            drop()
+            await measure("chart in processes, cold", chart, users, concurrency)
+            await measure("chart, cached", chart, users, concurrency)
+
+            await reports.close()
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [200_000, 50, 10][len(args):])))
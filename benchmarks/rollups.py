@@ -0,0 +1,80 @@
+"""Statistics range queries over raw transactions, daily_totals and the
+cached prefix sums used by UsersData.get_transactions_by_time.
+
+    python3 -m benchmarks.rollups [transactions] [users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.indexes import seed
+from src.data_managers import UsersData
+from src.pool import ConnectionPool
+
+YEARS = 5
+QUERIES = 200
+RANGES = [1, 7, 30, 365, 365 * YEARS]
+
+RAW = """SELECT sum(amount) FROM transactions
+        JOIN accounts ON transactions.account_id = accounts.account_id
+        WHERE owner_id = ? AND day BETWEEN ? AND ?"""
+
+ROLLUP = """SELECT sum(total) FROM daily_totals
+        WHERE owner_id = ? AND day BETWEEN ? AND ?"""
+
+
+async def measure(call, users, days):
+    rnd = random.Random(days)
+    last = date(2023, 12, 31)
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        begin = last - timedelta(days=rnd.randrange(365 * YEARS - days + 1) + days - 1)
+        end = begin + timedelta(days=days - 1)
+        await call(rnd.randint(1, users), begin.isoformat(), end.isoformat())
+    return (time.perf_counter() - start) / QUERIES
+
+
+async def main(transactions, users):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool()
+        await pool.init(os.path.join(directory, "data.db"))
+
+        try:
+            data = UsersData()
+            await data.init(pool)
+            await data.delete()
+            await data.create_tables()
+            await seed(pool.writer, transactions, users, YEARS)
+            await data.migrate()
+
+            for user in range(1, users + 1):
+                await data.exists_user(user)
+
+            def query(sql):
+                async def call(user, begin, end):
+                    async with pool.read() as cur:
+                        await cur.execute(sql, (user, begin, end))
+                        return await cur.fetchone()
+                return call
+
+            for days in RANGES:
+                raw_time = await measure(query(RAW), users, days)
+                rollup_time = await measure(query(ROLLUP), users, days)
+                prefix_time = await measure(data.get_transactions_by_time, users, days)
+                print(f"{days:>5} days: raw {raw_time * 1000:.3f} ms, "
+                      f"rollup {rollup_time * 1000:.3f} ms, "
+                      f"prefix sums {prefix_time * 1000:.3f} ms")
+        finally:
+            await pool.close()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    transactions = args[0] if args else 1_000_000
+    users = args[1] if len(args) > 1 else 100
+    asyncio.run(main(transactions, users))
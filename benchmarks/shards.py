@@ -0,0 +1,89 @@
+"""Write throughput of concurrent users as the number of SQLite shards
+grows, every write waiting for its group commit like a handler does.
+
+    python3 -m benchmarks.shards --users 200 --writes 50 --max-shards 8
+
+--commit-ms adds that many milliseconds to every commit to stand in
+for slower storage than the local disk, such as network volumes, where
+fsync latency rather than CPU bounds the write rate.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import UsersData
+from src.pool import ShardedPool, shard_paths
+
+
+def slow_commits(writer, delay):
+    commit = writer.commit
+
+    async def slow_commit():
+        await commit()
+        await asyncio.sleep(delay)
+
+    writer.commit = slow_commit
+
+
+async def run(directory, shards, users, writes, commit_delay):
+    pool = ShardedPool()
+    await pool.init(shard_paths(os.path.join(directory, "data.db"), shards), readers=1)
+    if commit_delay:
+        for writer in pool.writers:
+            slow_commits(writer, commit_delay)
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            data = UsersData()
+            await data.init(pool)
+            commits = CommitScheduler()
+            await commits.init(tg, pool)
+
+            ids = {}
+            for user in range(1, users + 1):
+                await data.add_user(user)
+                await data.add_category(user, "food")
+                await data.add_account(user, "card")
+                ids[user] = (await data.get_category_id(user, "food"),
+                             await data.get_account_id(user, "card"))
+            await commits.commit()
+
+            async def client(user):
+                category_id, account_id = ids[user]
+                for _ in range(writes):
+                    await data.add_transaction(user, 10, category_id, account_id)
+                    await commits.commit()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(user) for user in range(1, users + 1)))
+            elapsed = time.perf_counter() - start
+
+            stats = commits.stats()
+            await commits.close()
+    finally:
+        await pool.close()
+
+    return users * writes / elapsed, stats
+
+
+async def main(args):
+    shards = 1
+    while shards <= args.max_shards:
+        with tempfile.TemporaryDirectory() as directory:
+            rate, stats = await run(directory, shards, args.users, args.writes,
+                    args.commit_ms / 1000)
+        print(f"{shards:>2} shards: {rate:8.0f} writes/s, {stats['commits']} group commits, "
+              f"mean {stats['mean_commit_ms']:.2f} ms each")
+        shards *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=50, help="writes per user")
+    parser.add_argument("--max-shards", type=int, default=8)
+    parser.add_argument("--commit-ms", type=float, default=0)
+    asyncio.run(main(parser.parse_args()))
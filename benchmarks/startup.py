@@ -0,0 +1,99 @@
+"""Time to ready: how long a fresh bot process takes until it has
+answered its first update, started against the fake Bot API.
+
+    python3 -m benchmarks.startup --runs 5 --max-seconds 1.5
+
+With --max-seconds the exit status is 1 if the median exceeds it, so
+the script can guard against startup regressions.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_api import FakeBotApi
+from benchmarks.load import API_PORT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import sys, time, types
+started = time.perf_counter()
+config = types.ModuleType("src.config")
+config.__dict__.update({settings!r})
+sys.modules["src.config"] = config
+
+import asyncio, logging
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+from src import run
+print(f"src.run imported in {{time.perf_counter() - started:.3f}} s",
+      "pandas loaded" if "pandas" in sys.modules else "pandas not loaded",
+      file=sys.stderr)
+asyncio.run(run.main(started))
+"""
+
+
+async def start_once(directory):
+    replied = asyncio.Event()
+    api = FakeBotApi(lambda method, chat_id, reply_to, text: replied.set())
+    await api.start(port=API_PORT)
+    api.updates.put_nowait({"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()),
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "user"},
+        "text": "/start"}})
+
+    settings = {"TOKEN": "123456:bench", "ADMIN_ID": 0,
+                "API_SERVER": f"http://127.0.0.1:{API_PORT}",
+                "DB_PATH": os.path.join(directory, "data.db")}
+
+    start = time.perf_counter()
+    child = await asyncio.create_subprocess_exec(sys.executable, "-c",
+            CHILD.format(settings=settings), cwd=ROOT,
+            stderr=asyncio.subprocess.PIPE)
+    reply = asyncio.create_task(replied.wait())
+    exit = asyncio.create_task(child.wait())
+    try:
+        await asyncio.wait([reply, exit], timeout=60,
+                return_when=asyncio.FIRST_COMPLETED)
+        elapsed = time.perf_counter() - start
+    finally:
+        if child.returncode is None:
+            child.send_signal(signal.SIGINT)
+        _, stderr = await child.communicate()
+        reply.cancel()
+        await api.close()
+
+    if not replied.is_set():
+        raise RuntimeError("bot exited or timed out before replying:\n"
+                           + stderr.decode())
+
+    return elapsed, stderr.decode().strip().splitlines()
+
+
+async def main(args):
+    times = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed, log = await start_once(directory)
+        times.append(elapsed)
+        print(f"run {run + 1}: first reply {elapsed:.3f} s after spawn")
+        for line in log:
+            print(f"    {line}")
+
+    median = statistics.median(times)
+    print(f"median time to first reply: {median:.3f} s")
+    if args.max_seconds and median > args.max_seconds:
+        print(f"slower than {args.max_seconds} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,42 @@
+"""Load test throughput as the number of worker processes grows, against
+the single-process bot (0 workers) as the baseline.
+
+    python3 -m benchmarks.workers --max-workers 4 --users 200 --messages 20
+
+Each run is a fresh benchmarks.load process with WORKERS set, and SHARDS
+set to match so every worker writes only its own database file. Worker
+processes can only run in parallel on as many cores as the machine has.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def run(workers, args):
+    command = [sys.executable, "-m", "benchmarks.load", "--users", str(args.users),
+               "--messages", str(args.messages), "--mode", args.mode,
+               "--setting", f"WORKERS={workers}", "--setting", f"SHARDS={max(workers, 1)}"]
+    result = subprocess.run(command, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    lines = [line for line in result.stdout.splitlines() if "messages/s" in line]
+    if result.returncode != 0 or not lines:
+        raise SystemExit(f"{workers} workers failed:\n{result.stderr[-2000:]}")
+    return lines[0]
+
+
+def main(args):
+    print(f"{os.cpu_count()} cores")
+    workers = 0
+    while workers <= args.max_workers:
+        print(f"{workers:>2} workers: {run(workers, args)}", flush=True)
+        workers = workers * 2 if workers else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    main(parser.parse_args())
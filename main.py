@@ -1,5 +1,55 @@
+import time
+
+started = time.perf_counter()
+
 import asyncio
+import logging
+import os
+import subprocess
+import sys
+
 from src import run
 
+imported = time.perf_counter()
+
+PROFILE_FLAG = "--profile-startup"
+PROFILE_MODULES = 15
+
+
+def print_import_times():
+    """Imports src.run in a fresh interpreter under -X importtime and prints
+    the modules that took longest by their own time and with their imports."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import src.run"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True,
+            text=True)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                times.append((int(own), int(cumulative), name.strip()))
+
+    if result.returncode != 0 or not times:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+              else "import profiling failed")
+        return
+
+    for title, key in (("own", 0), ("cumulative", 1)):
+        print(f"slowest imports, {title} time:")
+        for timing in sorted(times, key=lambda timing: timing[key])[-PROFILE_MODULES:][::-1]:
+            print(f"  {timing[key] / 1000:8.1f} ms  {timing[2]}")
+
+
 if __name__ == '__main__':
-    asyncio.run(run.main())
\ No newline at end of file
+    if PROFILE_FLAG in sys.argv:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        print(f"src.run imported in {imported - started:.3f} s")
+
+        profiling = time.perf_counter()
+        print_import_times()
+        # keep the profiling run out of the ready and first update times
+        started += time.perf_counter() - profiling
+        asyncio.run(run.main(started))
+    else:
+        asyncio.run(run.main())
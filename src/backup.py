@@ -0,0 +1,150 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+# pages copied between pauses, 1024 pages of 4 KiB are 4 MiB
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01
+
+log = logging.getLogger(__name__)
+
+
+def copy_database(path, target, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+    """Online copy of the SQLite database at path into target, returns the
+    number of steps it took.
+
+    The source connection holds one read transaction for the whole copy,
+    so the copy is the snapshot of its start: writers committing meanwhile
+    neither wait for it nor make it start over. pages are copied per step
+    with a pause in between, during which the GIL and the disk are free.
+    The copy is written under a temporary name and renamed when complete.
+    """
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if remaining:
+            time.sleep(pause)
+
+    partial = target + ".partial"
+    source = sqlite3.connect(path, isolation_level=None)
+    try:
+        source.execute("""PRAGMA busy_timeout = 5000""")
+        source.execute("""BEGIN""")
+        source.execute("""SELECT count(*) FROM sqlite_master""").fetchone()
+        destination = sqlite3.connect(partial)
+        try:
+            source.backup(destination, pages=pages, progress=progress)
+        finally:
+            destination.close()
+        source.execute("""COMMIT""")
+        # moves what the WAL holds into the database without waiting for
+        # writers, so the WAL does not grow from one backup to the next
+        source.execute("""PRAGMA wal_checkpoint(PASSIVE)""").fetchone()
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        source.close()
+
+    os.replace(partial, target)
+    return steps
+
+
+class Backup:
+    """Periodic online copies of every shard into directory.
+
+    Every interval seconds each shard is copied by copy_database() in a
+    thread, one shard after the other, as <name>-<time>.db, and all but
+    the newest keep copies of it are removed. Handlers go on reading and
+    writing throughout. A failed copy is logged and retried at the next
+    interval.
+    """
+    _tg = None
+    _task = None
+
+    async def init(self, tg, paths, directory, interval, keep=3, pages=BACKUP_PAGES,
+                   pause=BACKUP_PAUSE):
+        self._tg = tg
+        self._paths = paths
+        self._directory = directory
+        self._interval = interval
+        self._keep = keep
+        self._pages = pages
+        self._pause = pause
+        os.makedirs(directory, exist_ok=True)
+
+        self.running = 0
+        self.runs = 0
+        self.failures = 0
+        self.duration = 0.0
+        self.size = 0
+        self.steps = 0
+
+        self._task = tg.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.run()
+            except Exception:
+                self.failures += 1
+                log.exception("Backup failed")
+
+    async def run(self):
+        """Copies every shard once, returns the paths of the copies."""
+        self.running = 1
+        start = time.perf_counter()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        copies = []
+        steps = 0
+        try:
+            for path in self._paths:
+                root, extension = os.path.splitext(os.path.basename(path))
+                target = os.path.join(self._directory, f"{root}-{stamp}{extension}")
+                steps += await asyncio.to_thread(copy_database, path, target,
+                        self._pages, self._pause)
+                copies.append(target)
+                self._prune(root, extension)
+        finally:
+            self.running = 0
+
+        self.runs += 1
+        self.duration = time.perf_counter() - start
+        self.size = sum(os.path.getsize(copy) for copy in copies)
+        self.steps = steps
+        log.info("Backed up %d files, %.1f MB in %.1f s", len(copies),
+                self.size / 2 ** 20, self.duration)
+        return copies
+
+    def _prune(self, root, extension):
+        # the time stamps sort in the order the copies were made
+        copies = sorted(glob.glob(os.path.join(glob.escape(self._directory),
+                f"{glob.escape(root)}-*{extension}")))
+        for old in copies[:-self._keep]:
+            os.remove(old)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "duration_s": self.duration,
+            "size_bytes": self.size,
+            "steps": self.steps,
+        }
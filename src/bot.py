@@ -1,23 +1,22 @@
-from aiogram import Bot, types
-from aiogram.dispatcher import Dispatcher
-from aiogram.utils import executor
-from aiogram.types import InlineKeyboardMarkup
-from aiogram.types import InlineKeyboardButton
-from aiogram.types import ReplyKeyboardMarkup
+from aiogram import types
 from aiogram.types import ReplyKeyboardRemove
-from aiogram.types import KeyboardButton
 
 from datetime import datetime
 
+import csv
+import html
+import os
+import tempfile
+import time
+
 import src.config as config
 import src.messages as messages
 
-def isfloat(number):
-    try:
-        float(number)
-        return True
-    except ValueError:
-        return False
+from src.exporter import export_csv
+from src.importer import import_csv
+from src.money import format_amount, is_amount, parse_amount
+
+IMPORT_PROGRESS_INTERVAL = 2.0
 
 def is_date_correct(date):
     try:
@@ -30,68 +29,87 @@ def is_date_correct(date):
 class MessageHandler:
     _tg = None
     _data = None
-    _con = None
-
-    async def init(self, tg, data, con):
+    _commits = None
+    _outbox = None
+    _reports = None
+    _reaper = None
+    _digests = None
+
+    async def init(self, tg, data, commits, outbox, reports=None, reaper=None,
+                   digests=None):
         self._tg = tg
         self._data = data
-        self._con = con
+        self._commits = commits
+        self._outbox = outbox
+        self._reports = reports
+        self._reaper = reaper
+        self._digests = digests
+
+    def _reap(self):
+        if self._reaper is not None:
+            self._reaper.wake()
 
     async def add_category_message(self, message, name):
         user_id = message.from_user.id
         exists = await self._data.exists_category(user_id, name)
 
         if exists:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DOUBLE_CATEGORY_ADD.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         else:
             await self._data.add_category(user_id, name)
-            self._tg.create_task(message.reply(
+            await self._commits.commit()
+            await self._outbox.reply(message,
                     messages.SUCCESSFUL_CATEGORY_ADD.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def add_account_message(self, message, name):
         user_id = message.from_user.id
         exists = await self._data.exists_account(user_id, name)
 
         if exists:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DOUBLE_ACCOUNT_ADD.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         else:
             await self._data.add_account(user_id, name)
-            self._tg.create_task(message.reply(
+            await self._commits.commit()
+            await self._outbox.reply(message,
                     messages.SUCCESSFUL_ACCOUNT_ADD.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def delete_category_message(self, message, name):
         user_id = message.from_user.id
         category_id = await self._data.get_category_id(user_id, name)
 
         if category_id == -1:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.CATEGORY_NOT_EXIST.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         else:
             await self._data.delete_category(user_id, category_id)
-            self._tg.create_task(message.reply(
+            await self._commits.commit()
+            self._reap()
+            await self._outbox.reply(message,
                     messages.SUCCESSFUL_CATEGORY_DELETE.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def delete_account_message(self, message, name):
         user_id = message.from_user.id
         account_id = await self._data.get_account_id(user_id, name)
 
         if account_id == -1:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.ACCOUNT_NOT_EXIST.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         else:
             await self._data.delete_account(user_id, account_id)
-            self._tg.create_task(message.reply(
+            await self._commits.commit()
+            self._reap()
+            await self._outbox.reply(message,
                     messages.SUCCESSFUL_ACCOUNT_DELETE.format(name=name),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def add_transaction_message(self, message, amount, category, account):
         user_id = message.from_user.id
@@ -100,125 +118,164 @@ class MessageHandler:
 
         match category_id, account_id:
             case -1, -1:
-                self._tg.create_task(message.reply(
+                await self._outbox.reply(message,
                         messages.CATEGORY_AND_ACCOUNT_NOT_EXIST.format(
                         category=category, account=account),
-                        parse_mode=types.ParseMode.HTML))
+                        parse_mode=types.ParseMode.HTML)
             case -1, _:
-                self._tg.create_task(message.reply(
+                await self._outbox.reply(message,
                         messages.CATEGORY_NOT_EXIST.format(name=category),
-                        parse_mode=types.ParseMode.HTML))
+                        parse_mode=types.ParseMode.HTML)
             case _, -1:
-                self._tg.create_task(message.reply(
+                await self._outbox.reply(message,
                         messages.ACCOUNT_NOT_EXIST.format(name=account),
-                        parse_mode=types.ParseMode.HTML))
+                        parse_mode=types.ParseMode.HTML)
             case _, _:
-                await self._data.add_transaction(user_id, 
-                        float(amount.replace(',', '.')), category_id, account_id)
-                self._tg.create_task(message.reply(
-                        messages.TRANSACTION_ADD.format(amount=amount, 
+                minor = parse_amount(amount)
+                await self._data.add_transaction(user_id, minor, category_id, account_id)
+                await self._commits.commit()
+                await self._outbox.reply(message,
+                        messages.TRANSACTION_ADD.format(amount=format_amount(minor),
                             category=category, account=account),
-                        parse_mode=types.ParseMode.HTML))
+                        parse_mode=types.ParseMode.HTML)
 
     async def get_account_balance_message(self, message, account):
         user_id = message.from_user.id
         exists = await self._data.exists_account(user_id, account)
 
         if not exists:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.ACCOUNT_NOT_EXIST.format(name=account),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         else:
             balance = await self._data.get_balance(user_id, account)
-            self._tg.create_task(message.reply(
-                    messages.ACCOUNT_BALANCE.format(balance=round(balance, 2),
+            await self._outbox.reply(message,
+                    messages.ACCOUNT_BALANCE.format(balance=format_amount(balance),
                         account=account), 
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def get_balance_message(self, message):
         user_id = message.from_user.id
         balance = await self._data.get_balance(user_id)
 
-        self._tg.create_task(message.reply(
-                messages.BALANCE.format(balance=round(balance, 2)),
-                parse_mode=types.ParseMode.HTML))
+        await self._outbox.reply(message,
+                messages.BALANCE.format(balance=format_amount(balance)),
+                parse_mode=types.ParseMode.HTML)
 
     async def get_category_statistics_message(self, message, begin, end, category):
         user_id = message.from_user.id
         category_id = await self._data.get_category_id(user_id, category)
 
         if category_id == -1:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.CATEGORY_NOT_EXIST.format(name=category),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         elif not is_date_correct(begin):
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DATE_INCORRECT.format(date=begin),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         elif not is_date_correct(end):
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DATE_INCORRECT.format(date=end),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         elif begin > end:
-            self._tg.create_task(message.reply(messages.DATE_ORDER_INCORRECT,
-                    parse_mode=types.ParseMode.HTML))
+            await self._outbox.reply(message, messages.DATE_ORDER_INCORRECT,
+                    parse_mode=types.ParseMode.HTML)
         else:
             result = await self._data.get_transactions_by_time(user_id, begin, 
                     end, category_id)
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.TIME_STATISTICS_CATEGORY.format(begin=begin,
-                        end=end, amount=result, category=category),
-                    parse_mode=types.ParseMode.HTML))
+                        end=end, amount=format_amount(result), category=category),
+                    parse_mode=types.ParseMode.HTML)
 
     async def get_statistics_message(self, message, begin, end):
         user_id = message.from_user.id
 
         if not is_date_correct(begin):
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DATE_INCORRECT.format(date=begin),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         elif not is_date_correct(end):
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.DATE_INCORRECT.format(date=end),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
         elif begin > end:
-            self._tg.create_task(message.reply(messages.DATE_ORDER_INCORRECT,
-                    parse_mode=types.ParseMode.HTML))
+            await self._outbox.reply(message, messages.DATE_ORDER_INCORRECT,
+                    parse_mode=types.ParseMode.HTML)
         else:
             result = await self._data.get_transactions_by_time(user_id, begin, end)
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.TIME_STATISTICS.format(begin=begin,
-                        end=end, amount=result),
-                    parse_mode=types.ParseMode.HTML))
+                        end=end, amount=format_amount(result)),
+                    parse_mode=types.ParseMode.HTML)
+
+    async def get_report_message(self, message, begin, end, chart=False):
+        user_id = message.from_user.id
+
+        if not is_date_correct(begin):
+            await self._outbox.reply(message,
+                    messages.DATE_INCORRECT.format(date=begin),
+                    parse_mode=types.ParseMode.HTML)
+        elif not is_date_correct(end):
+            await self._outbox.reply(message,
+                    messages.DATE_INCORRECT.format(date=end),
+                    parse_mode=types.ParseMode.HTML)
+        elif begin > end:
+            await self._outbox.reply(message, messages.DATE_ORDER_INCORRECT,
+                    parse_mode=types.ParseMode.HTML)
+        else:
+            report = await self._reports.get_report(user_id, begin, end)
+            if not report.days:
+                await self._outbox.reply(message,
+                        messages.REPORT_EMPTY.format(begin=begin, end=end),
+                        parse_mode=types.ParseMode.HTML)
+            elif chart:
+                await self._outbox.reply_photo(message,
+                        await self._reports.get_chart(report),
+                        caption=messages.REPORT_CHART.format(begin=begin, end=end,
+                            amount=format_amount(report.total)),
+                        parse_mode=types.ParseMode.HTML)
+            else:
+                await self._outbox.reply(message,
+                        messages.REPORT.format(begin=begin, end=end,
+                            amount=format_amount(report.total),
+                            categories="\n".join(messages.REPORT_LINE.format(
+                                name=name, amount=format_amount(amount))
+                                for name, amount in report.categories),
+                            accounts="\n".join(messages.REPORT_LINE.format(
+                                name=name, amount=format_amount(amount))
+                                for name, amount in report.accounts)),
+                        parse_mode=types.ParseMode.HTML)
 
     async def get_categories_message(self, message):
         user_id = message.from_user.id
         categories = await self._data.get_categories(user_id)
 
         if not categories:
-            self._tg.create_task(message.reply(messages.NO_CATEGORIES,
-                    parse_mode=types.ParseMode.HTML))
+            await self._outbox.reply(message, messages.NO_CATEGORIES,
+                    parse_mode=types.ParseMode.HTML)
         else:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.CATEGORIES.format(
                         categories=messages.CATEGORIES_SEP.join(categories)),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def get_accounts_message(self, message):
         user_id = message.from_user.id
         accounts = await self._data.get_accounts(user_id)
 
         if not accounts:
-            self._tg.create_task(message.reply(messages.NO_ACCOUNTS,
-                    parse_mode=types.ParseMode.HTML))
+            await self._outbox.reply(message, messages.NO_ACCOUNTS,
+                    parse_mode=types.ParseMode.HTML)
         else:
-            self._tg.create_task(message.reply(
+            await self._outbox.reply(message,
                     messages.ACCOUNTS.format(
                         accounts=messages.ACCOUNTS_SEP.join(accounts)),
-                    parse_mode=types.ParseMode.HTML))
+                    parse_mode=types.ParseMode.HTML)
 
     async def unknown_command_message(self, message):
-        self._tg.create_task(message.reply(messages.UNKNOWN_COMMAND))
+        await self._outbox.reply(message, messages.UNKNOWN_COMMAND)
 
     async def start_message(self, message):
         user_id = message.from_user.id
@@ -226,27 +283,241 @@ class MessageHandler:
 
         if not result:
             result = await self._data.add_user(user_id)
+            await self._commits.commit()
 
-        self._tg.create_task(message.reply(messages.START))
-        self._tg.create_task(self._con.commit())
+        await self._outbox.reply(message, messages.START)
 
     async def recreate_message(self, message):
         if message.from_user.id == config.ADMIN_ID:
-            await self._data.delete()
-            await self._data.create()
+            await self._data.delete_all()
+            await self._commits.commit()
+            self._reap()
+
+            await self._outbox.reply(message, messages.RECREATE_DONE,
+                    reply_markup=ReplyKeyboardRemove())
+
+    async def verify_message(self, message):
+        if message.from_user.id == config.ADMIN_ID:
+            drift = await self._data.verify_balances()
+            await self._commits.commit()
+
+            await self._outbox.reply(message,
+                    messages.VERIFY_DONE.format(drift=len(drift)),
+                    parse_mode=types.ParseMode.HTML)
+
+    async def stats_message(self, message):
+        if message.from_user.id == config.ADMIN_ID:
+            cache = self._data.cache.stats()
+            commits = self._commits.stats()
+            outbox = self._outbox.stats()
+            reaper = (self._reaper.stats() if self._reaper is not None
+                      else {"rows": 0, "mean_chunk_ms": 0.0, "max_chunk_ms": 0.0})
+            digests = (self._digests.stats() if self._digests is not None
+                       else {"sent": 0, "duration_s": 0.0, "rate": 0.0})
+            tombstones = await self._data.count_tombstones()
+
+            await self._outbox.reply(message,
+                    messages.STATS.format(
+                        cache_hits=cache["hits"], cache_misses=cache["misses"],
+                        cache_hit_rate=round(cache["hit_rate"] * 100, 1),
+                        cache_users=cache["users"], cache_size=cache["size"],
+                        cache_evictions=cache["evictions"],
+                        commits=commits["commits"], writes=commits["writes"],
+                        mean_batch=round(commits["mean_batch"], 1),
+                        max_batch=commits["max_batch"],
+                        mean_commit_ms=round(commits["mean_commit_ms"], 2),
+                        max_commit_ms=round(commits["max_commit_ms"], 2),
+                        outbox_depth=outbox["depth"],
+                        outbox_max_depth=outbox["max_depth"],
+                        outbox_sent=outbox["sent"], outbox_merged=outbox["merged"],
+                        outbox_retries=outbox["retries"],
+                        outbox_errors=outbox["errors"],
+                        send_mean_ms=round(outbox["mean_latency_ms"], 2),
+                        send_max_ms=round(outbox["max_latency_ms"], 2),
+                        tombstones=tombstones, reaped=reaper["rows"],
+                        reap_mean_ms=round(reaper["mean_chunk_ms"], 2),
+                        reap_max_ms=round(reaper["max_chunk_ms"], 2),
+                        digest_sent=digests["sent"],
+                        digest_seconds=round(digests["duration_s"], 1),
+                        digest_rate=round(digests["rate"], 1),
+                        digest_queued=outbox["background_depth"]),
+                    parse_mode=types.ParseMode.HTML)
+
+    async def batch_message(self, message, lines):
+        user_id = message.from_user.id
+        today = datetime.today().strftime('%Y-%m-%d')
+        transactions = []
+        errors = []
+        done = 0
+
+        # one write sequence, a group commit cannot take half of the batch
+        async with self._data.writing(user_id):
+            for number, line in enumerate(lines, 1):
+                tokens = [word.lower() for word in line.split()]
+                error = None
+
+                match tokens:
+                    case "добавить"|"доб", "категорию"|"кат", name:
+                        if await self._data.exists_category(user_id, name):
+                            error = messages.DOUBLE_CATEGORY_ADD.format(
+                                    name=html.escape(name))
+                        else:
+                            await self._data.add_category(user_id, name)
+
+                    case "добавить"|"доб", "счет"|"счёт", name:
+                        if await self._data.exists_account(user_id, name):
+                            error = messages.DOUBLE_ACCOUNT_ADD.format(
+                                    name=html.escape(name))
+                        else:
+                            await self._data.add_account(user_id, name)
+
+                    case "удалить"|"уд", "категорию"|"кат", name:
+                        category_id = await self._data.get_category_id(user_id, name)
+                        if category_id == -1:
+                            error = messages.CATEGORY_NOT_EXIST.format(
+                                    name=html.escape(name))
+                        else:
+                            await self._data.add_transactions(user_id, transactions)
+                            transactions = []
+                            await self._data.delete_category(user_id, category_id)
+
+                    case "удалить"|"уд", "счет"|"счёт", name:
+                        account_id = await self._data.get_account_id(user_id, name)
+                        if account_id == -1:
+                            error = messages.ACCOUNT_NOT_EXIST.format(
+                                    name=html.escape(name))
+                        else:
+                            await self._data.add_transactions(user_id, transactions)
+                            transactions = []
+                            await self._data.delete_account(user_id, account_id)
+
+                    case amount, category, account if is_amount(amount):
+                        category_id = await self._data.get_category_id(user_id, category)
+                        account_id = await self._data.get_account_id(user_id, account)
+
+                        match category_id, account_id:
+                            case -1, -1:
+                                error = messages.CATEGORY_AND_ACCOUNT_NOT_EXIST.format(
+                                        category=html.escape(category),
+                                        account=html.escape(account))
+                            case -1, _:
+                                error = messages.CATEGORY_NOT_EXIST.format(
+                                        name=html.escape(category))
+                            case _, -1:
+                                error = messages.ACCOUNT_NOT_EXIST.format(
+                                        name=html.escape(account))
+                            case _, _:
+                                transactions.append((parse_amount(amount),
+                                        category_id, account_id, today))
+
+                    case _:
+                        error = messages.BATCH_UNKNOWN_LINE
+
+                if error is None:
+                    done += 1
+                else:
+                    errors.append(messages.BATCH_LINE_ERROR.format(number=number,
+                            line=html.escape(line.strip()), error=error))
+
+            if done:
+                await self._data.add_transactions(user_id, transactions)
+
+        if done:
+            await self._commits.commit()
+            self._reap()
+
+        await self._outbox.reply(message,
+                messages.BATCH_DONE.format(done=done, total=len(lines))
+                + "".join(errors),
+                parse_mode=types.ParseMode.HTML)
+
+    async def import_message(self, message):
+        user_id = message.from_user.id
+        # only shown, in HTML replies
+        name = html.escape(message.document.file_name or "import.csv")
+        status = await self._outbox.reply_status(message,
+                messages.IMPORT_STARTED.format(name=name),
+                parse_mode=types.ParseMode.HTML)
+        edited = time.monotonic()
+
+        async def progress(read, imported):
+            nonlocal edited
+            if time.monotonic() - edited >= IMPORT_PROGRESS_INTERVAL:
+                edited = time.monotonic()
+                await self._outbox.edit(message.chat.id, status,
+                        messages.IMPORT_PROGRESS.format(name=name, read=read,
+                            imported=imported),
+                        parse_mode=types.ParseMode.HTML)
+
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+        try:
+            await message.document.download(destination_file=path)
+            imported, error_count, error_lines = await import_csv(self._data,
+                    self._commits, user_id, path, progress)
+        except (OSError, EOFError, UnicodeDecodeError, csv.Error):
+            await self._outbox.edit(message.chat.id, status,
+                    messages.IMPORT_FAILED.format(name=name),
+                    parse_mode=types.ParseMode.HTML)
+            return
+        finally:
+            os.remove(path)
+
+        text = messages.IMPORT_DONE.format(name=name, imported=imported)
+        if error_count:
+            text += messages.IMPORT_ERRORS.format(count=error_count,
+                    lines=", ".join(map(str, error_lines)))
+        await self._outbox.edit(message.chat.id, status, text,
+                parse_mode=types.ParseMode.HTML)
+
+    async def export_message(self, message):
+        user_id = message.from_user.id
+        name = f"transactions-{datetime.today().strftime('%Y-%m-%d')}.csv.gz"
+
+        handle, path = tempfile.mkstemp(suffix=".csv.gz")
+        os.close(handle)
+        try:
+            count = await export_csv(self._data, user_id, path)
+            if not count:
+                await self._outbox.reply(message, messages.NO_TRANSACTIONS)
+                return
+
+            await self._outbox.reply_document(message, path, name,
+                    caption=messages.EXPORT_DONE.format(count=count),
+                    parse_mode=types.ParseMode.HTML)
+        finally:
+            os.remove(path)
+
+    async def document_message(self, message):
+        user_id = message.from_user.id
+        result = await self._data.exists_user(user_id)
+        if not result:
+            await self._outbox.reply(message, messages.REGISTER_REQUIRED)
+            return
 
-            self._tg.create_task(message.reply(messages.RECREATE_DONE,
-                    reply_markup=ReplyKeyboardRemove()))
-            self._tg.create_task(self._con.commit())
+        caption = (message.caption or "").strip().lower()
+        name = (message.document.file_name or "").lower()
+        if caption in ("импорт", "import") or name.endswith((".csv", ".csv.gz")):
+            await self.import_message(message)
+        else:
+            await self.unknown_command_message(message)
+
+    async def busy_message(self, message):
+        await self._outbox.reply(message, messages.BUSY)
 
     async def help_message(self, message):
-        await message.reply(messages.HELP, parse_mode=types.ParseMode.HTML)
+        await self._outbox.reply(message, messages.HELP, parse_mode=types.ParseMode.HTML)
 
     async def reply_message(self, message):
         user_id = message.from_user.id
         result = await self._data.exists_user(user_id)
         if not result:
-            await message.reply(messages.REGISTER_REQUIRED)
+            await self._outbox.reply(message, messages.REGISTER_REQUIRED)
+            return
+
+        lines = [line for line in message.text.splitlines() if line.strip()]
+        if len(lines) > 1:
+            await self.batch_message(message, lines)
             return
 
         tokens = [word.lower() for word in message.text.split()]
@@ -264,7 +535,7 @@ class MessageHandler:
             case "удалить"|"уд", "счет"|"счёт", name:
                 await self.delete_account_message(message, name)
 
-            case amount, category, account if isfloat(amount.replace(',', '.')):
+            case amount, category, account if is_amount(amount):
                 await self.add_transaction_message(message, amount, category, account)
 
             case "баланс"|"бал", account:
@@ -279,13 +550,20 @@ class MessageHandler:
             case "статистика"|"стата", begin, end:
                 await self.get_statistics_message(message, begin, end)
 
+            case "отчет"|"отчёт", begin, end:
+                await self.get_report_message(message, begin, end)
+
+            case "график", begin, end:
+                await self.get_report_message(message, begin, end, chart=True)
+
             case "категории",:
                 await self.get_categories_message(message)
 
             case "счета",:
                 await self.get_accounts_message(message)
 
+            case "экспорт",:
+                await self.export_message(message)
+
             case _:
                 await self.unknown_command_message(message)
-
-        self._tg.create_task(self._con.commit())
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+
+
+class UserEntry:
+    def __init__(self):
+        self.categories = None
+        self.accounts = None
+        self.totals = None
+        self.reports = None
+        self.version = 0
+
+    def weight(self):
+        return (1 + len(self.categories or ())
+                + len(self.accounts or ())
+                + sum(len(days) for days, _ in (self.totals or {}).values())
+                + sum(report.weight() for report in (self.reports or {}).values()))
+
+
+class LookupCache:
+    """LRU cache of registered users, their category/account name→id maps,
+    prefix sums of their daily totals and their breakdown reports.
+
+    The bound is the total number of cached items, every user costs one
+    slot plus one per cached category, account and prefix sum day, and
+    a report costs one per line in it. Reports depend on everything, so
+    any invalidation of a user drops them.
+
+    Loads run concurrently with writes, so a loader takes version() before
+    reading and set_*() drops the result if the user was invalidated since.
+    """
+    DEFAULT_SIZE = 100_000
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self._size = size
+        self._weight = 0
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _touch(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is not None:
+            self._users.move_to_end(user_id)
+        return entry
+
+    def _reweigh(self, entry, before):
+        self._weight += entry.weight() - before
+
+        while self._weight > self._size and len(self._users) > 1:
+            _, evicted = self._users.popitem(last=False)
+            self._weight -= evicted.weight()
+            self.evictions += 1
+
+    def has_user(self, user_id):
+        found = self._touch(user_id) is not None
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def add_user(self, user_id):
+        if self._touch(user_id) is None:
+            entry = self._users[user_id] = UserEntry()
+            self._reweigh(entry, 0)
+
+    def version(self, user_id):
+        entry = self._users.get(user_id)
+        return None if entry is None else entry.version
+
+    def get_names(self, user_id, kind):
+        entry = self._touch(user_id)
+        names = None if entry is None else getattr(entry, kind)
+        if names is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return names
+
+    def set_names(self, user_id, kind, names, version):
+        entry = self._touch(user_id)
+        if entry is not None and entry.version == version:
+            before = entry.weight()
+            setattr(entry, kind, names)
+            self._reweigh(entry, before)
+
+    def get_totals(self, user_id, category_id):
+        entry = self._touch(user_id)
+        totals = None
+        if entry is not None and entry.totals is not None:
+            totals = entry.totals.get(category_id)
+        if totals is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return totals
+
+    def set_totals(self, user_id, category_id, totals, version):
+        entry = self._touch(user_id)
+        if entry is not None and entry.version == version:
+            before = entry.weight()
+            if entry.totals is None:
+                entry.totals = {}
+            entry.totals[category_id] = totals
+            self._reweigh(entry, before)
+
+    def get_report(self, user_id, key):
+        entry = self._touch(user_id)
+        report = None
+        if entry is not None and entry.reports is not None:
+            report = entry.reports.get(key)
+        if report is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return report
+
+    def set_report(self, user_id, key, report, version):
+        entry = self._touch(user_id)
+        if entry is not None and entry.version == version:
+            before = entry.weight()
+            if entry.reports is None:
+                entry.reports = {}
+            entry.reports[key] = report
+            self._reweigh(entry, before)
+
+    def invalidate(self, user_id, kind):
+        entry = self._users.get(user_id)
+        if entry is not None:
+            before = entry.weight()
+            entry.version += 1
+            setattr(entry, kind, None)
+            entry.reports = None
+            self._weight += entry.weight() - before
+
+    def clear(self):
+        self._users.clear()
+        self._weight = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "users": len(self._users),
+            "size": self._weight,
+        }
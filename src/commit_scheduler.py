@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+
+class CommitScheduler:
+    """Merges the writes of concurrent handlers into group commits on the
+    pool's WAL writer connections.
+
+    A handler calls commit() after its writes and waits until they are
+    durable. Every writer has its own pending batch, committed once it
+    reaches max_batch writes or its oldest write waited for max_delay
+    seconds, so shards commit independently of each other. commit()
+    waits for every writer that holds an open transaction at the time,
+    a writer without one has nothing of the caller left to commit. A
+    commit waits for the write sequences open on its writer to end, see
+    ConnectionPool.committing().
+    """
+    _writers = None
+    _tasks = None
+
+    async def init(self, tg, pool, max_delay=0.01, max_batch=64):
+        self._shards = pool.shards
+        self._writers = [shard.writer for shard in self._shards]
+        self._max_delay = max_delay
+        self._max_batch = max_batch
+
+        self._pending = [[] for _ in self._writers]
+        self._wakeup = [asyncio.Event() for _ in self._writers]
+        self._full = [asyncio.Event() for _ in self._writers]
+        self._closing = False
+
+        self.commits = 0
+        self.writes = 0
+        self.max_batch_size = 0
+        self.commit_time = 0.0
+        self.max_commit_time = 0.0
+
+        self._tasks = [tg.create_task(self._run(number))
+                       for number in range(len(self._writers))]
+
+    async def commit(self):
+        futures = []
+        for number, writer in enumerate(self._writers):
+            if not writer.in_transaction:
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            self._pending[number].append(future)
+            futures.append(future)
+
+            self._wakeup[number].set()
+            if len(self._pending[number]) >= self._max_batch:
+                self._full[number].set()
+
+        if futures:
+            await asyncio.gather(*futures)
+
+    async def _run(self, number):
+        while not self._closing or self._pending[number]:
+            await self._wakeup[number].wait()
+
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full[number].wait(), self._max_delay)
+                except TimeoutError:
+                    pass
+
+            await self.flush(number)
+
+    async def flush(self, number=0):
+        batch, self._pending[number] = self._pending[number], []
+        self._wakeup[number].clear()
+        self._full[number].clear()
+        if not batch:
+            return
+
+        start = time.perf_counter()
+        try:
+            async with self._shards[number].committing() as writer:
+                await writer.commit()
+        except Exception as error:
+            for future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        elapsed = time.perf_counter() - start
+        self.commits += 1
+        self.writes += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.commit_time += elapsed
+        self.max_commit_time = max(self.max_commit_time, elapsed)
+
+        for future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        self._closing = True
+        for number in range(len(self._writers)):
+            self._wakeup[number].set()
+            self._full[number].set()
+        await asyncio.gather(*self._tasks)
+
+    def stats(self):
+        return {
+            "commits": self.commits,
+            "writes": self.writes,
+            "mean_batch": self.writes / self.commits if self.commits else 0.0,
+            "max_batch": self.max_batch_size,
+            "mean_commit_ms": (self.commit_time / self.commits * 1000
+                    if self.commits else 0.0),
+            "max_commit_ms": self.max_commit_time * 1000,
+        }
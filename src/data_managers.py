@@ -1,82 +1,499 @@
+import contextvars
+from bisect import bisect_left, bisect_right
 from datetime import datetime
+from itertools import accumulate
+
+from src.cache import LookupCache
+
+
+REBUILD_BALANCES = """INSERT OR REPLACE INTO account_balances (account_id, owner_id, total)
+    SELECT accounts.account_id, accounts.owner_id, coalesce(sum(amount), 0)
+    FROM accounts LEFT JOIN transactions
+        ON transactions.account_id = accounts.account_id
+            AND transactions.category_id NOT IN (
+                SELECT category_id FROM categories WHERE deleted = 1)
+    WHERE accounts.deleted = 0
+    GROUP BY accounts.account_id"""
+
+MIGRATION_CHUNK_ROWS = 50_000
+
+# update_id of the Telegram update the running handler serves, see
+# UsersData.track_updates()
+APPLYING = contextvars.ContextVar("applying", default=None)
+# update ids looked up per query, well below SQLite's variable limit
+APPLIED_PAGE = 500
+
+
+class Chunked:
+    """Migration step for tables too large to rewrite in one transaction.
+
+    Every statement takes a (low, high] range of key, the step runs them
+    over consecutive ranges of about MIGRATION_CHUNK_ROWS rows of table
+    and commits each range together with its upper bound in
+    migration_progress, so an interrupted migration resumes after the
+    last committed range instead of converting rows twice.
+    """
+
+    def __init__(self, table, key, *statements):
+        self.table = table
+        self.key = key
+        self.statements = statements
+
+
+# Every entry upgrades the schema by one version, PRAGMA user_version
+# stores the number of entries already applied to the database file.
+MIGRATIONS = [
+    # 1: unique names per owner and covering indexes for the hot queries
+    [
+        """UPDATE transactions SET category_id = (
+            SELECT min(other.category_id) FROM categories AS this
+            JOIN categories AS other
+                ON (this.owner_id, this.name) = (other.owner_id, other.name)
+            WHERE this.category_id = transactions.category_id)
+            WHERE category_id IN (SELECT category_id FROM categories
+                WHERE category_id NOT IN (SELECT min(category_id) FROM categories
+                    GROUP BY owner_id, name))""",
+        """DELETE FROM categories WHERE category_id NOT IN (
+            SELECT min(category_id) FROM categories GROUP BY owner_id, name)""",
+        """UPDATE transactions SET account_id = (
+            SELECT min(other.account_id) FROM accounts AS this
+            JOIN accounts AS other
+                ON (this.owner_id, this.name) = (other.owner_id, other.name)
+            WHERE this.account_id = transactions.account_id)
+            WHERE account_id IN (SELECT account_id FROM accounts
+                WHERE account_id NOT IN (SELECT min(account_id) FROM accounts
+                    GROUP BY owner_id, name))""",
+        """DELETE FROM accounts WHERE account_id NOT IN (
+            SELECT min(account_id) FROM accounts GROUP BY owner_id, name)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS categories_owner_name
+            ON categories (owner_id, name)""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS accounts_owner_name
+            ON accounts (owner_id, name)""",
+        """CREATE INDEX IF NOT EXISTS transactions_account_day
+            ON transactions (account_id, day, amount)""",
+        """CREATE INDEX IF NOT EXISTS transactions_category_day
+            ON transactions (category_id, day, amount)""",
+    ],
+    # 2: materialized per-account balances
+    [
+        """CREATE TABLE IF NOT EXISTS account_balances (
+            account_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0
+            )""",
+        """CREATE INDEX IF NOT EXISTS account_balances_owner
+            ON account_balances (owner_id)""",
+        """INSERT OR REPLACE INTO account_balances (account_id, owner_id, total)
+            SELECT accounts.account_id, accounts.owner_id, coalesce(sum(amount), 0)
+            FROM accounts LEFT JOIN transactions
+                ON transactions.account_id = accounts.account_id
+            GROUP BY accounts.account_id""",
+    ],
+    # 3: per-day rollups of transactions for statistics ranges
+    [
+        """CREATE TABLE IF NOT EXISTS daily_totals (
+            owner_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (owner_id, category_id, account_id, day)
+            ) WITHOUT ROWID""",
+        """CREATE INDEX IF NOT EXISTS daily_totals_owner_day
+            ON daily_totals (owner_id, day, total)""",
+        """CREATE INDEX IF NOT EXISTS daily_totals_owner_category_day
+            ON daily_totals (owner_id, category_id, day, total)""",
+        """INSERT OR REPLACE INTO daily_totals
+                (owner_id, category_id, account_id, day, total)
+            SELECT accounts.owner_id, transactions.category_id,
+                transactions.account_id, transactions.day, sum(amount)
+            FROM transactions JOIN accounts
+                ON transactions.account_id = accounts.account_id
+            GROUP BY accounts.owner_id, transactions.category_id,
+                transactions.account_id, transactions.day""",
+    ],
+    # 4: tombstones, deleted names disappear at once and the Reaper removes
+    # their transactions in the background; names may be reused meanwhile
+    [
+        """ALTER TABLE categories ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0""",
+        """ALTER TABLE accounts ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0""",
+        """DROP INDEX IF EXISTS categories_owner_name""",
+        """DROP INDEX IF EXISTS accounts_owner_name""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS categories_owner_name
+            ON categories (owner_id, name) WHERE deleted = 0""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS accounts_owner_name
+            ON accounts (owner_id, name) WHERE deleted = 0""",
+        """CREATE INDEX IF NOT EXISTS categories_deleted
+            ON categories (category_id) WHERE deleted = 1""",
+        """CREATE INDEX IF NOT EXISTS accounts_deleted
+            ON accounts (account_id) WHERE deleted = 1""",
+    ],
+    # 5: amounts in integer kopecks, rollups and balances rebuilt from the
+    # converted transactions so that they match them exactly
+    [
+        Chunked("transactions", "transaction_id",
+            """UPDATE transactions SET amount = CAST(round(amount * 100) AS INTEGER)
+                WHERE transaction_id > ? AND transaction_id <= ?"""),
+        Chunked("daily_totals", "owner_id",
+            """DELETE FROM daily_totals WHERE owner_id > ? AND owner_id <= ?""",
+            """INSERT INTO daily_totals (owner_id, category_id, account_id, day, total)
+                SELECT accounts.owner_id, transactions.category_id,
+                    transactions.account_id, transactions.day, sum(amount)
+                FROM accounts JOIN transactions
+                    ON transactions.account_id = accounts.account_id
+                WHERE accounts.owner_id > ? AND accounts.owner_id <= ?
+                    AND accounts.deleted = 0
+                    AND transactions.category_id NOT IN (
+                        SELECT category_id FROM categories WHERE deleted = 1)
+                GROUP BY accounts.owner_id, transactions.category_id,
+                    transactions.account_id, transactions.day"""),
+        Chunked("accounts", "account_id",
+            """INSERT OR REPLACE INTO account_balances (account_id, owner_id, total)
+                SELECT accounts.account_id, accounts.owner_id, coalesce(sum(amount), 0)
+                FROM accounts LEFT JOIN transactions
+                    ON transactions.account_id = accounts.account_id
+                        AND transactions.category_id NOT IN (
+                            SELECT category_id FROM categories WHERE deleted = 1)
+                WHERE accounts.account_id > ? AND accounts.account_id <= ?
+                    AND accounts.deleted = 0
+                GROUP BY accounts.account_id"""),
+    ],
+    # 6: progress and timing of the scheduled digests, per shard
+    [
+        """CREATE TABLE IF NOT EXISTS digest_runs (
+            kind TEXT NOT NULL,
+            first_day DATE NOT NULL,
+            last_day DATE NOT NULL,
+            last_user INTEGER NOT NULL DEFAULT -1,
+            sent INTEGER NOT NULL DEFAULT 0,
+            finished INTEGER NOT NULL DEFAULT 0,
+            duration REAL,
+            rate REAL,
+            PRIMARY KEY (kind, first_day)
+            )""",
+    ],
+    # 7: updates whose handlers wrote to the shard, for replaying the journal
+    [
+        """CREATE TABLE IF NOT EXISTS applied_updates (
+            update_id INTEGER PRIMARY KEY
+            )""",
+    ],
+    # 8: how far the imports of journaled updates got, for resuming them
+    [
+        """CREATE TABLE IF NOT EXISTS import_progress (
+            update_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            read INTEGER NOT NULL,
+            imported INTEGER NOT NULL
+            )""",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
 
-import aiosqlite as sq
+EXPORT_PAGE_ROWS = 1000
+DIGEST_PAGE_USERS = 500
+REAP_CHUNK_ROWS = 5000
 
 
 class UsersData:
-    _cur = None
+    _pool = None
+    cache = None
 
-    async def init(self, connection):
-        connection.row_factory = sq.Row
-        self._cur = await connection.cursor()
+    async def init(self, pool, cache_size=LookupCache.DEFAULT_SIZE):
+        self._pool = pool
+        self.cache = LookupCache(cache_size)
         await self.create()
 
     async def create(self):
-        await self._cur.execute("""CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY
-            )""")
-
-        await self._cur.execute("""CREATE TABLE IF NOT EXISTS categories (
-            category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            owner_id INTEGER NOT NULL,
-            name TEXT NOT NULL
-            )""")
-
-        await self._cur.execute("""CREATE TABLE IF NOT EXISTS accounts (
-            account_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            owner_id INTEGER NOT NULL,
-            name TEXT NOT NULL
-            )""")
-
-        await self._cur.execute("""CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category_id INTEGER NOT NULL,
-            account_id INTEGER NOT NULL,
-            amount INTEGER NOT NULL,
-            day DATE NOT NULL
-            )""")
+        await self.create_tables()
+        await self.migrate()
+
+    async def get_schema_version(self):
+        versions = []
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""PRAGMA user_version""")
+
+                result = await cur.fetchone()
+                versions.append(result[0])
+        return min(versions)
+
+    async def migrate(self):
+        version = await self.get_schema_version()
+
+        for shard in self._pool.shards:
+            # the migrations commit as they go, which the savepoint write()
+            # opens inside a pending transaction would not survive
+            await shard.writer.commit()
+            async with shard.write() as cur:
+                await cur.execute("""PRAGMA user_version""")
+                current = (await cur.fetchone())[0]
+
+                for number, statements in enumerate(MIGRATIONS[current:], current + 1):
+                    for step, statement in enumerate(statements):
+                        if isinstance(statement, Chunked):
+                            await self._migrate_chunked(shard, cur, number, step, statement)
+                        else:
+                            await cur.execute(statement)
+                    await cur.execute(f"""PRAGMA user_version = {number}""")
+                    await cur.execute("""DROP TABLE IF EXISTS migration_progress""")
+                    await shard.writer.commit()
+
+        return version, SCHEMA_VERSION
+
+    async def _migrate_chunked(self, shard, cur, number, step, chunked):
+        await cur.execute("""CREATE TABLE IF NOT EXISTS migration_progress (
+                version INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                done INTEGER NOT NULL,
+                PRIMARY KEY (version, step)
+                )""")
+        await cur.execute("""SELECT done FROM migration_progress
+                WHERE (version, step) = (?, ?)""",
+                (number, step))
+
+        result = await cur.fetchone()
+        low = -1 if result is None else result[0]
+        while True:
+            await cur.execute(f"""SELECT {chunked.key} FROM {chunked.table}
+                    WHERE {chunked.key} > ? ORDER BY {chunked.key}
+                    LIMIT 1 OFFSET ?""",
+                    (low, MIGRATION_CHUNK_ROWS - 1))
+
+            result = await cur.fetchone()
+            if result is None:
+                await cur.execute(f"""SELECT max({chunked.key}) FROM {chunked.table}""")
+
+                result = await cur.fetchone()
+                if result[0] is None or result[0] <= low:
+                    return
+
+            high = result[0]
+            for statement in chunked.statements:
+                await cur.execute(statement, (low, high))
+            await cur.execute("""INSERT OR REPLACE INTO migration_progress
+                    (version, step, done) VALUES (?, ?, ?)""",
+                    (number, step, high))
+            await shard.writer.commit()
+            low = high
+
+    async def create_tables(self):
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY
+                    )""")
+
+                await cur.execute("""CREATE TABLE IF NOT EXISTS categories (
+                    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner_id INTEGER NOT NULL,
+                    name TEXT NOT NULL
+                    )""")
+
+                await cur.execute("""CREATE TABLE IF NOT EXISTS accounts (
+                    account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner_id INTEGER NOT NULL,
+                    name TEXT NOT NULL
+                    )""")
+
+                await cur.execute("""CREATE TABLE IF NOT EXISTS transactions (
+                    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    category_id INTEGER NOT NULL,
+                    account_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,
+                    day DATE NOT NULL
+                    )""")
 
     async def delete(self):
-        await self._cur.execute("""DROP TABLE IF EXISTS users""")
-        await self._cur.execute("""DROP TABLE IF EXISTS accounts""")
-        await self._cur.execute("""DROP TABLE IF EXISTS categories""")
-        await self._cur.execute("""DROP TABLE IF EXISTS transactions""")
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""DROP TABLE IF EXISTS users""")
+                await cur.execute("""DROP TABLE IF EXISTS accounts""")
+                await cur.execute("""DROP TABLE IF EXISTS categories""")
+                await cur.execute("""DROP TABLE IF EXISTS transactions""")
+                await cur.execute("""DROP TABLE IF EXISTS account_balances""")
+                await cur.execute("""DROP TABLE IF EXISTS daily_totals""")
+                await cur.execute("""DROP TABLE IF EXISTS digest_runs""")
+                await cur.execute("""DROP TABLE IF EXISTS applied_updates""")
+                await cur.execute("""DROP TABLE IF EXISTS import_progress""")
+                await cur.execute("""PRAGMA user_version = 0""")
+        self.cache.clear()
+
+    async def delete_all(self):
+        """Deletes every user's data as /recreate asks, without the long
+        DROP of the transactions table: users, balances and rollups go at
+        once, every category and account becomes a tombstone and the
+        transactions are left to reap()."""
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""DELETE FROM users""")
+                await cur.execute("""UPDATE categories SET deleted = 1 WHERE deleted = 0""")
+                await cur.execute("""UPDATE accounts SET deleted = 1 WHERE deleted = 0""")
+                await cur.execute("""DELETE FROM account_balances""")
+                await cur.execute("""DELETE FROM daily_totals""")
+        self.cache.clear()
+
+    def writing(self, user_id):
+        """Context manager keeping group commits of user_id's shard out
+        while a handler makes several writes that belong together. Commit
+        after it, not inside."""
+        return self._pool.shard(user_id).hold()
+
+    def track_updates(self):
+        """Makes every write also record APPLYING, if set, in the same
+        transaction, so that after a crash get_applied_updates() tells
+        which journaled updates already took effect.
+
+        That holds for a handler whose writes all go into one transaction.
+        One that commits several times on the way, as the CSV import does,
+        clears APPLYING for its writes and calls mark_applied() with its
+        last one instead."""
+        self._pool.on_write = self._mark_applied
+
+    async def _mark_applied(self, cur):
+        update_id = APPLYING.get()
+        if update_id is not None:
+            await cur.execute("""INSERT OR IGNORE INTO applied_updates (update_id)
+                    VALUES (?)""",
+                    (update_id,))
+
+    async def mark_applied(self, user_id, update_id):
+        """Records that update_id took effect and forgets its import
+        progress."""
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""INSERT OR IGNORE INTO applied_updates (update_id)
+                    VALUES (?)""",
+                    (update_id,))
+            await cur.execute("""DELETE FROM import_progress WHERE update_id = ?""",
+                    (update_id,))
+
+    async def get_import_progress(self, user_id, update_id):
+        """Rows read and imported by the interrupted import of update_id,
+        (0, 0) if it has not committed any."""
+        async with self._pool.shard(user_id).read(fresh=True) as cur:
+            await cur.execute("""SELECT read, imported FROM import_progress
+                    WHERE update_id = ?""",
+                    (update_id,))
+
+            result = await cur.fetchone()
+        return (0, 0) if result is None else tuple(result)
+
+    async def save_import_progress(self, user_id, update_id, read, imported):
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""INSERT OR REPLACE INTO import_progress
+                    (update_id, owner_id, read, imported) VALUES (?, ?, ?, ?)""",
+                    (update_id, user_id, read, imported))
+
+    async def get_applied_updates(self, update_ids):
+        applied = set()
+        update_ids = list(update_ids)
+        for shard in self._pool.shards:
+            async with shard.read(fresh=True) as cur:
+                for start in range(0, len(update_ids), APPLIED_PAGE):
+                    page = update_ids[start:start + APPLIED_PAGE]
+                    await cur.execute(f"""SELECT update_id FROM applied_updates
+                            WHERE update_id IN ({", ".join("?" * len(page))})""",
+                            page)
+
+                    applied.update(row[0] for row in await cur.fetchall())
+        return applied
+
+    async def forget_applied_updates(self, before):
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""DELETE FROM applied_updates WHERE update_id < ?""",
+                        (before,))
+                await cur.execute("""DELETE FROM import_progress WHERE update_id < ?""",
+                        (before,))
 
     async def get_balance(self, user_id, account_name=""):
         if account_name:
-            await self._cur.execute("""SELECT count(amount), sum(amount) FROM transactions
-                    JOIN accounts ON transactions.account_id = accounts.account_id
-                    WHERE (accounts.owner_id, accounts.name) = (?, ?)""",
-                    (user_id, account_name))
-        else:
-            await self._cur.execute("""SELECT count(amount), sum(amount) FROM transactions
-                    JOIN accounts ON transactions.account_id = accounts.account_id
-                    WHERE accounts.owner_id = ?""",
-                    (user_id,))
-
-        result = await self._cur.fetchone()
-        return result[1] if result[0] else 0
+            account_id = await self.get_account_id(user_id, account_name)
+
+        async with self._pool.shard(user_id).read() as cur:
+            if account_name:
+                await cur.execute("""SELECT total FROM account_balances
+                        WHERE account_id = ?""",
+                        (account_id,))
+            else:
+                await cur.execute("""SELECT sum(total) FROM account_balances
+                        WHERE owner_id = ?""",
+                        (user_id,))
+
+            result = await cur.fetchone()
+            return 0 if result is None or result[0] is None else result[0]
+
+    async def verify_balances(self, repair=True):
+        drift = []
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""SELECT accounts.account_id,
+                            coalesce(account_balances.total, 0), coalesce(actual.total, 0)
+                        FROM accounts
+                        LEFT JOIN account_balances
+                            ON account_balances.account_id = accounts.account_id
+                        LEFT JOIN (SELECT account_id, sum(amount) AS total FROM transactions
+                                WHERE category_id NOT IN (
+                                    SELECT category_id FROM categories WHERE deleted = 1)
+                                GROUP BY account_id) AS actual
+                            ON actual.account_id = accounts.account_id
+                        WHERE accounts.deleted = 0
+                            AND (account_balances.account_id IS NULL
+                                OR coalesce(account_balances.total, 0)
+                                    <> coalesce(actual.total, 0))""")
+
+                found = [tuple(row) for row in await cur.fetchall()]
+                if found and repair:
+                    await cur.execute("""DELETE FROM account_balances""")
+                    await cur.execute(REBUILD_BALANCES)
+                drift.extend(found)
+        return drift
+
+    async def get_category_ids(self, user_id):
+        names = self.cache.get_names(user_id, "categories")
+        if names is None:
+            version = self.cache.version(user_id)
+            async with self._pool.shard(user_id).read(fresh=True) as cur:
+                await cur.execute("""SELECT name, category_id FROM categories
+                        WHERE owner_id = ? AND deleted = 0""",
+                        (user_id,))
+
+                names = {row[0]: row[1] for row in await cur.fetchall()}
+            self.cache.set_names(user_id, "categories", names, version)
+        return names
+
+    async def get_account_ids(self, user_id):
+        names = self.cache.get_names(user_id, "accounts")
+        if names is None:
+            version = self.cache.version(user_id)
+            async with self._pool.shard(user_id).read(fresh=True) as cur:
+                await cur.execute("""SELECT name, account_id FROM accounts
+                        WHERE owner_id = ? AND deleted = 0""",
+                        (user_id,))
+
+                names = {row[0]: row[1] for row in await cur.fetchall()}
+            self.cache.set_names(user_id, "accounts", names, version)
+        return names
 
     async def get_category_id(self, user_id, category_name):
-        await self._cur.execute("""SELECT category_id FROM categories
-                WHERE (owner_id, name) = (?, ?)""",
-                (user_id, category_name))
-
-        result = await self._cur.fetchone()
-        return -1 if result is None else result[0]
+        names = await self.get_category_ids(user_id)
+        return names.get(category_name, -1)
 
     async def get_account_id(self, user_id, account_name):
-        await self._cur.execute("""SELECT account_id FROM accounts
-                WHERE (owner_id, name) = (?, ?)""",
-                (user_id, account_name))
-
-        result = await self._cur.fetchone()
-        return -1 if result is None else result[0]
+        names = await self.get_account_ids(user_id)
+        return names.get(account_name, -1)
 
     async def exists_user(self, user_id):
-        await self._cur.execute("""SELECT * FROM users WHERE user_id = ?""", (user_id,))
+        if self.cache.has_user(user_id):
+            return True
 
-        result = await self._cur.fetchone()
+        async with self._pool.shard(user_id).read(fresh=True) as cur:
+            await cur.execute("""SELECT * FROM users WHERE user_id = ?""", (user_id,))
+
+            result = await cur.fetchone()
+        if result is not None:
+            self.cache.add_user(user_id)
         return result is not None
 
     async def exists_category(self, user_id, category_name):
@@ -88,75 +505,351 @@ class UsersData:
         return result != -1
 
     async def add_user(self, user_id):
-        await self._cur.execute("""INSERT INTO users (user_id) VALUES (?)""", (user_id,))
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""INSERT INTO users (user_id) VALUES (?)""", (user_id,))
+        self.cache.add_user(user_id)
 
     async def add_category(self, user_id, name):
-        await self._cur.execute("""INSERT INTO categories (owner_id, name) 
-                VALUES (?, ?)""",
-                (user_id, name))
+        await self.add_categories(user_id, [name])
+
+    async def add_categories(self, user_id, names):
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.executemany("""INSERT INTO categories (owner_id, name) 
+                    VALUES (?, ?)""",
+                    [(user_id, name) for name in names])
+        self.cache.invalidate(user_id, "categories")
 
     async def add_account(self, user_id, name):
-        await self._cur.execute("""INSERT INTO accounts (owner_id, name) 
-                VALUES (?, ?)""",
-                (user_id, name))
+        await self.add_accounts(user_id, [name])
+
+    async def add_accounts(self, user_id, names):
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.executemany("""INSERT INTO accounts (owner_id, name) 
+                    VALUES (?, ?)""",
+                    [(user_id, name) for name in names])
+            await cur.executemany("""INSERT INTO account_balances (account_id, owner_id)
+                    SELECT account_id, owner_id FROM accounts
+                    WHERE (owner_id, name) = (?, ?) AND deleted = 0""",
+                    [(user_id, name) for name in names])
+        self.cache.invalidate(user_id, "accounts")
 
     async def add_transaction(self, user_id, amount, category_id, account_id):
-        await self._cur.execute("""INSERT INTO transactions 
-                (category_id, account_id, amount, day)
-                VALUES (?, ?, ?, ?)""",
-                (category_id, account_id, amount, datetime.today().strftime('%Y-%m-%d')))
+        day = datetime.today().strftime('%Y-%m-%d')
+        await self.add_transactions(user_id, [(amount, category_id, account_id, day)])
+
+    async def add_transactions(self, user_id, transactions):
+        """Inserts (amount, category_id, account_id, day) rows of one user,
+        amounts in kopecks."""
+        if not transactions:
+            return
+
+        totals = {}
+        balances = {}
+        for amount, category_id, account_id, day in transactions:
+            key = (category_id, account_id, day)
+            totals[key] = totals.get(key, 0) + amount
+            balances[account_id] = balances.get(account_id, 0) + amount
+
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.executemany("""INSERT INTO transactions 
+                    (category_id, account_id, amount, day)
+                    VALUES (?, ?, ?, ?)""",
+                    [(category_id, account_id, amount, day)
+                        for amount, category_id, account_id, day in transactions])
+            await cur.executemany("""INSERT INTO daily_totals
+                    (owner_id, category_id, account_id, day, total)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (owner_id, category_id, account_id, day)
+                    DO UPDATE SET total = total + excluded.total""",
+                    [(user_id, category_id, account_id, day, total)
+                        for (category_id, account_id, day), total in totals.items()])
+            await cur.executemany("""UPDATE account_balances SET total = total + ?
+                    WHERE account_id = ?""",
+                    [(total, account_id) for account_id, total in balances.items()])
+        self.cache.invalidate(user_id, "totals")
 
     async def delete_category(self, user_id, category_id):
-        await self._cur.execute("""DELETE FROM transactions
-            WHERE category_id = ?""",
-            (category_id,))
-
-        await self._cur.execute("""DELETE FROM categories 
-                WHERE category_id = ?""",
-                (category_id,))
+        """Tombstones a category. Balances and rollups drop its amounts at
+        once, from the rollups rather than the transactions, which stay
+        behind for reap()."""
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""UPDATE account_balances SET total = total - coalesce(
+                    (SELECT sum(total) FROM daily_totals
+                        WHERE (owner_id, category_id) = (?, ?)
+                            AND daily_totals.account_id = account_balances.account_id), 0)
+                    WHERE owner_id = ?""",
+                    (user_id, category_id, user_id))
+
+            await cur.execute("""UPDATE categories SET deleted = 1
+                    WHERE category_id = ?""",
+                    (category_id,))
+
+            await cur.execute("""DELETE FROM daily_totals
+                    WHERE (owner_id, category_id) = (?, ?)""",
+                    (user_id, category_id))
+        self.cache.invalidate(user_id, "totals")
+        self.cache.invalidate(user_id, "categories")
 
     async def delete_account(self, user_id, account_id):
-        await self._cur.execute("""DELETE FROM transactions
-            WHERE account_id = ?""",
-            (account_id,))
-
-        await self._cur.execute("""DELETE FROM accounts 
-                WHERE account_id = ?""",
-                (account_id,))
+        """Tombstones an account, its transactions stay behind for reap()."""
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""UPDATE accounts SET deleted = 1
+                    WHERE account_id = ?""",
+                    (account_id,))
+
+            await cur.execute("""DELETE FROM account_balances
+                    WHERE account_id = ?""",
+                    (account_id,))
+
+            await cur.execute("""DELETE FROM daily_totals
+                    WHERE owner_id = ? AND account_id = ?""",
+                    (user_id, account_id))
+        self.cache.invalidate(user_id, "totals")
+        self.cache.invalidate(user_id, "accounts")
+
+    async def reap(self, limit=REAP_CHUNK_ROWS):
+        """Deletes up to limit transactions of one tombstoned category or
+        account, then the tombstone itself once it has none left. Returns
+        the number of transactions deleted and whether the tombstone went
+        with them, or None when there are no tombstones at all."""
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                for table, column in (("categories", "category_id"),
+                                      ("accounts", "account_id")):
+                    await cur.execute(f"""SELECT {column} FROM {table}
+                            WHERE deleted = 1 LIMIT 1""")
+
+                    result = await cur.fetchone()
+                    if result is None:
+                        continue
+
+                    await cur.execute(f"""DELETE FROM transactions
+                            WHERE transaction_id IN (SELECT transaction_id
+                                FROM transactions WHERE {column} = ? LIMIT ?)""",
+                            (result[0], limit))
+                    deleted = cur.rowcount
+                    if deleted < limit:
+                        await cur.execute(f"""DELETE FROM {table}
+                                WHERE {column} = ?""",
+                                (result[0],))
+                    return deleted, deleted < limit
+        return None
+
+    async def count_tombstones(self):
+        count = 0
+        for shard in self._pool.shards:
+            async with shard.read() as cur:
+                await cur.execute("""SELECT
+                        (SELECT count(*) FROM categories WHERE deleted = 1)
+                        + (SELECT count(*) FROM accounts WHERE deleted = 1)""")
+
+                count += (await cur.fetchone())[0]
+        return count
 
     async def get_categories(self, user_id):
-        await self._cur.execute("""SELECT categories.name FROM categories
-                WHERE owner_id = ?""",
-                (user_id,))
+        async with self._pool.shard(user_id).read() as cur:
+            await cur.execute("""SELECT categories.name FROM categories
+                    WHERE owner_id = ? AND deleted = 0""",
+                    (user_id,))
 
-        categories = []
-        result = await self._cur.fetchall()
-        for row in result:
-            categories.append(row[0])
-        return categories
+            categories = []
+            result = await cur.fetchall()
+            for row in result:
+                categories.append(row[0])
+            return categories
 
     async def get_accounts(self, user_id):
-        await self._cur.execute("""SELECT accounts.name FROM accounts
-                WHERE owner_id = ?""",
-                (user_id,))
+        async with self._pool.shard(user_id).read() as cur:
+            await cur.execute("""SELECT accounts.name FROM accounts
+                    WHERE owner_id = ? AND deleted = 0""",
+                    (user_id,))
 
-        accounts = []
-        result = await self._cur.fetchall()
-        for row in result:
-            accounts.append(row[0])
-        return accounts
+            accounts = []
+            result = await cur.fetchall()
+            for row in result:
+                accounts.append(row[0])
+            return accounts
+
+    async def iter_transactions(self, user_id, page_size=EXPORT_PAGE_ROWS):
+        """Yields all transactions of a user as pages of (day, amount,
+        category, account) rows, account by account and by day within one.
+
+        Every page is its own keyset query on a pooled reader, so no
+        connection is held between pages and memory is bounded by
+        page_size whatever the length of the history.
+        """
+        accounts = await self.get_account_ids(user_id)
+
+        for name, account_id in sorted(accounts.items()):
+            last = ("", 0)
+            while True:
+                async with self._pool.shard(user_id).read() as cur:
+                    await cur.execute("""SELECT transactions.day,
+                            transactions.transaction_id, transactions.amount,
+                            categories.name
+                            FROM transactions JOIN categories
+                                ON transactions.category_id = categories.category_id
+                                    AND categories.deleted = 0
+                            WHERE transactions.account_id = ?
+                                AND (transactions.day, transactions.transaction_id) > (?, ?)
+                            ORDER BY transactions.day, transactions.transaction_id
+                            LIMIT ?""",
+                            (account_id, *last, page_size))
+
+                    result = await cur.fetchall()
+                if not result:
+                    break
+
+                last = (result[-1][0], result[-1][1])
+                yield [(row[0], row[2], row[3], name) for row in result]
+                if len(result) < page_size:
+                    break
+
+    async def get_daily_totals(self, user_id, begin, end):
+        """Returns (category, account, day, total) rows of a user's daily
+        totals between begin and end in one query."""
+        async with self._pool.shard(user_id).read(fresh=True) as cur:
+            await cur.execute("""SELECT categories.name, accounts.name,
+                    daily_totals.day, daily_totals.total
+                    FROM daily_totals
+                    JOIN categories ON daily_totals.category_id = categories.category_id
+                    JOIN accounts ON daily_totals.account_id = accounts.account_id
+                    WHERE daily_totals.owner_id = ?
+                        AND daily_totals.day BETWEEN ? AND ?""",
+                    (user_id, begin, end))
+
+            result = await cur.fetchall()
+            return [tuple(row) for row in result]
 
     async def get_transactions_by_time(self, user_id, begin, end, category_id=-1):
-        if category_id == -1:
-            await self._cur.execute("""SELECT sum(amount) FROM transactions
-                    JOIN accounts ON transactions.account_id = accounts.account_id
-                    WHERE owner_id = ? AND day BETWEEN ? AND ?""",
-                    (user_id, begin, end))
-        else:
-            await self._cur.execute("""SELECT sum(amount) FROM transactions
-                    JOIN accounts ON transactions.account_id = accounts.account_id
-                    WHERE (owner_id, category_id) = (?, ?) AND day BETWEEN ? AND ?""",
-                    (user_id, category_id, begin, end))
-
-        result = await self._cur.fetchone()
-        return 0 if result is None or result[0] is None else result[0]
+        days, sums = await self.get_prefix_sums(user_id, category_id)
+
+        first = bisect_left(days, begin)
+        last = bisect_right(days, end)
+        if first == last:
+            return 0
+        return sums[last] - sums[first]
+
+    async def get_prefix_sums(self, user_id, category_id=-1):
+        totals = self.cache.get_totals(user_id, category_id)
+        if totals is not None:
+            return totals
+
+        version = self.cache.version(user_id)
+        async with self._pool.shard(user_id).read(fresh=True) as cur:
+            if category_id == -1:
+                await cur.execute("""SELECT day, sum(total) FROM daily_totals
+                        WHERE owner_id = ?
+                        GROUP BY day ORDER BY day""",
+                        (user_id,))
+            else:
+                await cur.execute("""SELECT day, sum(total) FROM daily_totals
+                        WHERE (owner_id, category_id) = (?, ?)
+                        GROUP BY day ORDER BY day""",
+                        (user_id, category_id))
+
+            result = await cur.fetchall()
+        days = [row[0] for row in result]
+        sums = list(accumulate((row[1] for row in result), initial=0))
+
+        self.cache.set_totals(user_id, category_id, (days, sums), version)
+        return days, sums
+
+    async def iter_digests(self, kind, begin, end, page_size=DIGEST_PAGE_USERS):
+        """Yields the digest of every user with transactions between begin
+        and end as pages of (user_id, total, categories, balance) rows, the
+        categories as (name, total) pairs, with the last user_id the page
+        covers.
+
+        A page is page_size users of one shard and two GROUP BY queries
+        over the rollups on a pooled reader, so the whole user base takes
+        a few queries per thousand users rather than one per user. Shards
+        already finished for (kind, begin) are skipped and the others
+        resume after the last_user save_digest_progress() recorded.
+        """
+        for shard in self._pool.shards:
+            async with shard.read() as cur:
+                await cur.execute("""SELECT last_user, finished FROM digest_runs
+                        WHERE (kind, first_day) = (?, ?)""",
+                        (kind, begin))
+
+                result = await cur.fetchone()
+            if result is not None and result[1]:
+                continue
+
+            low = -1 if result is None else result[0]
+            while True:
+                async with shard.read() as cur:
+                    await cur.execute("""SELECT user_id FROM users
+                            WHERE user_id > ? ORDER BY user_id
+                            LIMIT 1 OFFSET ?""",
+                            (low, page_size - 1))
+
+                    result = await cur.fetchone()
+                    if result is None:
+                        await cur.execute("""SELECT max(user_id) FROM users""")
+
+                        result = await cur.fetchone()
+                        if result[0] is None or result[0] <= low:
+                            break
+                    high = result[0]
+
+                    await cur.execute("""SELECT daily_totals.owner_id, categories.name,
+                            sum(daily_totals.total) AS total
+                            FROM daily_totals JOIN categories
+                                ON daily_totals.category_id = categories.category_id
+                            WHERE daily_totals.owner_id > ? AND daily_totals.owner_id <= ?
+                                AND daily_totals.day BETWEEN ? AND ?
+                            GROUP BY daily_totals.owner_id, daily_totals.category_id
+                            ORDER BY daily_totals.owner_id, total""",
+                            (low, high, begin, end))
+
+                    totals = await cur.fetchall()
+
+                    await cur.execute("""SELECT owner_id, sum(total) FROM account_balances
+                            WHERE owner_id > ? AND owner_id <= ?
+                            GROUP BY owner_id""",
+                            (low, high))
+
+                    balances = dict(await cur.fetchall())
+
+                digests = {}
+                for user_id, name, total in totals:
+                    digests.setdefault(user_id, []).append((name, total))
+                yield high, [(user_id, sum(total for _, total in categories), categories,
+                              balances.get(user_id, 0))
+                             for user_id, categories in digests.items()]
+                low = high
+
+    async def save_digest_progress(self, kind, begin, end, user_id, sent):
+        """Records that the digests of user_id's shard are queued up to
+        user_id, sent more of them than before."""
+        async with self._pool.shard(user_id).write() as cur:
+            await cur.execute("""INSERT INTO digest_runs (kind, first_day, last_day, last_user, sent)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (kind, first_day) DO UPDATE
+                    SET last_user = excluded.last_user, sent = sent + excluded.sent""",
+                    (kind, begin, end, user_id, sent))
+
+    async def finish_digest_run(self, kind, begin, end, duration, rate):
+        for shard in self._pool.shards:
+            async with shard.write() as cur:
+                await cur.execute("""INSERT INTO digest_runs
+                        (kind, first_day, last_day, finished, duration, rate)
+                        VALUES (?, ?, ?, 1, ?, ?)
+                        ON CONFLICT (kind, first_day) DO UPDATE
+                        SET finished = 1, duration = excluded.duration,
+                            rate = excluded.rate""",
+                        (kind, begin, end, duration, rate))
+
+    async def is_digest_finished(self, kind, begin):
+        for shard in self._pool.shards:
+            async with shard.read(fresh=True) as cur:
+                await cur.execute("""SELECT finished FROM digest_runs
+                        WHERE (kind, first_day) = (?, ?)""",
+                        (kind, begin))
+
+                result = await cur.fetchone()
+                if result is None or not result[0]:
+                    return False
+        return True
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram import types
+
+import src.messages as messages
+
+from src.data_managers import DIGEST_PAGE_USERS
+from src.money import format_amount
+
+# wake up at least this often, so a changed clock cannot delay a run for long
+DIGEST_CHECK_INTERVAL = 3600
+
+TITLES = {
+    "week": messages.DIGEST_WEEK,
+    "month": messages.DIGEST_MONTH,
+}
+
+log = logging.getLogger(__name__)
+
+
+def period_start(kind, day):
+    """First day of the week or month day falls in."""
+    if kind == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def last_period(kind, day):
+    """First and last day of the latest whole week or month before day."""
+    end = period_start(kind, day) - timedelta(days=1)
+    return period_start(kind, end), end
+
+
+def next_start(kind, day):
+    """First day of the week or month after the one day falls in."""
+    if kind == "week":
+        return period_start(kind, day) + timedelta(days=7)
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+class Digests:
+    """Weekly and monthly summaries pushed to every user with transactions
+    in the period, at hour o'clock on the day after it ends.
+
+    A run streams the digests page by page out of UsersData.iter_digests()
+    and queues them with Outbox.send_background(), which only spends the
+    send rate replies leave over, so handlers are not slowed while it runs.
+    Progress is saved after every page and finished runs are recorded with
+    their duration and send rate in digest_runs, so a restart neither sends
+    a digest twice nor skips the rest of an interrupted run.
+    """
+    _tg = None
+    _task = None
+
+    async def init(self, tg, data, commits, outbox, kinds=("week", "month"), hour=9,
+                   page_users=DIGEST_PAGE_USERS):
+        self._tg = tg
+        self._data = data
+        self._commits = commits
+        self._outbox = outbox
+        self._kinds = kinds
+        self._hour = hour
+        self._page_users = page_users
+
+        self.runs = 0
+        self.running = 0
+        self.sent = 0
+        self.duration = 0.0
+        self.rate = 0.0
+
+        self._task = tg.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # a day of digests starts at hour, not at midnight
+            shifted = datetime.now() - timedelta(hours=self._hour)
+            for kind in self._kinds:
+                begin, end = last_period(kind, shifted.date())
+                try:
+                    if not await self._data.is_digest_finished(kind, begin.isoformat()):
+                        await self.run(kind, begin.isoformat(), end.isoformat())
+                except Exception:
+                    log.exception("%s digest for %s failed", kind, begin)
+
+            due = min(datetime.combine(next_start(kind, shifted.date()), datetime.min.time())
+                      for kind in self._kinds)
+            await asyncio.sleep(min(DIGEST_CHECK_INTERVAL,
+                    max(1.0, (due - shifted).total_seconds())))
+
+    async def run(self, kind, begin, end):
+        """Sends the digest of kind for the days between begin and end to
+        every user who has not got it yet."""
+        self.running = 1
+        start = time.perf_counter()
+        sent = 0
+        try:
+            async for last_user, page in self._data.iter_digests(kind, begin, end,
+                    self._page_users):
+                for user_id, total, categories, balance in page:
+                    await self._outbox.send_background(user_id,
+                            messages.DIGEST.format(title=TITLES[kind], begin=begin,
+                                end=end, amount=format_amount(total),
+                                categories="\n".join(messages.REPORT_LINE.format(
+                                    name=name, amount=format_amount(amount))
+                                    for name, amount in categories),
+                                balance=format_amount(balance)),
+                            parse_mode=types.ParseMode.HTML)
+                await self._data.save_digest_progress(kind, begin, end, last_user,
+                        len(page))
+                await self._commits.commit()
+                sent += len(page)
+
+            await self._outbox.wait_background()
+            duration = time.perf_counter() - start
+            rate = sent / duration if duration else 0.0
+            await self._data.finish_digest_run(kind, begin, end, duration, rate)
+            await self._commits.commit()
+        finally:
+            self.running = 0
+
+        self.runs += 1
+        self.sent, self.duration, self.rate = sent, duration, rate
+        log.info("%s digest for %s - %s: %d messages in %.1f s, %.1f per second",
+                kind, begin, end, sent, duration, rate)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "sent": self.sent,
+            "duration_s": self.duration,
+            "rate": self.rate,
+        }
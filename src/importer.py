@@ -0,0 +1,126 @@
+import asyncio
+import csv
+import gzip
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+from src.data_managers import APPLYING
+from src.money import parse_amount
+
+CHUNK_ROWS = 5000
+COMMIT_ROWS = 50_000
+MAX_ERRORS = 10
+
+
+def parse_row(row):
+    """Turns a day,amount,category,account row into a transaction tuple,
+    returns None if the row is malformed."""
+    if len(row) != 4:
+        return None
+
+    day, amount, category, account = (field.strip() for field in row)
+    try:
+        day = datetime.strptime(day, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+    amount = parse_amount(amount)
+    if amount is None or not category or not account:
+        return None
+    return day, amount, category.lower(), account.lower()
+
+
+async def import_csv(data, commits, user_id, path, progress=None):
+    """Streams a CSV file of day,amount,category,account rows into one
+    user's transactions.
+
+    The file is read in chunks of CHUNK_ROWS rows off the event loop.
+    Categories and accounts missing from a chunk are created in bulk
+    and the rows are written with executemany, committing every
+    COMMIT_ROWS rows. progress(rows_read, rows_imported) is awaited
+    after each chunk. Gzip-compressed files, as export_csv writes them,
+    are read as well.
+
+    The import of a journaled update records with every chunk how far it
+    got and marks the update applied after the last one, so a replay
+    after a crash skips the rows already committed and goes on with the
+    rest.
+    """
+    # the chunks are committed one by one, none of them may mark the
+    # update applied on its own, see UsersData.track_updates()
+    update_id = APPLYING.get()
+    token = APPLYING.set(None)
+    try:
+        return await _import(data, commits, user_id, path, progress, update_id)
+    finally:
+        APPLYING.reset(token)
+
+
+async def _import(data, commits, user_id, path, progress, update_id):
+    read, imported = (0, 0) if update_id is None else \
+        await data.get_import_progress(user_id, update_id)
+    uncommitted = 0
+    errors = 0
+    error_lines = []
+
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+
+    with (gzip.open if compressed else open)(path, "rt", newline="",
+                                              encoding="utf-8-sig") as file:
+        first = file.readline()
+        file.seek(0)
+        reader = csv.reader(file, delimiter=";" if first.count(";") > first.count(",")
+                            else ",")
+        if read:
+            await asyncio.to_thread(deque, islice(reader, read), 0)
+
+        while True:
+            rows = await asyncio.to_thread(list, islice(reader, CHUNK_ROWS))
+            if not rows:
+                break
+
+            parsed = []
+            for row in rows:
+                read += 1
+                transaction = parse_row(row)
+                if transaction is not None:
+                    parsed.append(transaction)
+                elif read > 1 and any(field.strip() for field in row):
+                    errors += 1
+                    if len(error_lines) < MAX_ERRORS:
+                        error_lines.append(read)
+
+            imported += len(parsed)
+            async with data.writing(user_id):
+                categories = await data.get_category_ids(user_id)
+                missing = {category for _, _, category, _ in parsed} - categories.keys()
+                if missing:
+                    await data.add_categories(user_id, sorted(missing))
+                    categories = await data.get_category_ids(user_id)
+
+                accounts = await data.get_account_ids(user_id)
+                missing = {account for _, _, _, account in parsed} - accounts.keys()
+                if missing:
+                    await data.add_accounts(user_id, sorted(missing))
+                    accounts = await data.get_account_ids(user_id)
+
+                await data.add_transactions(user_id, [
+                        (amount, categories[category], accounts[account], day)
+                        for day, amount, category, account in parsed])
+                if update_id is not None:
+                    await data.save_import_progress(user_id, update_id, read, imported)
+
+            uncommitted += len(parsed)
+            if uncommitted >= COMMIT_ROWS:
+                await commits.commit()
+                uncommitted = 0
+
+            if progress is not None:
+                await progress(read, imported)
+
+    if update_id is not None:
+        await data.mark_applied(user_id, update_id)
+    await commits.commit()
+    return imported, errors, error_lines
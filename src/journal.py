@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+
+import aiosqlite as sq
+from aiogram import types
+
+from src.data_managers import APPLYING
+
+POLL_LIMIT = 100
+POLL_TIMEOUT = 20
+# applied_updates rows older than every pending update are dropped this often
+PRUNE_INTERVAL = 60.0
+
+log = logging.getLogger(__name__)
+
+
+class UpdateJournal:
+    """Durable record of the updates received from Telegram, in a SQLite
+    file of its own next to the database.
+
+    poll() commits every batch to the journal before the next getUpdates
+    confirms it to Telegram, and the webhook commits before it answers,
+    so an update that reached the bot survives a crash or a restart.
+    Each one stays pending until process() has seen its handler return.
+    After a restart resumable() gives the pending updates back, except
+    those UsersData already recorded as applied, so their writes are not
+    made twice, and poll() goes on from the offset after the newest one.
+    A CSV import commits chunk by chunk and is recorded as applied only
+    with its last one, its replay resumes after the committed chunks.
+
+    Done marks are committed in batches every flush_interval. Losing the
+    last few to a crash only replays updates whose writes were recorded
+    as applied anyway, or repeats a reply that wrote nothing.
+    """
+    _tg = None
+    _db = None
+    _task = None
+
+    async def init(self, tg, path, data=None, commits=None, flush_interval=0.05):
+        self._tg = tg
+        self._data = data
+        self._commits = commits
+        self._flush_interval = flush_interval
+
+        self._db = await sq.connect(path, isolation_level="IMMEDIATE")
+        await self._db.execute("""PRAGMA journal_mode = WAL""")
+        await self._db.execute("""PRAGMA synchronous = FULL""")
+        # the ingest process appends while workers mark their updates done
+        await self._db.execute("""PRAGMA busy_timeout = 5000""")
+        await self._db.execute("""CREATE TABLE IF NOT EXISTS updates (
+                update_id INTEGER PRIMARY KEY,
+                body TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0
+                )""")
+        await self._db.commit()
+
+        self._done = set()
+        self._held = set()
+        self._wakeup = asyncio.Event()
+
+        self.appended = 0
+        self.duplicates = 0
+        self.replayed = 0
+        self.skipped = 0
+        self.finished = 0
+
+        self._task = tg.create_task(self._run())
+
+    async def append(self, updates):
+        """Commits raw updates, dicts as the Bot API sends them, and
+        returns the ones not journaled before."""
+        if not updates:
+            return []
+
+        ids = [raw["update_id"] for raw in updates]
+        async with self._db.execute(f"""SELECT update_id FROM updates
+                WHERE update_id IN ({", ".join("?" * len(ids))})""",
+                ids) as cur:
+            known = {row[0] for row in await cur.fetchall()}
+
+        new = [raw for raw in updates if raw["update_id"] not in known]
+        await self._db.executemany("""INSERT INTO updates (update_id, body) VALUES (?, ?)""",
+                [(raw["update_id"], json.dumps(raw, ensure_ascii=False)) for raw in new])
+        await self._db.commit()
+
+        self.appended += len(new)
+        self.duplicates += len(updates) - len(new)
+        return new
+
+    async def next_offset(self):
+        async with self._db.execute("""SELECT max(update_id) FROM updates""") as cur:
+            result = await cur.fetchone()
+        return None if result[0] is None else result[0] + 1
+
+    async def resumable(self, data):
+        """Raw updates a crash left pending, oldest first, less the ones
+        data shows were applied, which are marked done here."""
+        async with self._db.execute("""SELECT update_id, body FROM updates
+                WHERE done = 0 ORDER BY update_id""") as cur:
+            pending = [(row[0], row[1]) for row in await cur.fetchall()]
+
+        applied = await data.get_applied_updates([update_id for update_id, _ in pending])
+        for update_id in applied:
+            self.done(update_id)
+        self.skipped += len(applied)
+        self.replayed += len(pending) - len(applied)
+        return [json.loads(body) for update_id, body in pending if update_id not in applied]
+
+    def hold(self, update_id):
+        """Keeps update_id pending after process() returns, until done()."""
+        self._held.add(update_id)
+
+    def done(self, update_id):
+        self._held.discard(update_id)
+        self._done.add(update_id)
+        self._wakeup.set()
+
+    async def process(self, dp, update):
+        """Dispatches update with APPLYING set, so that its handler's writes
+        record it, and marks it done unless a handler held it."""
+        token = APPLYING.set(update.update_id)
+        try:
+            await dp.updates_handler.notify(update)
+        except Exception:
+            log.exception("Update %s failed", update.update_id)
+        finally:
+            APPLYING.reset(token)
+        if update.update_id not in self._held:
+            self.done(update.update_id)
+
+    async def poll(self, bot, dispatch, ordered=True):
+        """Long polls Telegram from the journaled offset on and hands every
+        new update to dispatch, in order and one by one if ordered."""
+        offset = await self.next_offset()
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, limit=POLL_LIMIT,
+                        timeout=POLL_TIMEOUT)
+            except Exception:
+                log.exception("getUpdates failed")
+                await asyncio.sleep(5)
+                continue
+            if not updates:
+                continue
+
+            new = await self.append([update.to_python() for update in updates])
+            offset = updates[-1].update_id + 1
+            for raw in new:
+                if ordered:
+                    await dispatch(types.Update(**raw))
+                else:
+                    self._tg.create_task(dispatch(types.Update(**raw)))
+
+    async def _run(self):
+        pruned = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self._flush_interval)
+            self._wakeup.clear()
+
+            done, self._done = self._done, set()
+            try:
+                await self._db.executemany("""UPDATE updates SET done = 1
+                        WHERE update_id = ?""",
+                        [(update_id,) for update_id in done])
+                # the newest row stays, it carries the offset
+                await self._db.execute("""DELETE FROM updates WHERE done = 1
+                        AND update_id < (SELECT max(update_id) FROM updates)""")
+                await self._db.commit()
+                self.finished += len(done)
+
+                if self._data is not None and loop.time() - pruned >= PRUNE_INTERVAL:
+                    pruned = loop.time()
+                    async with self._db.execute("""SELECT min(update_id) FROM updates
+                            WHERE done = 0""") as cur:
+                        oldest = (await cur.fetchone())[0]
+                    await self._data.forget_applied_updates(
+                            oldest if oldest is not None else await self.next_offset())
+                    await self._commits.commit()
+            except Exception:
+                log.exception("Journal flush failed")
+                self._done |= done
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            if self._done:
+                await self._db.executemany("""UPDATE updates SET done = 1
+                        WHERE update_id = ?""",
+                        [(update_id,) for update_id in self._done])
+                await self._db.commit()
+        if self._db is not None:
+            await self._db.close()
+
+    def stats(self):
+        return {
+            "appended": self.appended,
+            "duplicates": self.duplicates,
+            "replayed": self.replayed,
+            "skipped": self.skipped,
+            "done": self.finished,
+            "held": len(self._held),
+        }
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+POLICIES = ("busy", "drop_oldest")
+
+log = logging.getLogger(__name__)
+
+
+class Mailboxes:
+    """Per-user FIFO queues between the dispatcher and MessageHandler.
+
+    submit() only queues a message in its sender's mailbox and returns.
+    workers tasks take users round-robin and run one message of a user at
+    a time, so each user's messages are handled in the order they came
+    and in parallel with other users', and a user who sends a hundred
+    messages gets one turn like everyone else. At most user_limit messages
+    wait per user and limit in total. Beyond that the policy sheds load:
+    "busy" turns the new message away and calls on_busy(message) once
+    until the sender's mailbox has emptied, "drop_oldest" forgets the oldest
+    waiting message of the sender, or of the longest mailbox when the
+    total is over. The dropped callback given to submit() is called for a
+    message that is shed either way, instead of its handler.
+    """
+    _tg = None
+    _tasks = None
+
+    async def init(self, tg, workers=64, user_limit=20, limit=1000, policy="busy",
+                   on_busy=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown mailbox policy {policy!r}, expected one of {POLICIES}")
+
+        self._tg = tg
+        self._user_limit = user_limit
+        self._limit = limit
+        self._policy = policy
+        self._on_busy = on_busy
+
+        self._mailboxes = {}
+        self._ready = asyncio.Queue()
+        self._warned = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.depth = 0
+        self.max_depth = 0
+        self.running = 0
+        self.handled = 0
+        self.shed = 0
+        self.dropped = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+        self._tasks = [tg.create_task(self._work()) for _ in range(workers)]
+
+    def submit(self, message, handler, dropped=None):
+        """Queues handler(message) behind the sender's earlier messages."""
+        user_id = message.from_user.id
+        mailbox = self._mailboxes.get(user_id)
+
+        if mailbox is not None and len(mailbox) >= self._user_limit:
+            if not self._shed(user_id, mailbox, message):
+                if dropped is not None:
+                    dropped()
+                return
+        if self.depth >= self._limit:
+            longest = max(self._mailboxes.items(), key=lambda item: len(item[1]))
+            if not self._shed(*longest, message):
+                if dropped is not None:
+                    dropped()
+                return
+
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = deque()
+            # waiting for a turn, a user runs or waits at most once at a time
+            self._ready.put_nowait(user_id)
+        mailbox.append((message, handler, dropped, time.perf_counter()))
+
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self._idle.clear()
+
+    def _shed(self, user_id, mailbox, message):
+        """Makes room for message by the policy, False if it has to go."""
+        if self._policy == "drop_oldest" and mailbox:
+            _, _, dropped, _ = mailbox.popleft()
+            if dropped is not None:
+                dropped()
+            self.depth -= 1
+            self.dropped += 1
+            return True
+
+        self.shed += 1
+        sender = message.from_user.id
+        if self._on_busy is not None and sender not in self._warned:
+            self._warned.add(sender)
+            self._tg.create_task(self._warn(message))
+        return False
+
+    async def _warn(self, message):
+        try:
+            await self._on_busy(message)
+        except Exception:
+            log.exception("Telling user %s to wait failed", message.from_user.id)
+
+    async def _work(self):
+        while True:
+            user_id = await self._ready.get()
+            mailbox = self._mailboxes[user_id]
+            if not mailbox:
+                # drop_oldest emptied it while it waited for a turn
+                self._close_mailbox(user_id)
+                continue
+
+            message, handler, _, queued = mailbox.popleft()
+            self.depth -= 1
+            waited = time.perf_counter() - queued
+            self.wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+            self.running += 1
+            try:
+                await handler(message)
+            except Exception:
+                log.exception("Handling a message of user %s failed", user_id)
+            finally:
+                self.running -= 1
+                self.handled += 1
+
+            if mailbox:
+                self._ready.put_nowait(user_id)
+            else:
+                self._close_mailbox(user_id)
+
+    def _close_mailbox(self, user_id):
+        del self._mailboxes[user_id]
+        self._warned.discard(user_id)
+        if not self._mailboxes:
+            self._idle.set()
+
+    async def close(self):
+        """Handles every message queued so far, then stops the workers."""
+        await self._idle.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "users": len(self._mailboxes),
+            "running": self.running,
+            "handled": self.handled,
+            "shed": self.shed,
+            "dropped": self.dropped,
+            "mean_wait_ms": self.wait / self.handled * 1000 if self.handled else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -1,6 +1,12 @@
 START = """Привет! С помощью этого бота ты можешь удобно следить за своими финансами😉
 Рекомендую начать с команды /help"""
 
+BATCH_DONE = """Выполнено строк: <code>{done}</code> из <code>{total}</code>🤙"""
+BATCH_LINE_ERROR = """
+
+Строка <code>{number}</code> (<code>{line}</code>): {error}"""
+BATCH_UNKNOWN_LINE = """такую команду нельзя использовать в пакете🙄"""
+
 TRANSACTION_ADD = """Операция на <code>{amount}</code> категории <code>{category}</code> успешно добавлена на счет <code>{account}</code>🤙"""
 SUCCESSFUL_CATEGORY_ADD = """Категория <code>{name}</code> успешно создана😎"""
 SUCCESSFUL_ACCOUNT_ADD = """Счет <code>{name}</code> успешно создан😎"""
@@ -15,7 +21,29 @@ CATEGORY_NOT_EXIST = """Категории <code>{name}</code> не сущест
 ACCOUNT_NOT_EXIST = """Счета <code>{name}</code> не существует😩"""
 CATEGORY_AND_ACCOUNT_NOT_EXIST = """Ни категории <code>{category}</code>, ни счета <code>{account}</code> не существует😫"""
 
-RECREATE_DONE = """Таблица успешно пересоздана, все данные были удалены!🤯"""
+RECREATE_DONE = """Таблица успешно пересоздана, все данные были удалены!🤯 Операции стираются с диска в фоне, прогресс виден в /stats"""
+
+VERIFY_DONE = """Балансы пересчитаны, расхождений найдено: <code>{drift}</code>🧐"""
+
+STATS = """Кэш: <code>{cache_hits}</code> попаданий, <code>{cache_misses}</code> промахов (<code>{cache_hit_rate}%</code>)
+Пользователей в кэше: <code>{cache_users}</code>, имен: <code>{cache_size}</code>, вытеснено: <code>{cache_evictions}</code>
+Коммитов: <code>{commits}</code>, записей: <code>{writes}</code>, в среднем в пачке: <code>{mean_batch}</code>, максимум: <code>{max_batch}</code>
+Время коммита: в среднем <code>{mean_commit_ms}</code> мс, максимум <code>{max_commit_ms}</code> мс
+Очередь ответов: <code>{outbox_depth}</code>, максимум <code>{outbox_max_depth}</code>
+Отправлено: <code>{outbox_sent}</code>, склеено: <code>{outbox_merged}</code>, повторов после 429: <code>{outbox_retries}</code>, ошибок: <code>{outbox_errors}</code>
+Ожидание отправки: в среднем <code>{send_mean_ms}</code> мс, максимум <code>{send_max_ms}</code> мс
+Удаление в фоне: осталось имен <code>{tombstones}</code>, удалено операций <code>{reaped}</code>, порция в среднем <code>{reap_mean_ms}</code> мс, максимум <code>{reap_max_ms}</code> мс
+Последняя рассылка дайджестов: <code>{digest_sent}</code> сообщений за <code>{digest_seconds}</code> с, <code>{digest_rate}</code> в секунду, ждут отправки <code>{digest_queued}</code>"""
+
+IMPORT_STARTED = """Начинаю импорт файла <code>{name}</code>⏳"""
+IMPORT_PROGRESS = """Импорт файла <code>{name}</code>: прочитано строк <code>{read}</code>, добавлено операций <code>{imported}</code>⏳"""
+IMPORT_DONE = """Импорт файла <code>{name}</code> завершен, добавлено операций: <code>{imported}</code>🥳"""
+IMPORT_ERRORS = """
+Пропущено некорректных строк: <code>{count}</code>, например строки <code>{lines}</code>😬"""
+IMPORT_FAILED = """Не получилось импортировать файл <code>{name}</code>😵"""
+
+EXPORT_DONE = """Вот все твои операции, всего <code>{count}</code>📦"""
+NO_TRANSACTIONS = """У тебя пока нет ни одной операции😔"""
 
 BALANCE = """Твой текущий баланс: <code>{balance}</code>🤑"""
 ACCOUNT_BALANCE = """Твой текущий баланс на счете <code>{account}</code>: <code>{balance}</code>🤑"""
@@ -33,6 +61,25 @@ ACCOUNTS_SEP = """</code>\n<code>"""
 TIME_STATISTICS_CATEGORY = """В промежуток между днем <code>{begin}</code> и <code>{end}</code> твой баланс изменился на <code>{amount}</code> по категории <code>{category}</code>🥳"""
 TIME_STATISTICS = """В промежуток между днем <code>{begin}</code> и <code>{end}</code> твой баланс изменился на <code>{amount}</code>🥳"""
 
+REPORT = """В промежуток между днем <code>{begin}</code> и <code>{end}</code> твой баланс изменился на <code>{amount}</code>🥳
+
+По категориям:
+{categories}
+
+По счетам:
+{accounts}"""
+REPORT_LINE = """<code>{name}</code>: <code>{amount}</code>"""
+REPORT_CHART = """Операции между днем <code>{begin}</code> и <code>{end}</code>, итого <code>{amount}</code>📊"""
+DIGEST = """{title} с <code>{begin}</code> по <code>{end}</code> твой баланс изменился на <code>{amount}</code>📅
+
+По категориям:
+{categories}
+
+Текущий баланс: <code>{balance}</code>🤑"""
+DIGEST_WEEK = """За неделю"""
+DIGEST_MONTH = """За месяц"""
+REPORT_EMPTY = """Между днем <code>{begin}</code> и <code>{end}</code> у тебя не было операций😔"""
+
 DATE_INCORRECT = """День <code>{date}</code> записан некорректно😵
 Он должен быть корректным днем, записанным в формате <code>YYYY-MM-DD</code>🧐"""
 DATE_ORDER_INCORRECT = """Первый день должен быть раньше второго😬"""
@@ -58,8 +105,21 @@ HELP = """Вот команды, которые можно использова
 <code>баланс [account]</code> - выводит суммарный баланс пользователя, или же только по счету <code>account</code>, если он указан
 
 <code>статистика begin end [category]</code> - выводит суммарные траты по дням между <code>begin</code> и <code>end</code> по всем категориям, или же только по <code>category</code>, если указана
+
+<code>отчет begin end</code> - разбивка изменений баланса между <code>begin</code> и <code>end</code> по категориям и счетам
+
+<code>график begin end</code> - то же самое картинкой
+
+Несколько команд добавления, удаления и операций можно отправить одним сообщением, каждую на своей строке
+
+Историю операций можно загрузить CSV файлом со строками <code>day,amount,category,account</code>, где <code>day</code> в формате <code>YYYY-MM-DD</code>. Недостающие категории и счета будут созданы
+
+<code>экспорт</code> - присылает все операции сжатым CSV файлом в том же формате
 """
 
+BUSY = """Слишком много сообщений сразу, я не успеваю их обработать😵
+Подожди немного и отправь последние еще раз"""
+
 REGISTER_REQUIRED = """Сначала тебе необходимо написать /start!🤬"""
 
 UNKNOWN_COMMAND = """К сожалению, я не понял, что ты имеешь в виду🙄
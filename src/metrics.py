@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+PREFIX = "financebot_"
+SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+ROWS = (0, 1, 10, 100, 1000, 10_000, 100_000)
+# MessageHandler entry points the dispatcher calls, DispatchTimer times them
+DISPATCHED = ("reply_message", "document_message")
+
+_rows = contextvars.ContextVar("rows", default=None)
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CountingCursor:
+    """Cursor proxy adding fetched and changed rows to the counter of the
+    instrumented method running in the current task."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def _count(self, rows):
+        counter = _rows.get()
+        if counter is not None:
+            counter[0] += rows
+
+    async def execute(self, *args):
+        await self._cur.execute(*args)
+        self._count(max(self._cur.rowcount, 0))
+        return self
+
+    async def executemany(self, *args):
+        await self._cur.executemany(*args)
+        self._count(max(self._cur.rowcount, 0))
+        return self
+
+    async def fetchone(self):
+        row = await self._cur.fetchone()
+        self._count(row is not None)
+        return row
+
+    async def fetchmany(self, *args):
+        rows = await self._cur.fetchmany(*args)
+        self._count(len(rows))
+        return rows
+
+    async def fetchall(self):
+        rows = await self._cur.fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class DispatchTimer(BaseMiddleware):
+    """Times every update through the aiogram dispatcher and counts the
+    ones in flight, for handlers that run in the dispatcher's tasks. The
+    ones mailbox workers run are timed by Metrics.timed_handler()."""
+
+    def __init__(self, metrics):
+        super().__init__()
+        self._metrics = metrics
+
+    async def on_pre_process_update(self, update, data):
+        self._metrics.in_flight += 1
+        data["metrics_started"] = time.perf_counter()
+
+    async def on_post_process_update(self, update, results, data):
+        self._metrics.in_flight -= 1
+        self._metrics.dispatched(time.perf_counter() - data["metrics_started"])
+
+
+class Metrics:
+    """In-process metrics served in the Prometheus text format.
+
+    instrument() swaps the coroutine methods of one object for timed
+    wrappers, so nothing is measured and nothing costs anything unless
+    metrics are on. Gauges are read from callbacks at scrape time, which
+    lets the existing stats() of the cache, commit scheduler and outbox
+    be exported as they are.
+    """
+    _tg = None
+    _runner = None
+    _lag_task = None
+
+    async def init(self, tg, host="127.0.0.1", port=9108, lag_interval=0.5):
+        self._tg = tg
+        self._host = host
+        self._port = port
+        self._lag_interval = lag_interval
+
+        self._histograms = {}
+        self._help = {}
+        self._gauges = []
+        self.in_flight = 0
+
+        self.gauge("handlers_in_flight", "Updates being handled right now",
+                lambda: self.in_flight)
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+            self._help[name] = (help, "histogram")
+        return histogram
+
+    def dispatched(self, seconds):
+        self.histogram("dispatch_seconds", "Update handling time, from the "
+                "dispatcher or the mailbox worker taking it to the handler's "
+                "return").observe(seconds)
+
+    def timed_handler(self, handler):
+        """handler counted in handlers_in_flight and timed into
+        dispatch_seconds while it runs, for a mailbox worker to call. The
+        dispatcher only queues the update then, and the time it waited
+        for a worker is in the mailboxes gauges."""
+        @functools.wraps(handler)
+        async def timed(message):
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                await handler(message)
+            finally:
+                self.in_flight -= 1
+                self.dispatched(time.perf_counter() - start)
+
+        return timed
+
+    def gauge(self, name, help, read):
+        """Exports read(), a number or a dict of names to numbers, each of
+        which becomes its own name_key gauge."""
+        self._gauges.append((name, help, read))
+
+    def instrument(self, obj, name, label, help, rows=False, skip=()):
+        """Times every public coroutine method of obj not in skip into the
+        name_seconds histogram labelled by method, and with rows the rows
+        it read or changed into name_rows."""
+        for method, function in inspect.getmembers(type(obj),
+                inspect.iscoroutinefunction):
+            if not method.startswith("_") and method not in skip:
+                setattr(obj, method, self._timed(getattr(obj, method),
+                        name, ((label, method),), help, rows))
+
+    def _timed(self, function, name, labels, help, rows):
+        seconds = self.histogram(f"{name}_seconds", help, labels)
+        counted = (self.histogram(f"{name}_rows", "Rows read or changed",
+                labels, ROWS) if rows else None)
+
+        @functools.wraps(function)
+        async def timed(*args, **kwargs):
+            token = _rows.set([0]) if rows else None
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                seconds.observe(time.perf_counter() - start)
+                if rows:
+                    count = _rows.get()[0]
+                    _rows.reset(token)
+                    counted.observe(count)
+                    outer = _rows.get()
+                    if outer is not None:
+                        outer[0] += count
+
+        return timed
+
+    def watch_loop(self):
+        self._lag_task = self._tg.create_task(self._watch_loop())
+
+    async def _watch_loop(self):
+        lag = self.histogram("loop_lag_seconds", "Event loop lag")
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self._lag_interval)
+            lag.observe(max(time.perf_counter() - start - self._lag_interval, 0.0))
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in self._histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+
+        for name, series in by_name.items():
+            help, kind = self._help[name]
+            lines.append(f"# HELP {PREFIX}{name} {help}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),),
+                                        histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{PREFIX}{name}_bucket"
+                                 f"{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count{format_labels(labels)} "
+                             f"{histogram.count}")
+
+        for name, help, read in self._gauges:
+            value = read()
+            values = value.items() if isinstance(value, dict) else [("", value)]
+            for key, number in values:
+                full = f"{PREFIX}{name}_{key}" if key else f"{PREFIX}{name}"
+                lines.append(f"# HELP {full} {help}")
+                lines.append(f"# TYPE {full} gauge")
+                lines.append(f"{full} {number}")
+
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain",
+                headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        """Serves /metrics, or logs why it cannot and lets the bot run on
+        without it, a port taken by another process is no reason to stop."""
+        try:
+            await web.TCPSite(self._runner, self._host, self._port).start()
+        except OSError:
+            log.exception("Serving metrics on %s:%d failed, running without them",
+                    self._host, self._port)
+            return
+        self.watch_loop()
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        await self._runner.cleanup()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
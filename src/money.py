@@ -0,0 +1,35 @@
+"""Amounts are integer kopecks everywhere past the edges of the bot.
+
+Text from users and CSV files is parsed straight to kopecks and only
+turned back into rubles when a message or an export is written, so the
+database stores and sums integers and no total ever needs rounding.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+MINOR_UNITS = 100
+# far below the 64-bit limit of SQLite, so sums of many cannot overflow
+MAX_AMOUNT = 10 ** 15
+
+
+def parse_amount(text):
+    """Kopecks of an amount such as "12", "-3,5" or "0.99", or None if the
+    text is not a number. Fractions of a kopeck round half to even."""
+    try:
+        value = Decimal(text.replace(",", "."))
+    except InvalidOperation:
+        return None
+    # checked before any arithmetic, "1e999999999" must not become an int
+    if not value.is_finite() or value.copy_abs() > MAX_AMOUNT // MINOR_UNITS:
+        return None
+    return int((value * MINOR_UNITS).to_integral_value(ROUND_HALF_EVEN))
+
+
+def is_amount(text):
+    return parse_amount(text) is not None
+
+
+def format_amount(minor):
+    """Rubles of an amount in kopecks, "12", "-3.50" or "0.99"."""
+    rubles, kopecks = divmod(abs(minor), MINOR_UNITS)
+    sign = "-" if minor < 0 else ""
+    return f"{sign}{rubles}.{kopecks:02}" if kopecks else f"{sign}{rubles}"
@@ -0,0 +1,328 @@
+import asyncio
+import heapq
+import io
+import logging
+import time
+from collections import deque
+
+from aiogram import types
+from aiogram.utils.exceptions import RetryAfter
+
+MESSAGE_LIMIT = 4096
+
+log = logging.getLogger(__name__)
+
+
+class Outgoing:
+    def __init__(self, chat_id, send, message=None, text="", kwargs=None,
+                 background=False):
+        self.chat_id = chat_id
+        self.send = send
+        self.message = message
+        self.text = text
+        self.kwargs = kwargs or {}
+        self.background = background
+        self.queued = time.perf_counter()
+
+    def mergeable(self, other, length):
+        return (self.message is not None and other.message is not None
+                and self.kwargs == other.kwargs
+                and length + 2 + len(other.text) <= MESSAGE_LIMIT)
+
+
+class Outbox:
+    """Queue all outgoing messages go through on their way to Telegram.
+
+    Sends are paced by a global token bucket of rate messages per second
+    and at most one message per chat every chat_interval seconds. At most
+    max_queue messages wait at once, further handlers block in reply()
+    until there is room. A 429 response puts its messages back at the
+    head of their chat's queue for retry_after seconds. With merge on,
+    replies waiting for the same chat are joined into one message.
+
+    Messages nobody waits for, such as digests, go through send_background()
+    into a separate queue of at most max_background. They only take tokens
+    while no reply is due and more than reserve tokens are left, so replies
+    keep a burst of reserve messages at hand and digests get whatever rate
+    the replies leave over.
+    """
+    _tg = None
+    _bot = None
+    _task = None
+
+    async def init(self, tg, bot, rate=30, chat_interval=1.0, max_queue=1000,
+                   merge=False, reserve=5, max_background=100):
+        self._tg = tg
+        self._bot = bot
+        self._rate = rate
+        self._chat_interval = chat_interval
+        self._merge = merge
+        self._reserve = max(0, min(reserve, rate - 1))
+
+        self._queues = {}
+        self._ready = []
+        self._next = {}
+        self._order = 0
+        self._space = asyncio.Semaphore(max_queue)
+        self._background = deque()
+        self._background_space = asyncio.Semaphore(max_background)
+        self._background_empty = asyncio.Event()
+        self._background_empty.set()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._sending = set()
+
+        self._tokens = rate
+        self._refilled = time.monotonic()
+
+        self.depth = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.merged = 0
+        self.retries = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.background_depth = 0
+        self.background_sent = 0
+
+        self._task = tg.create_task(self._run())
+
+    async def reply(self, message, text, **kwargs):
+        await self._put(Outgoing(message.chat.id, None, message, text, kwargs))
+
+    async def reply_status(self, message, text, **kwargs):
+        """Sends a reply meant to be edited later and returns its message_id."""
+        result = await self.request(message.chat.id, lambda: self._bot.send_message(
+                message.chat.id, text, reply_to_message_id=message.message_id,
+                **kwargs))
+        return result.message_id
+
+    async def reply_document(self, message, path, name, **kwargs):
+        """Sends the file at path as a document and waits until it is uploaded."""
+        await self.request(message.chat.id, lambda: self._bot.send_document(
+                message.chat.id, types.InputFile(path, filename=name),
+                reply_to_message_id=message.message_id, **kwargs))
+
+    async def edit(self, chat_id, message_id, text, **kwargs):
+        await self.send(chat_id, lambda: self._bot.edit_message_text(text, chat_id,
+                message_id, **kwargs))
+
+    async def reply_photo(self, message, photo, **kwargs):
+        """Sends PNG bytes as a photo and waits until it is uploaded."""
+        await self.request(message.chat.id, lambda: self._bot.send_photo(
+                message.chat.id, types.InputFile(io.BytesIO(photo), filename="chart.png"),
+                reply_to_message_id=message.message_id, **kwargs))
+
+    async def send(self, chat_id, send):
+        """Queues a coroutine function making any other Bot API call."""
+        await self._put(Outgoing(chat_id, send))
+
+    async def send_background(self, chat_id, text, **kwargs):
+        """Queues a message to a chat at the lowest priority, waits while
+        max_background of them are queued already."""
+        await self._background_space.acquire()
+        self.background_depth += 1
+        self._background_empty.clear()
+        self._background.append(Outgoing(chat_id,
+                lambda: self._bot.send_message(chat_id, text, **kwargs),
+                background=True))
+        self._wakeup.set()
+
+    async def wait_background(self):
+        """Waits until every background message queued so far is sent."""
+        await self._background_empty.wait()
+
+    async def request(self, chat_id, call):
+        """Queues a Bot API call like send() and waits for its result."""
+        done = asyncio.get_running_loop().create_future()
+
+        async def send():
+            try:
+                result = await call()
+            except RetryAfter:
+                raise
+            except Exception as error:
+                done.set_exception(error)
+                raise
+            done.set_result(result)
+
+        await self.send(chat_id, send)
+        return await done
+
+    async def _put(self, item):
+        await self._space.acquire()
+        item.queued = time.perf_counter()
+
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self._enqueue(item.chat_id, [item])
+
+    def _enqueue(self, chat_id, items, front=False):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._schedule(chat_id, self._next.get(chat_id, 0.0))
+
+        if front:
+            queue.extendleft(reversed(items))
+        else:
+            queue.extend(items)
+        self._wakeup.set()
+
+    def _schedule(self, chat_id, when):
+        self._order += 1
+        heapq.heappush(self._ready, (when, self._order, chat_id))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._rate,
+                self._tokens + (now - self._refilled) * self._rate)
+        self._refilled = now
+
+    async def _take_token(self):
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def _send_background(self):
+        """Sends the next background message if the tokens above reserve
+        allow, otherwise returns how long until they do."""
+        self._refill()
+        missing = self._reserve + 1 - self._tokens
+        if missing > 0:
+            return missing / self._rate
+
+        item = self._background.popleft()
+        now = time.monotonic()
+        if item.chat_id in self._queues or self._next.get(item.chat_id, 0.0) > now:
+            # the chat is being answered, the message goes after the replies
+            self._enqueue(item.chat_id, [item])
+            return 0.0
+
+        self._tokens -= 1
+        self._next[item.chat_id] = now + self._chat_interval
+        task = self._tg.create_task(self._send(item.chat_id, [item]))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+        return 0.0
+
+    async def _run(self):
+        while not self._closing or self._ready or self._background:
+            delay = None
+            if self._ready:
+                when, _, chat_id = self._ready[0]
+                later = self._next.get(chat_id, 0.0)
+                if when < later:
+                    heapq.heappop(self._ready)
+                    self._schedule(chat_id, later)
+                    continue
+                delay = when - time.monotonic()
+
+            if (delay is None or delay > 0) and self._background:
+                wait = self._send_background()
+                if not wait:
+                    continue
+                delay = wait if delay is None else min(delay, wait)
+
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            await self._take_token()
+            when, _, chat_id = self._ready[0]
+            if when < self._next.get(chat_id, 0.0) or when > time.monotonic():
+                # the head changed while waiting for the token, start over
+                self._tokens += 1
+                continue
+            heapq.heappop(self._ready)
+
+            queue = self._queues[chat_id]
+            items = [queue.popleft()]
+            while (self._merge and queue
+                    and items[0].mergeable(queue[0], sum(len(item.text) for item in items))):
+                items.append(queue.popleft())
+
+            now = time.monotonic()
+            self._next[chat_id] = now + self._chat_interval
+            if queue:
+                self._schedule(chat_id, self._next[chat_id])
+            else:
+                del self._queues[chat_id]
+            if len(self._next) > 4 * len(self._queues) + 1024:
+                self._next = {chat: moment for chat, moment in self._next.items()
+                        if moment > now}
+
+            task = self._tg.create_task(self._send(chat_id, items))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id, items):
+        first = items[0]
+        try:
+            if first.send is not None:
+                await first.send()
+            else:
+                await self._bot.send_message(chat_id,
+                        "\n\n".join(item.text for item in items),
+                        reply_to_message_id=first.message.message_id, **first.kwargs)
+        except RetryAfter as error:
+            self.retries += 1
+            self._next[chat_id] = time.monotonic() + error.timeout
+            self._enqueue(chat_id, items, front=True)
+            return
+        except Exception:
+            self.errors += 1
+            log.exception("Sending to chat %s failed", chat_id)
+
+        if first.background:
+            self._background_space.release()
+            self.background_depth -= 1
+            self.background_sent += 1
+            if not self.background_depth:
+                self._background_empty.set()
+            return
+
+        now = time.perf_counter()
+        for item in items:
+            latency = now - item.queued
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._space.release()
+        self.depth -= len(items)
+        self.sent += 1
+        self.merged += len(items) - 1
+
+    async def close(self):
+        self._closing = True
+        while True:
+            self._wakeup.set()
+            await self._task
+            if self._sending:
+                await asyncio.gather(*list(self._sending))
+            if not self._ready and not self._background:
+                break
+            self._task = self._tg.create_task(self._run())
+
+    def stats(self):
+        delivered = self.sent + self.merged
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "merged": self.merged,
+            "retries": self.retries,
+            "errors": self.errors,
+            "mean_latency_ms": (self.latency / delivered * 1000
+                    if delivered else 0.0),
+            "max_latency_ms": self.max_latency * 1000,
+            "background_depth": self.background_depth,
+            "background_sent": self.background_sent,
+        }
@@ -0,0 +1,203 @@
+import asyncio
+import contextvars
+import os
+import zlib
+from contextlib import asynccontextmanager
+
+import aiosqlite as sq
+
+# pools whose writer the running task holds, see ConnectionPool.hold()
+HOLDING = contextvars.ContextVar("holding", default=frozenset())
+
+
+class ConnectionPool:
+    """One writer connection and a fixed set of read-only WAL connections.
+
+    Every aiosqlite connection runs on its own thread, so reads taken
+    from the pool run in parallel with each other and with the writer.
+    Readers only see committed data, read(fresh=True) falls back to the
+    writer while it holds uncommitted writes. wrap_cursor, if set, is
+    applied to every cursor handed out. on_write, if set, is awaited with
+    the cursor at the end of every write() block, so whatever it writes
+    goes into the same transaction as the block.
+
+    Writes of concurrent handlers share the writer's transaction until a
+    group commit. A write() block or hold() is one write sequence: the
+    sequences on a writer take turns, and committing() takes its turn
+    among them, so a commit never splits a sequence. A sequence that
+    raises or is cancelled is rolled back to where it started and leaves
+    the writes of the others alone. A handler that writes several times
+    and then commits holds the writer across the writes and commits after
+    the hold.
+    """
+    writer = None
+    wrap_cursor = None
+    on_write = None
+
+    async def init(self, path, readers=4):
+        self._readers = []
+        self._idle = asyncio.Queue()
+        self._sequence = asyncio.Lock()
+
+        # IMMEDIATE takes the write lock at BEGIN, where busy_timeout applies,
+        # instead of upgrading a read snapshot another process may have staled
+        self.writer = await sq.connect(path, isolation_level="IMMEDIATE")
+        self.writer.row_factory = sq.Row
+        await self.writer.execute("""PRAGMA journal_mode = WAL""")
+        await self.writer.execute("""PRAGMA synchronous = FULL""")
+        # worker processes share the files, wait for each other's write locks
+        await self.writer.execute("""PRAGMA busy_timeout = 5000""")
+
+        if path == ":memory:":
+            readers = 0
+
+        for _ in range(readers):
+            reader = await sq.connect(f"file:{path}?mode=ro", uri=True)
+            await reader.execute("""PRAGMA busy_timeout = 5000""")
+            reader.row_factory = sq.Row
+            self._readers.append(reader)
+            self._idle.put_nowait(reader)
+
+    @asynccontextmanager
+    async def read(self, fresh=False):
+        if not self._readers or fresh and self.writer.in_transaction:
+            async with self._cursor() as cur:
+                yield cur
+            return
+
+        reader = await self._idle.get()
+        try:
+            async with reader.cursor() as cur:
+                yield cur if self.wrap_cursor is None else self.wrap_cursor(cur)
+        finally:
+            self._idle.put_nowait(reader)
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.hold(), self._cursor() as cur:
+            yield cur
+            if self.on_write is not None:
+                await self.on_write(cur)
+
+    @asynccontextmanager
+    async def hold(self):
+        """Keeps group commits and the write sequences of other tasks off the
+        writer until the block ends, and undoes the writes of the block if
+        it fails. Holds and write() blocks nest, committing inside one would
+        wait forever."""
+        held = HOLDING.get()
+        if self in held:
+            yield
+            return
+
+        async with self._sequence:
+            token = HOLDING.set(held | {self})
+            # the transaction may carry sequences of other handlers waiting
+            # for a group commit, the savepoint keeps them if this one fails;
+            # without one pending the transaction holds this sequence alone.
+            # A sequence that succeeds leaves its savepoint to the commit,
+            # which releases them all, ROLLBACK TO finds the newest one.
+            nested = self.writer.in_transaction
+            if nested:
+                await self.writer.execute("""SAVEPOINT write_sequence""")
+            try:
+                yield
+            except BaseException:
+                # an error SQLite rolled back on its own left nothing to undo
+                if nested and self.writer.in_transaction:
+                    await self.writer.execute("""ROLLBACK TO write_sequence""")
+                    await self.writer.execute("""RELEASE write_sequence""")
+                elif not nested:
+                    await self.writer.rollback()
+                raise
+            finally:
+                HOLDING.reset(token)
+
+    @asynccontextmanager
+    async def committing(self):
+        """Waits for the open write sequence to end and keeps new ones out
+        until the block ends, the commit goes there."""
+        async with self._sequence:
+            yield self.writer
+
+    @asynccontextmanager
+    async def _cursor(self):
+        async with self.writer.cursor() as cur:
+            yield cur if self.wrap_cursor is None else self.wrap_cursor(cur)
+
+    @property
+    def shards(self):
+        return [self]
+
+    @property
+    def writers(self):
+        return [self.writer]
+
+    def shard(self, user_id):
+        return self
+
+    async def close(self):
+        for reader in self._readers:
+            await reader.close()
+        await self.writer.close()
+
+
+def shard_of(user_id, count):
+    """Stable shard number of a user, the same in every process and run."""
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+def shard_paths(path, count):
+    """data.db stays data.db unsharded and becomes data.0.db, data.1.db, ..."""
+    if count == 1:
+        return [path]
+    root, extension = os.path.splitext(path)
+    return [f"{root}.{number}{extension}" for number in range(count)]
+
+
+class ShardedPool:
+    """ConnectionPools over several SQLite files with users spread across
+    them by shard_of(user_id).
+
+    Every file has its own writer, so commits to different shards are
+    fsynced in parallel. UsersData sends user-scoped calls to shard() and
+    fans admin operations out over shards, a plain ConnectionPool offers
+    the same three names as a single shard.
+    """
+    shards = None
+
+    async def init(self, paths, readers=4):
+        self.shards = []
+        for path in paths:
+            shard = ConnectionPool()
+            await shard.init(path, readers=readers)
+            self.shards.append(shard)
+
+    @property
+    def writers(self):
+        return [shard.writer for shard in self.shards]
+
+    @property
+    def wrap_cursor(self):
+        return self.shards[0].wrap_cursor
+
+    @wrap_cursor.setter
+    def wrap_cursor(self, wrap):
+        for shard in self.shards:
+            shard.wrap_cursor = wrap
+
+    @property
+    def on_write(self):
+        return self.shards[0].on_write
+
+    @on_write.setter
+    def on_write(self, hook):
+        for shard in self.shards:
+            shard.on_write = hook
+
+    def shard(self, user_id):
+        return self.shards[shard_of(user_id, len(self.shards))]
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
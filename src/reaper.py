@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from src.data_managers import REAP_CHUNK_ROWS
+
+# first and smallest chunk, the size adapts from there
+REAP_MIN_ROWS = 100
+
+log = logging.getLogger(__name__)
+
+
+class Reaper:
+    """Background removal of the transactions deleted categories and
+    accounts leave behind.
+
+    Deleting a name only tombstones it, so the handler's write is small.
+    This task then deletes the transactions in chunks, each committed
+    through the CommitScheduler, so other users' writes queue behind one
+    chunk at most rather than behind the whole history. Chunks are sized
+    to take about chunk_ms on the writer, at most chunk_rows, and each is
+    followed by a pause at least as long as it took, which leaves the
+    writer to everyone else at least half of the time. Tombstones live in
+    the database, so a restart picks up where the last run stopped.
+    wake() starts a pass at once, otherwise new tombstones are found
+    within idle_interval seconds.
+    """
+    _tg = None
+    _task = None
+
+    async def init(self, tg, data, commits, chunk_rows=REAP_CHUNK_ROWS, chunk_ms=5.0,
+                   pause=0.005, idle_interval=5.0):
+        self._tg = tg
+        self._data = data
+        self._commits = commits
+        self._max_rows = chunk_rows
+        self._rows = min(REAP_MIN_ROWS, chunk_rows)
+        self._budget = chunk_ms / 1000
+        self._pause = pause
+        self._idle_interval = idle_interval
+        self._wakeup = asyncio.Event()
+
+        self.rows = 0
+        self.tombstones = 0
+        self.chunks = 0
+        self.busy = False
+        self._chunk_time = 0.0
+        self._max_chunk_time = 0.0
+
+        self._task = tg.create_task(self._run())
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            try:
+                result = await self._data.reap(self._rows)
+                elapsed = time.perf_counter() - start
+                if result is not None:
+                    await self._commits.commit()
+            except Exception:
+                log.exception("Reaping failed")
+                result = None
+
+            if result is None:
+                self.busy = False
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._idle_interval)
+                except TimeoutError:
+                    pass
+                continue
+
+            rows, finished = result
+            self.busy = True
+            self.rows += rows
+            self.tombstones += finished
+            self.chunks += 1
+            self._chunk_time += elapsed
+            self._max_chunk_time = max(self._max_chunk_time, elapsed)
+
+            if rows == self._rows:
+                self._rows = max(REAP_MIN_ROWS, min(self._max_rows,
+                        int(self._rows * self._budget / max(elapsed, 1e-6))))
+            await asyncio.sleep(max(self._pause, elapsed))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "busy": int(self.busy),
+            "rows": self.rows,
+            "tombstones": self.tombstones,
+            "chunks": self.chunks,
+            "chunk_rows": self._rows,
+            "mean_chunk_ms": self._chunk_time / self.chunks * 1000 if self.chunks else 0.0,
+            "max_chunk_ms": self._max_chunk_time * 1000,
+        }
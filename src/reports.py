@@ -0,0 +1,105 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from src.money import MINOR_UNITS
+
+
+class Report:
+    def __init__(self, begin, end, total, categories, accounts, days):
+        self.begin = begin
+        self.end = end
+        self.total = total
+        self.categories = categories
+        self.accounts = accounts
+        self.days = days
+        self.chart = None
+
+    def weight(self):
+        return 1 + len(self.categories) + len(self.accounts) + len(self.days)
+
+
+def build_report(begin, end, rows):
+    """Aggregates (category, account, day, total) rows into per-category,
+    per-account and per-day sums, all in kopecks."""
+    import pandas as pd
+
+    frame = pd.DataFrame(rows, columns=["category", "account", "day", "total"])
+
+    def sums(column):
+        grouped = frame.groupby(column)["total"].sum()
+        if column != "day":
+            grouped = grouped.sort_values()
+        return [(name, int(amount)) for name, amount in grouped.items()]
+
+    return Report(begin, end, int(frame["total"].sum()), sums("category"),
+                  sums("account"), sums("day"))
+
+
+def render_chart(report):
+    """Draws a report as a PNG, runs in a worker process."""
+    import matplotlib
+    import pandas as pd
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    figure, (by_category, by_day) = plt.subplots(2, 1, figsize=(8, 9))
+
+    names = [name for name, _ in report.categories]
+    amounts = [amount / MINOR_UNITS for _, amount in report.categories]
+    by_category.barh(names, amounts,
+                     color=["tab:red" if amount < 0 else "tab:green" for amount in amounts])
+    by_category.set_title(f"{report.begin} — {report.end}")
+
+    days = pd.to_datetime([day for day, _ in report.days])
+    balance = pd.Series([amount for _, amount in report.days]).cumsum() / MINOR_UNITS
+    by_day.plot(days, balance)
+    by_day.axhline(0, color="grey", linewidth=0.5)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=100)
+    plt.close(figure)
+    return buffer.getvalue()
+
+
+class Reports:
+    """Breakdown reports of a user's daily totals over a range of days.
+
+    Rows come from one grouped query and are aggregated with pandas in a
+    thread. Charts are drawn with matplotlib in a pool of worker processes
+    so plotting never holds the event loop. pandas and matplotlib are only
+    imported with the first report, not at startup. Reports and their
+    charts are cached in the LookupCache under the user's data version.
+    """
+    _data = None
+    _executor = None
+
+    async def init(self, data, workers=2):
+        self._data = data
+        self._executor = ProcessPoolExecutor(workers,
+                mp_context=multiprocessing.get_context("spawn"))
+
+    async def get_report(self, user_id, begin, end):
+        cache = self._data.cache
+        report = cache.get_report(user_id, (begin, end))
+        if report is not None:
+            return report
+
+        version = cache.version(user_id)
+        rows = await self._data.get_daily_totals(user_id, begin, end)
+        report = await asyncio.to_thread(build_report, begin, end, rows)
+
+        cache.set_report(user_id, (begin, end), report, version)
+        return report
+
+    async def get_chart(self, report):
+        if report.chart is None:
+            report.chart = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, render_chart, report)
+        return report.chart
+
+    async def close(self):
+        await asyncio.to_thread(self._executor.shutdown)
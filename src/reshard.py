@@ -0,0 +1,117 @@
+"""Offline split of one SQLite database into SHARDS files by user.
+
+    python3 -m src.reshard data.db 4
+
+Stop the bot first. The source is migrated to the current schema, then
+every shard file is created next to it (data.0.db, data.1.db, ...) and
+gets the rows of the users shard_of() sends there, ids kept. Tables that
+belong to no user are copied whole into every shard. Row counts of every
+table are checked against the source before the tool reports success. The source itself is left untouched.
+"""
+import asyncio
+import os
+import sys
+
+from src.data_managers import UsersData
+from src.pool import ConnectionPool, shard_of, shard_paths
+
+OWNED = {
+    "users": "user_id",
+    "categories": "owner_id",
+    "accounts": "owner_id",
+    "account_balances": "owner_id",
+    "daily_totals": "owner_id",
+    "import_progress": "owner_id",
+}
+TABLES = list(OWNED) + ["transactions"]
+# every shard needs all of them: a digest run resumes past last_user in
+# each shard the users it covered went to, and a journaled update replayed
+# after the split is skipped only if the shard of its user knows it was
+# applied
+REPLICATED = ["digest_runs", "applied_updates"]
+
+
+async def count_rows(con, schema="main"):
+    counts = {}
+    for table in TABLES + REPLICATED:
+        async with con.execute(f"""SELECT count(*) FROM {schema}.{table}""") as cur:
+            counts[table] = (await cur.fetchone())[0]
+    return counts
+
+
+async def copy_shard(source, target, number, count):
+    pool = ConnectionPool()
+    await pool.init(target, readers=0)
+    try:
+        data = UsersData()
+        await data.init(pool)
+
+        con = pool.writer
+        await con.create_function("shard_of", 2, shard_of, deterministic=True)
+        await con.execute("""ATTACH DATABASE ? AS source""", (source,))
+
+        for table, owner in OWNED.items():
+            await con.execute(f"""INSERT INTO {table} SELECT * FROM source.{table}
+                    WHERE shard_of({owner}, ?) = ?""",
+                    (count, number))
+        await con.execute("""INSERT INTO transactions SELECT transactions.*
+                FROM source.transactions JOIN source.accounts
+                    ON transactions.account_id = accounts.account_id
+                WHERE shard_of(accounts.owner_id, ?) = ?""",
+                (count, number))
+        for table in REPLICATED:
+            await con.execute(f"""INSERT INTO {table} SELECT * FROM source.{table}""")
+        await con.commit()
+
+        await con.execute("""DETACH DATABASE source""")
+        return await count_rows(con)
+    finally:
+        await pool.close()
+
+
+async def reshard(source, count):
+    if not os.path.exists(source):
+        raise SystemExit(f"{source} does not exist")
+    targets = shard_paths(source, count)
+    for target in targets:
+        if os.path.exists(target):
+            raise SystemExit(f"{target} already exists")
+
+    pool = ConnectionPool()
+    await pool.init(source, readers=0)
+    try:
+        data = UsersData()
+        await data.init(pool)
+        await pool.writer.commit()
+        expected = await count_rows(pool.writer)
+
+        async with pool.writer.execute("""SELECT count(*) FROM transactions
+                WHERE account_id NOT IN (SELECT account_id FROM accounts)""") as cur:
+            orphans = (await cur.fetchone())[0]
+        expected["transactions"] -= orphans
+    finally:
+        await pool.close()
+
+    copied = dict.fromkeys(TABLES, 0)
+    for number, target in enumerate(targets):
+        counts = await copy_shard(source, target, number, count)
+        print(f"{target}: " + ", ".join(f"{counts[table]} {table}" for table in TABLES))
+        for table in TABLES:
+            copied[table] += counts[table]
+        for table in REPLICATED:
+            if counts[table] != expected[table]:
+                raise SystemExit(f"{target} has {counts[table]} of the "
+                                 f"{expected[table]} rows of {table}")
+
+    expected = {table: expected[table] for table in TABLES}
+    if copied != expected:
+        raise SystemExit(f"row counts differ, source {expected}, shards {copied}")
+    if orphans:
+        print(f"skipped {orphans} transactions of deleted accounts")
+    print(f"done, set SHARDS = {count}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or not sys.argv[2].isdigit() or int(sys.argv[2]) < 2:
+        raise SystemExit(__doc__.strip().splitlines()[2].strip())
+    asyncio.run(reshard(sys.argv[1], int(sys.argv[2])))
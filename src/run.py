@@ -1,52 +1,445 @@
 from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher import Dispatcher
-from aiogram.utils import executor
-from aiogram.types import InlineKeyboardMarkup
-from aiogram.types import InlineKeyboardButton
-from aiogram.types import ReplyKeyboardMarkup
-from aiogram.types import ReplyKeyboardRemove
-from aiogram.types import KeyboardButton
+from aiogram.dispatcher.middlewares import BaseMiddleware
 
-from datetime import datetime
-
-import aiosqlite as sq
 import asyncio
-import nest_asyncio
+import functools
+import logging
+import os
+import signal
+import time
 
 import src.config as config
 
+from src.backup import Backup
 from src.bot import MessageHandler
-from src.data_managers import UsersData
+from src.commit_scheduler import CommitScheduler
+from src.data_managers import APPLYING, UsersData
+from src.digests import Digests
+from src.journal import UpdateJournal
+from src.mailboxes import Mailboxes
+from src.metrics import DISPATCHED, CountingCursor, DispatchTimer, Metrics
+from src.outbox import Outbox
+from src.pool import ShardedPool, shard_paths
+from src.reaper import Reaper
+from src.reports import Reports
+from src.webhook import WebhookServer
+from src.workers import STOP, Supervisor, receive
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimer(BaseMiddleware):
+    """Logs how long after process start the first update was handled."""
+
+    def __init__(self, started):
+        super().__init__()
+        self._started = started
+        self._done = False
+
+    async def on_post_process_update(self, update, results, data):
+        if not self._done:
+            self._done = True
+            log.info("first update handled %.3f s after start",
+                    time.perf_counter() - self._started)
+
+
+def stop_on_signals():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+
+def make_bot():
+    api_server = getattr(config, "API_SERVER", "")
+    return Bot(token=config.TOKEN, server=(TelegramAPIServer.from_base(api_server)
+            if api_server else TELEGRAM_PRODUCTION))
+
+
+def db_paths():
+    return shard_paths(getattr(config, "DB_PATH", "data.db"), getattr(config, "SHARDS", 1))
+
+
+async def open_pool():
+    pool = ShardedPool()
+    await pool.init(db_paths(), readers=getattr(config, "DB_READERS", 4))
+    return pool
+
+
+async def open_journal(tg, data=None, commits=None):
+    journal = UpdateJournal()
+    await journal.init(tg, getattr(config, "JOURNAL_PATH", os.path.join(
+                os.path.dirname(getattr(config, "DB_PATH", "data.db")), "journal.db")),
+            data, commits)
+    return journal
+
+
+class Services:
+    """Storage, handlers and everything around them behind one dispatcher.
+
+    A single process runs one of these. In worker mode every worker runs
+    its own, sending at share-th of OUTBOX_RATE so that together they keep
+    to the Telegram limit, and serving metrics on metrics_port. Only one of
+    them runs the reaper, the digests and the backups.
+
+    With MAILBOX_WORKERS set, the handlers do not run in the dispatcher's
+    tasks but queue every message in its sender's mailbox, see
+    src.mailboxes. With JOURNAL on, updates the journal dispatches are
+    marked done when their handler returns, wherever it ran, and every
+    write records the update it was made for, see src.journal.
+    """
+    pool = None
+    data = None
+    reaper = None
+    digests = None
+    mailboxes = None
+    journal = None
+    backup = None
+    metrics = None
+
+    async def init(self, tg, tg_bot, dp, share=1, metrics_port=None, reap=True,
+                   digest=True, backup=True):
+        # mailbox workers start here and need the bot aiogram objects refer to
+        Bot.set_current(tg_bot)
+        Dispatcher.set_current(dp)
+
+        self.pool = await open_pool()
+
+        data = self.data = UsersData()
+        await data.init(self.pool)
+
+        commits = self.commits = CommitScheduler()
+        await commits.init(tg, self.pool,
+                max_delay=getattr(config, "COMMIT_MAX_DELAY", 0.01),
+                max_batch=getattr(config, "COMMIT_MAX_BATCH", 64))
+
+        outbox = self.outbox = Outbox()
+        await outbox.init(tg, tg_bot,
+                rate=getattr(config, "OUTBOX_RATE", 30) / share,
+                chat_interval=getattr(config, "OUTBOX_CHAT_INTERVAL", 1.0),
+                max_queue=getattr(config, "OUTBOX_MAX_QUEUE", 1000),
+                merge=getattr(config, "OUTBOX_MERGE", False),
+                reserve=getattr(config, "OUTBOX_RESERVE", 5) / share)
+
+        reports = self.reports = Reports()
+        await reports.init(data, workers=getattr(config, "REPORT_WORKERS", 2))
+
+        if reap:
+            reaper = self.reaper = Reaper()
+            await reaper.init(tg, data, commits,
+                    chunk_ms=getattr(config, "REAP_CHUNK_MS", 5.0))
+
+        kinds = getattr(config, "DIGESTS", ())
+        if digest and kinds:
+            digests = self.digests = Digests()
+            await digests.init(tg, data, commits, outbox, kinds=kinds,
+                    hour=getattr(config, "DIGEST_HOUR", 9))
+
+        interval = getattr(config, "BACKUP_INTERVAL", 0)
+        if backup and interval:
+            backup = self.backup = Backup()
+            await backup.init(tg, db_paths(), getattr(config, "BACKUP_DIR", "backups"),
+                    interval, keep=getattr(config, "BACKUP_KEEP", 3),
+                    pages=getattr(config, "BACKUP_PAGES", 1024),
+                    pause=getattr(config, "BACKUP_PAUSE", 0.01))
+
+        if getattr(config, "JOURNAL", True):
+            self.journal = await open_journal(tg, data, commits)
+            data.track_updates()
+
+        bot = MessageHandler()
+        await bot.init(tg, data, commits, outbox, reports, self.reaper, self.digests)
 
-nest_asyncio.apply()
+        if getattr(config, "MAILBOX_WORKERS", 64):
+            mailboxes = self.mailboxes = Mailboxes()
+            await mailboxes.init(tg, workers=getattr(config, "MAILBOX_WORKERS", 64),
+                    user_limit=getattr(config, "MAILBOX_USER_LIMIT", 20),
+                    limit=getattr(config, "MAILBOX_LIMIT", 1000),
+                    policy=getattr(config, "MAILBOX_POLICY", "busy"),
+                    on_busy=bot.busy_message)
 
+        if getattr(config, "METRICS", False):
+            metrics = self.metrics = Metrics()
+            await metrics.init(tg,
+                    host=getattr(config, "METRICS_HOST", "127.0.0.1"),
+                    port=(getattr(config, "METRICS_PORT", 9108) if metrics_port is None
+                          else metrics_port))
+            self.pool.wrap_cursor = CountingCursor
+            metrics.instrument(data, "query", "method", "UsersData call time",
+                    rows=True)
+            metrics.instrument(bot, "handler", "handler", "MessageHandler call time",
+                    skip=DISPATCHED)
+            metrics.instrument(commits, "commit", "method",
+                    "Group commit time (flush) and handler wait for it (commit)")
+            metrics.gauge("cache", "LookupCache statistics", data.cache.stats)
+            metrics.gauge("commits", "CommitScheduler statistics", commits.stats)
+            metrics.gauge("outbox", "Outbox statistics", outbox.stats)
+            if self.reaper is not None:
+                metrics.gauge("reaper", "Reaper progress", self.reaper.stats)
+            if self.digests is not None:
+                metrics.gauge("digests", "Last digest run", self.digests.stats)
+            if self.mailboxes is not None:
+                metrics.gauge("mailboxes", "Messages waiting in per-user mailboxes, "
+                        "their wait for a worker and the ones shed", self.mailboxes.stats)
+            if self.journal is not None:
+                metrics.gauge("journal", "Updates journaled, replayed after a restart "
+                        "and done", self.journal.stats)
+            if self.backup is not None:
+                metrics.gauge("backup", "Last backup", self.backup.stats)
+            if self.mailboxes is None:
+                dp.middleware.setup(DispatchTimer(metrics))
+            await metrics.start()
 
-async def main():
-    tg_bot = Bot(token=config.TOKEN)
+        @dp.message_handler(commands=["start"])
+        async def start_message(message: types.Message):
+            await self._handle(message, bot.start_message)
+
+        @dp.message_handler(commands=["recreate", "кускуфеу"])
+        async def recreate_message(message: types.Message):
+            await self._handle(message, bot.recreate_message)
+
+        @dp.message_handler(commands=["verify", "мукшан"])
+        async def verify_message(message: types.Message):
+            await self._handle(message, bot.verify_message)
+
+        @dp.message_handler(commands=["stats", "ыефеы"])
+        async def stats_message(message: types.Message):
+            await self._handle(message, bot.stats_message)
+
+        @dp.message_handler(commands=["help", "рудз"])
+        async def help_message(message: types.Message):
+            await self._handle(message, bot.help_message)
+
+        @dp.message_handler(content_types=[types.ContentType.DOCUMENT])
+        async def document_message(message: types.Message):
+            await self._handle(message, bot.document_message)
+
+        @dp.message_handler()
+        async def reply_message(message: types.Message):
+            await self._handle(message, bot.reply_message)
+
+    async def _handle(self, message, handler):
+        journal = self.journal
+        update_id = APPLYING.get()
+        if self.mailboxes is None:
+            await handler(message)
+            return
+
+        if self.metrics is not None:
+            handler = self.metrics.timed_handler(handler)
+        if journal is None or update_id is None:
+            self.mailboxes.submit(message, handler)
+        else:
+            # the mailbox worker runs it outside the dispatcher's context
+            async def apply(message):
+                token = APPLYING.set(update_id)
+                try:
+                    await handler(message)
+                finally:
+                    APPLYING.reset(token)
+                    journal.done(update_id)
+
+            journal.hold(update_id)
+            self.mailboxes.submit(message, apply,
+                    dropped=functools.partial(journal.done, update_id))
+
+    async def close(self):
+        try:
+            if self.mailboxes is not None:
+                await self.mailboxes.close()
+            if self.journal is not None:
+                await self.journal.close()
+            if self.reaper is not None:
+                await self.reaper.close()
+            if self.digests is not None:
+                await self.digests.close()
+            if self.backup is not None:
+                await self.backup.close()
+            await self.commits.close()
+            await self.outbox.close()
+            await self.reports.close()
+            if self.metrics is not None:
+                await self.metrics.close()
+        finally:
+            await self.pool.close()
+
+
+async def main(started=None):
+    """Runs the bot until SIGINT or SIGTERM. With started, the
+    time.perf_counter() taken when the process started, it logs when the
+    bot is ready and when the first update has been handled.
+
+    With WORKERS set this process only receives updates and hands each one
+    to the worker process its sender belongs to, see src.workers.
+
+    With JOURNAL on, updates are committed to the journal before Telegram
+    is told they arrived, and the ones a crash or a restart interrupted are
+    dispatched again first.
+    """
+    tg_bot = make_bot()
+    dp = Dispatcher(tg_bot)
+    stop = stop_on_signals()
+    if started is not None:
+        dp.middleware.setup(StartupTimer(started))
+
+    async with asyncio.TaskGroup() as tg:
+        workers = getattr(config, "WORKERS", 0)
+        metrics = None
+        journal = None
+        pending = []
+        dispatch = dp.updates_handler.notify
+        if workers:
+            # migrate once here rather than racing K workers at it
+            pool = await open_pool()
+            try:
+                data = UsersData()
+                await data.init(pool)
+                for writer in pool.writers:
+                    await writer.commit()
+                if getattr(config, "JOURNAL", True):
+                    # the workers mark the updates done, this process journals them
+                    journal = await open_journal(tg)
+                    pending = await journal.resumable(data)
+            finally:
+                await pool.close()
+
+            service = Supervisor()
+            await service.init(tg, workers, config)
+            dp.updates_handler.unregister(dp.process_update)
+            dp.updates_handler.register(service.route)
+
+            if getattr(config, "METRICS", False):
+                metrics = Metrics()
+                await metrics.init(tg,
+                        host=getattr(config, "METRICS_HOST", "127.0.0.1"),
+                        port=getattr(config, "METRICS_PORT", 9108))
+                metrics.gauge("workers", "Worker processes and the updates routed "
+                        "to them", service.stats)
+                if journal is not None:
+                    metrics.gauge("journal", "Updates journaled and replayed after "
+                            "a restart", journal.stats)
+                await metrics.start()
+        else:
+            service = Services()
+            await service.init(tg, tg_bot, dp)
+            journal = service.journal
+            if journal is not None:
+                pending = await journal.resumable(service.data)
+                dispatch = functools.partial(journal.process, dp)
+
+        try:
+            if pending:
+                log.info("replaying %d journaled updates", len(pending))
+            for raw in pending:
+                await dispatch(types.Update(**raw))
+
+            if getattr(config, "MODE", "polling") == "webhook":
+                server = WebhookServer()
+                await server.init(tg, dp, journal=journal, dispatch=dispatch,
+                        secret=getattr(config, "WEBHOOK_SECRET", ""),
+                        host=getattr(config, "WEBHOOK_HOST", "127.0.0.1"),
+                        port=getattr(config, "WEBHOOK_PORT", 8080),
+                        path=getattr(config, "WEBHOOK_PATH", "/webhook"))
+                await server.start(url=getattr(config, "WEBHOOK_URL", ""))
+                if started is not None:
+                    log.info("webhook ready %.3f s after start",
+                            time.perf_counter() - started)
+
+                await stop.wait()
+                await server.close()
+            elif journal is not None:
+                polling = tg.create_task(journal.poll(tg_bot, dispatch,
+                        ordered=workers or service.mailboxes is not None))
+                if started is not None:
+                    log.info("polling ready %.3f s after start",
+                            time.perf_counter() - started)
+
+                await stop.wait()
+                polling.cancel()
+            else:
+                await dp.skip_updates()
+                polling = tg.create_task(dp.start_polling())
+                if started is not None:
+                    log.info("polling ready %.3f s after start",
+                            time.perf_counter() - started)
+
+                await stop.wait()
+                dp.stop_polling()
+                polling.cancel()
+                await dp.wait_closed()
+        finally:
+            await service.close()
+            if workers and journal is not None:
+                await journal.close()
+            if metrics is not None:
+                await metrics.close()
+
+    session = await tg_bot.get_session()
+    await session.close()
+
+
+async def work(number, count, connection, generation):
+    """Worker process number of count: handles the updates the ingest
+    process sends over connection until it sends STOP, then finishes the ones in
+    flight and flushes commits and replies before returning.
+
+    generation is shared by all workers and bumped by whichever of them
+    recreates the tables, so the others drop their cached lookups too.
+    """
+    tg_bot = make_bot()
     dp = Dispatcher(tg_bot)
+    Bot.set_current(tg_bot)
+    Dispatcher.set_current(dp)
 
     async with asyncio.TaskGroup() as tg:
-        async with sq.connect("data.db") as con:
-            data = UsersData()
-            await data.init(con)
+        services = Services()
+        await services.init(tg, tg_bot, dp, share=count,
+                metrics_port=getattr(config, "METRICS_PORT", 9108) + 1 + number,
+                reap=number == 0, digest=number == 0, backup=number == 0)
+
+        delete_all = services.data.delete_all
+
+        async def delete_everywhere():
+            await delete_all()
+            with generation.get_lock():
+                generation.value += 1
 
-            bot = MessageHandler()
-            await bot.init(tg, data, con)
+        services.data.delete_all = delete_everywhere
+        seen = generation.value
 
-            @dp.message_handler(commands=["start"])
-            async def start_message(message: types.Message):
-                await bot.start_message(message)
+        async def process(update):
+            if services.journal is not None:
+                await services.journal.process(dp, update)
+                return
+            try:
+                await dp.updates_handler.notify(update)
+            except Exception:
+                log.exception("Update %s failed", update.update_id)
 
-            @dp.message_handler(commands=["recreate", "кускуфеу"])
-            async def recreate_message(message: types.Message):
-                await bot.recreate_message(message)
+        in_flight = set()
+        running = True
+        try:
+            while running:
+                batch = await asyncio.to_thread(receive, connection)
+                if generation.value != seen:
+                    seen = generation.value
+                    services.data.cache.clear()
 
-            @dp.message_handler(commands=["help", "рудз"])
-            async def help_message(message: types.Message):
-                await bot.help_message(message)
+                for raw in batch:
+                    if raw is STOP:
+                        running = False
+                        break
+                    task = tg.create_task(process(types.Update(**raw)))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
 
-            @dp.message_handler()
-            async def reply_message(message: types.Message):
-                await bot.reply_message(message)
+            if in_flight:
+                await asyncio.wait(in_flight)
+        finally:
+            await services.close()
 
-            executor.start_polling(dp, skip_updates=True)
+    session = await tg_bot.get_session()
+    await session.close()
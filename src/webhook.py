@@ -0,0 +1,96 @@
+import hmac
+import logging
+
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+log = logging.getLogger(__name__)
+
+
+def is_update(raw):
+    """Whether raw is shaped like an Update object, the journal and the
+    dispatcher need a dict with an integer update_id."""
+    update_id = raw.get("update_id") if isinstance(raw, dict) else None
+    return isinstance(update_id, int) and not isinstance(update_id, bool)
+
+
+class WebhookServer:
+    """Local aiohttp server that feeds POSTed updates into the dispatcher.
+
+    The body is either one Update object, as Telegram sends it, or a JSON
+    array of them, which lets a load generator deliver batches. Anything
+    else is answered 400 before any of it is journaled. With a
+    journal the updates are committed to it before the answer, so Telegram
+    only forgets them once they survive a crash, and dispatch, if given,
+    is awaited with each new one instead of the dispatcher's handlers.
+    """
+    _tg = None
+    _dp = None
+    _runner = None
+
+    async def init(self, tg, dp, journal=None, dispatch=None, secret="",
+                   host="127.0.0.1", port=8080, path="/webhook"):
+        self._tg = tg
+        self._dp = dp
+        self._journal = journal
+        self._dispatch = dispatch or dp.updates_handler.notify
+        self._secret = secret
+        self._host = host
+        self._port = port
+
+        self.received = 0
+        self.rejected = 0
+        self.malformed = 0
+
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, "")
+        if self._secret and not hmac.compare_digest(token, self._secret):
+            self.rejected += 1
+            return web.Response(status=403)
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            self.malformed += 1
+            return web.Response(status=400)
+
+        updates = payload if isinstance(payload, list) else [payload]
+        if not all(is_update(raw) for raw in updates):
+            self.malformed += 1
+            return web.Response(status=400)
+        received = len(updates)
+        if self._journal is not None:
+            # a redelivered update is answered again but not handled twice
+            updates = await self._journal.append(updates)
+        Bot.set_current(self._dp.bot)
+        Dispatcher.set_current(self._dp)
+
+        for raw in updates:
+            self._tg.create_task(self._process(types.Update(**raw)))
+        self.received += received
+
+        return web.json_response({"ok": True, "accepted": received})
+
+    async def _process(self, update):
+        try:
+            await self._dispatch(update)
+        except Exception:
+            log.exception("Update %s failed", update.update_id)
+
+    async def start(self, url=""):
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+
+        if url:
+            await self._dp.bot.set_webhook(url, secret_token=self._secret or None)
+
+    async def close(self):
+        await self._runner.cleanup()
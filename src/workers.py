@@ -0,0 +1,169 @@
+"""Multi-process mode: one ingest process, WORKERS worker processes.
+
+The ingest process polls or serves the webhook as usual but, instead of
+handling updates, hands each one to the worker its sender belongs to. A
+user's updates therefore always reach the same worker, in the order they
+arrived, while different users are handled on different cores. Every
+worker runs the full bot (run.work) against the same database files;
+with WORKERS equal to SHARDS each worker is the only writer of its own
+shard, since both are picked by shard_of().
+"""
+import asyncio
+import collections
+import logging
+import multiprocessing
+import signal
+import sys
+import types
+
+from src.pool import shard_of
+
+# sent to a worker to make it finish and exit
+STOP = None
+# most updates pickled and sent to a worker in one go
+SEND_BATCH = 256
+
+log = logging.getLogger(__name__)
+
+
+def partition(raw, count):
+    """Worker number of an update: the one of its sender, or any for the
+    few update kinds that have none."""
+    for value in raw.values():
+        if isinstance(value, dict) and "from" in value:
+            return shard_of(value["from"]["id"], count)
+    return raw["update_id"] % count
+
+
+def receive(connection):
+    """Blocks for the next batch of updates from the ingest process. A
+    closed connection means the ingest process is gone, which stops the
+    worker as STOP would."""
+    try:
+        return connection.recv()
+    except EOFError:
+        return [STOP]
+
+
+def worker_main(number, count, connection, generation, settings):
+    """Process entry point. The config module is rebuilt from the ingest
+    process's settings, so workers run with exactly the same ones."""
+    config = types.ModuleType("src.config")
+    vars(config).update(settings)
+    sys.modules["src.config"] = config
+
+    # Ctrl+C reaches the whole process group, but only the ingest process
+    # decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from src import run
+    asyncio.run(run.work(number, count, connection, generation))
+
+
+class Supervisor:
+    """Starts the worker processes, routes updates to them and starts a
+    replacement for any that dies.
+
+    Routed updates wait in a backlog per worker that a sender task pickles
+    over a pipe in batches, so a slow worker never blocks the ingest event
+    loop. When a worker dies its backlog waits for the replacement; only
+    the updates already sent to it and not yet handled are lost.
+    """
+    _tg = None
+
+    async def init(self, tg, count, config, check_interval=1.0):
+        self._tg = tg
+        self._check_interval = check_interval
+        self._settings = {name: getattr(config, name) for name in dir(config)
+                          if name.isupper()}
+
+        self._context = multiprocessing.get_context("spawn")
+        self._generation = self._context.Value("i", 0)
+        self._backlogs = [collections.deque() for _ in range(count)]
+        self._wakeups = [asyncio.Event() for _ in range(count)]
+        self._processes = [None] * count
+        self._connections = [None] * count
+        self._closing = False
+
+        self.routed = 0
+        self.restarts = 0
+
+        for number in range(count):
+            self._start(number)
+        self._tasks = [tg.create_task(self._send(number)) for number in range(count)]
+        self._tasks.append(tg.create_task(self._watch()))
+
+    def _start(self, number):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=worker_main, name=f"worker-{number}",
+                args=(number, len(self._processes), receiver, self._generation,
+                      self._settings))
+        process.start()
+        # the worker holds the only read end now, so sends to a dead one fail
+        receiver.close()
+        self._processes[number] = process
+        self._connections[number] = sender
+
+    async def route(self, update):
+        raw = update.to_python()
+        number = partition(raw, len(self._processes))
+        self._backlogs[number].append(raw)
+        self._wakeups[number].set()
+        self.routed += 1
+
+    async def _send(self, number):
+        backlog = self._backlogs[number]
+        wakeup = self._wakeups[number]
+        while True:
+            if not backlog:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+
+            batch = [backlog.popleft() for _ in range(min(len(backlog), SEND_BATCH))]
+            try:
+                await asyncio.to_thread(self._connections[number].send, batch)
+            except OSError:
+                # dead worker, keep the batch for its replacement
+                backlog.extendleft(reversed(batch))
+                await asyncio.sleep(self._check_interval)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self._check_interval)
+            for number, process in enumerate(self._processes):
+                if not process.is_alive() and not self._closing:
+                    log.warning("worker %d exited with code %s, restarting",
+                            number, process.exitcode)
+                    self._connections[number].close()
+                    self._start(number)
+                    self.restarts += 1
+
+    async def close(self, timeout=30.0):
+        """Lets every worker finish its backlog and exit, and kills the ones
+        still running after timeout seconds."""
+        self._closing = True
+        for backlog, wakeup in zip(self._backlogs, self._wakeups):
+            backlog.append(STOP)
+            wakeup.set()
+
+        for number, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                log.warning("worker %d did not stop in %.0f s, killing it",
+                        number, timeout)
+                process.kill()
+                await asyncio.to_thread(process.join)
+
+        for task in self._tasks:
+            task.cancel()
+        for connection in self._connections:
+            connection.close()
+
+    def stats(self):
+        return {
+            "alive": sum(process.is_alive() for process in self._processes),
+            "routed": self.routed,
+            "restarts": self.restarts,
+            "queued": sum(len(backlog) for backlog in self._backlogs),
+        }